@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Stand-in for wpa_supplicant used to benchmark Companion without a radio.
+
+Accepts the wpa_supplicant command line used by Companion, serves the
+control interface socket from the configuration file and replays debug
+log scripts from bench/scripts on stdout for every WPS attempt.
+
+Environment:
+    FAKE_WPAS_SCENARIO    script replayed for every attempt: success, nack_m4, nack_m6,
+                          timeout, deauth, locked, a path to a script file, or 'pin'
+                          (default) to pick the outcome from FAKE_WPAS_PIN
+    FAKE_WPAS_PIN         the AP PIN for the 'pin' scenario [12345670]
+    FAKE_WPAS_TIME_SCALE  multiplier for the @sleep delays of the scripts [1.0]
+    FAKE_WPAS_LOCK_AFTER  lock the AP after that many wrong PINs in a row [0 — never];
+                          every BSSID is a separate AP with its own lock
+    FAKE_WPAS_LOCK_TIME   seconds the AP stays locked [60]
+    FAKE_WPAS_SSID        ESSID of the AP [FakeAP]
+    FAKE_WPAS_FREQ        channel frequency of the APs in MHz [2437]; the scan of every attempt
+                          takes its scripted time over the 13 2.4 GHz channels, proportionally
+                          less with SET freq_list, and misses APs outside the list
+    FAKE_WPAS_KEEP_ASSOC  1 if the AP keeps the station associated after a NACK, so that
+                          SET_NETWORK phase1 + REAUTHENTICATE restarts only EAP-WSC [0]
+
+Script format: one output line per line, with {iface}, {bssid}, {ssid}, {pin}
+and {pin_hex} placeholders. '@sleep <seconds>' lines pause the replay.
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'scripts')
+
+# Channels of the full scan the scripts were recorded with
+SCAN_CHANNELS = 13
+
+LEVELS = ('EXCESSIVE', 'MSGDUMP', 'DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+# Messages wpa_supplicant prints at INFO level; everything else is DEBUG or MSGDUMP
+INFO_MARKERS = ('CTRL-EVENT-', 'WPS-FAIL', 'WPS-SUCCESS', 'WPS-TIMEOUT', 'WPS-CRED-RECEIVED',
+                'Trying to authenticate with', 'Trying to associate with')
+MSGDUMP_MARKERS = ('RX EAPOL - hexdump', 'TX EAPOL - hexdump')
+
+def line_level(line):
+    if any(marker in line for marker in INFO_MARKERS):
+        return LEVELS.index('INFO')
+    if line.startswith(MSGDUMP_MARKERS):
+        return LEVELS.index('MSGDUMP')
+    return LEVELS.index('DEBUG')
+
+def load_script(name):
+    path = name if os.sep in name else os.path.join(SCRIPTS_DIR, name + '.txt')
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read().splitlines()
+
+class FakeAccessPoint:
+    """Decides how the AP answers a PIN"""
+    def __init__(self):
+        self.scenario = os.environ.get('FAKE_WPAS_SCENARIO', 'pin')
+        self.pin = os.environ.get('FAKE_WPAS_PIN', '12345670')
+        self.ssid = os.environ.get('FAKE_WPAS_SSID', 'FakeAP')
+        self.freq = int(os.environ.get('FAKE_WPAS_FREQ', '2437'))
+        self.lock_after = int(os.environ.get('FAKE_WPAS_LOCK_AFTER', '0'))
+        self.lock_time = float(os.environ.get('FAKE_WPAS_LOCK_TIME', '60'))
+        self.failures = 0
+        self.locked_until = 0
+
+    def answer(self, pin):
+        """Returns the script name for the attempt"""
+        if time.monotonic() < self.locked_until:
+            return 'locked'
+        if self.scenario != 'pin':
+            return self.scenario
+        if pin == self.pin:
+            self.failures = 0
+            return 'success'
+        self.failures += 1
+        if self.lock_after and self.failures >= self.lock_after:
+            self.failures = 0
+            self.locked_until = time.monotonic() + self.lock_time
+        if pin[:4] != self.pin[:4]:
+            return 'nack_m4'
+        return 'nack_m6'
+
+class FakeWpaSupplicant:
+    def __init__(self, argv):
+        self.iface = 'wlan0'
+        self.level = LEVELS.index('INFO')
+        conf = None
+        for arg in argv:
+            if arg == '-d':
+                self.level = LEVELS.index('DEBUG')
+            elif arg.startswith('-i'):
+                self.iface = arg[2:]
+            elif arg.startswith('-c'):
+                conf = arg[2:]
+        ctrl_dir = '/var/run/wpa_supplicant'
+        with open(conf, 'r') as file:
+            for line in file:
+                if line.startswith('ctrl_interface='):
+                    ctrl_dir = line.strip().split('=', 1)[1]
+        self.ctrl_path = os.path.join(ctrl_dir, self.iface)
+        self.aps = {}   # BSSID → FakeAccessPoint
+        self.time_scale = float(os.environ.get('FAKE_WPAS_TIME_SCALE', '1.0'))
+        self.out = sys.stdout.buffer
+        self.out_lock = threading.Lock()
+        self.monitors = set()
+        self.sock = None
+        self.replay = None
+        self.cancel = threading.Event()
+        self.keep_assoc = os.environ.get('FAKE_WPAS_KEEP_ASSOC', '0') == '1'
+        self.associated = None   # BSSID of the current association
+        self.phase1_pin = None
+        self.freq_list = None   # SET freq_list
+        self.seen = {}          # BSSID → time.monotonic() of the last scan that found it, for the BSS command
+
+    def write(self, line):
+        with self.out_lock:
+            self.out.write(line.encode() + b'\n')
+
+    def emit(self, line):
+        level = line_level(line)
+        if level >= self.level:
+            self.write(line)
+        if self.monitors and level >= LEVELS.index('INFO'):
+            self.send_event(line)
+
+    def run_script(self, lines, values, cancel):
+        for line in lines:
+            if cancel.is_set():
+                break
+            if line.startswith('@sleep '):
+                self.out.flush()
+                cancel.wait(float(line.split()[1]) * self.time_scale)
+                continue
+            line = line.format_map(values)
+            if '-> ASSOCIATED' in line:
+                self.associated = values['bssid'].upper()
+            elif 'CTRL-EVENT-DISCONNECTED' in line:
+                self.associated = None
+            self.emit(line)
+        self.out.flush()
+
+    def start_attempt(self, bssid, pin, reauth=False):
+        """@reauth — restart EAP on the current association instead of scanning and associating"""
+        self.stop_attempt()
+        ap = self.aps.setdefault(bssid.upper(), FakeAccessPoint())
+        script = ap.answer(pin) if pin is not None else 'success'
+        lines = load_script(script)
+        if not reauth:
+            self.associated = None
+            lines = self.scale_scan(lines)
+            if self.freq_list and ap.freq not in self.freq_list:
+                # The scan does not find the AP: nothing happens until the caller gives up
+                lines = lines[:next(i for i, line in enumerate(lines) if line.endswith('-> SCANNING')) + 2]
+            else:
+                self.seen[bssid.upper()] = time.monotonic()
+        else:
+            lines = lines[next(i for i, line in enumerate(lines) if line.startswith('EAPOL: txStart')):]
+        if self.keep_assoc and script.startswith('nack'):
+            lines = [line for line in lines if 'DISCONNECTED' not in line]
+        values = {
+            'iface': self.iface, 'bssid': bssid.lower(), 'ssid': ap.ssid,
+            'pin': pin or '', 'pin_hex': ' '.join('{:02x}'.format(c) for c in (pin or '').encode())
+        }
+        self.cancel = threading.Event()
+        self.replay = threading.Thread(target=self.run_script, args=(lines, values, self.cancel),
+                                       daemon=True)
+        self.replay.start()
+
+    def scale_scan(self, lines):
+        """Shortens the scan delay of the script to the channels of freq_list"""
+        channels = len(self.freq_list) if self.freq_list else SCAN_CHANNELS
+        lines = list(lines)
+        start = next((i for i, line in enumerate(lines) if line.endswith('-> SCANNING')), None)
+        if start is not None and start + 1 < len(lines) and lines[start + 1].startswith('@sleep '):
+            delay = float(lines[start + 1].split()[1]) * channels / SCAN_CHANNELS
+            lines[start + 1] = '@sleep {}'.format(delay)
+        return lines
+
+    def stop_attempt(self):
+        self.cancel.set()
+        if self.replay:
+            self.replay.join()
+            self.replay = None
+
+    def handle(self, command, address):
+        args = command.split()
+        if not args:
+            return 'FAIL'
+        cmd = args[0].upper()
+        if cmd == 'PING':
+            return 'PONG'
+        elif cmd == 'ATTACH':
+            self.monitors.add(address)
+            return 'OK'
+        elif cmd == 'DETACH':
+            self.monitors.discard(address)
+            return 'OK'
+        elif cmd == 'LOG_LEVEL':
+            if len(args) > 1:
+                if args[1].upper() not in LEVELS:
+                    return 'FAIL'
+                self.level = LEVELS.index(args[1].upper())
+                return 'OK'
+            return 'Current level: {}\nTimestamp: 0'.format(LEVELS[self.level])
+        elif cmd == 'WPS_REG' and len(args) >= 3:
+            self.start_attempt(args[1], args[2])
+            return 'OK'
+        elif cmd == 'WPS_PBC':
+            self.start_attempt(args[1] if len(args) > 1 else '00:00:00:00:00:00', None)
+            return 'OK'
+        elif cmd == 'WPS_CANCEL':
+            self.stop_attempt()
+            self.associated = None
+            return 'OK'
+        elif cmd == 'STATUS':
+            if self.associated:
+                return 'bssid={}\nid=0\nmode=station\nkey_mgmt=WPS\nwpa_state=ASSOCIATED\n'.format(
+                    self.associated.lower())
+            return 'wpa_state=DISCONNECTED\n'
+        elif cmd == 'SET_NETWORK' and len(args) >= 4 and args[2] == 'phase1':
+            self.phase1_pin = command.split('pin=', 1)[-1].split()[0].strip('"')
+            return 'OK'
+        elif cmd == 'SET' and len(args) >= 2 and args[1] == 'freq_list':
+            self.freq_list = [int(f) for f in args[2:]] or None
+            return 'OK'
+        elif cmd == 'BSS' and len(args) >= 2:
+            bssid = args[1].upper()
+            if bssid not in self.seen:
+                return ''
+            ap = self.aps[bssid]
+            return 'id=0\nbssid={}\nfreq={}\nage={}\nssid={}\n'.format(
+                bssid.lower(), ap.freq, int(time.monotonic() - self.seen[bssid]), ap.ssid)
+        elif cmd == 'REAUTHENTICATE':
+            # Like wpa_supplicant, refused once disconnected
+            if not self.associated:
+                return 'FAIL'
+            self.start_attempt(self.associated, self.phase1_pin, reauth=True)
+            return 'OK'
+        return 'UNKNOWN COMMAND'
+
+    def send_event(self, line):
+        """Sends an INFO level message to the attached monitors"""
+        message = '<3>' + line.split(': ', 1)[-1]
+        for monitor in list(self.monitors):
+            try:
+                self.sock.sendto(message.encode(), socket.MSG_DONTWAIT, monitor)
+            except OSError:
+                self.monitors.discard(monitor)
+
+    def serve(self):
+        self.sock = sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.ctrl_path)
+        self.write('Successfully initialized wpa_supplicant')
+        self.out.flush()
+        try:
+            while True:
+                data, address = sock.recvfrom(4096)
+                reply = self.handle(data.decode('utf-8', errors='replace'), address)
+                try:
+                    # Like wpa_supplicant, never block on a client that does not read its replies
+                    sock.sendto(reply.encode(), socket.MSG_DONTWAIT, address)
+                except OSError:
+                    pass
+        finally:
+            sock.close()
+            os.remove(self.ctrl_path)
+
+if __name__ == '__main__':
+    try:
+        FakeWpaSupplicant(sys.argv[1:]).serve()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
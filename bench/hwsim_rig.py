@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark rig with a real 802.11 stack and no hardware: mac80211_hwsim
+provides two radios, the AP radio is moved to a network namespace where
+hostapd runs with WPS enabled, and Companion attacks it from the station
+radio. The rig prints the median and 90th percentile duration of every
+attempt phase recorded by AttemptMetrics.
+
+Needs root, the mac80211_hwsim kernel module, hostapd, iw and iproute2.
+
+Usage: sudo python3 bench/hwsim_rig.py [single|bruteforce|pixie] [-n 10] [--ap-pin 12345670]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from src.wps_connection import Companion  # noqa: E402
+from src.metrics import AttemptMetrics  # noqa: E402
+from src.utils import ifaceUp, die  # noqa: E402
+
+NETNS = 'osup-hwsim'
+SSID = 'osup-hwsim'
+PSK = 'hwsim-password'
+
+HOSTAPD_CONF = '''interface={iface}
+driver=nl80211
+ctrl_interface={ctrl_dir}
+ssid={ssid}
+hw_mode=g
+channel={channel}
+wpa=2
+wpa_passphrase={psk}
+wpa_key_mgmt=WPA-PSK
+rsn_pairwise=CCMP
+eap_server=1
+wps_state=2
+ap_pin={ap_pin}
+ap_setup_locked={locked}
+device_name=hwsim AP
+manufacturer=Simulated
+model_name=hwsim
+model_number=1.0
+serial_number=0
+device_type=6-0050F204-1
+config_methods=label display push_button keypad
+'''
+
+def run(cmd, netns=None, check=True):
+    if netns:
+        cmd = ['ip', 'netns', 'exec', netns] + cmd
+    return subprocess.run(cmd, check=check, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          encoding='utf-8', errors='replace').stdout
+
+def hwsim_phys():
+    phys = []
+    for phy in os.listdir('/sys/class/ieee80211'):
+        driver = os.path.realpath('/sys/class/ieee80211/{}/device/driver'.format(phy))
+        if os.path.basename(driver) == 'mac80211_hwsim':
+            phys.append(phy)
+    return sorted(phys, key=lambda phy: int(phy[3:]))
+
+def phy_iface(phy, netns=None):
+    return run(['ls', '/sys/class/ieee80211/{}/device/net'.format(phy)], netns).split()[0]
+
+class HwsimRig:
+    """mac80211_hwsim radios with hostapd serving WPS on one of them"""
+    def __init__(self, ap_pin='12345670', locked=False, no_lockout=False, channel=6):
+        self.ap_pin = ap_pin
+        self.locked = locked
+        self.no_lockout = no_lockout
+        self.channel = channel
+        self.tempdir = tempfile.mkdtemp(prefix='osup-hwsim-')
+        self.hostapd = None
+        self.sta_iface = self.ap_iface = self.bssid = None
+        self.lockouts = 0
+
+    def __enter__(self):
+        try:
+            self.setup()
+        except BaseException:
+            self.teardown()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self.teardown()
+
+    def setup(self):
+        run(['modprobe', 'mac80211_hwsim', 'radios=2'])
+        sta_phy, ap_phy = hwsim_phys()[-2:]
+        self.sta_iface = phy_iface(sta_phy)
+        run(['ip', 'netns', 'add', NETNS])
+        run(['iw', 'phy', ap_phy, 'set', 'netns', 'name', NETNS])
+        self.ap_iface = phy_iface(ap_phy, NETNS)
+        with open(os.path.join('/sys/class/ieee80211', ap_phy, 'macaddress')) as file:
+            self.bssid = file.read().strip().upper()
+
+        conf = os.path.join(self.tempdir, 'hostapd.conf')
+        with open(conf, 'w') as file:
+            file.write(HOSTAPD_CONF.format(
+                iface=self.ap_iface, ctrl_dir=os.path.join(self.tempdir, 'hostapd'), ssid=SSID,
+                channel=self.channel, psk=PSK, ap_pin=self.ap_pin, locked=int(self.locked)))
+        self.hostapd = subprocess.Popen(['ip', 'netns', 'exec', NETNS, 'hostapd', conf],
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        encoding='utf-8', errors='replace')
+        for line in self.hostapd.stdout:
+            if 'AP-ENABLED' in line:
+                break
+        else:
+            raise RuntimeError('hostapd failed to start')
+        threading.Thread(target=self.__watch_hostapd, daemon=True).start()
+        ifaceUp(self.sta_iface)
+
+    def __watch_hostapd(self):
+        for line in self.hostapd.stdout:
+            if 'WPS-AP-SETUP-LOCKED' in line:
+                self.lockouts += 1
+                if self.no_lockout:
+                    # Setting the AP PIN again re-enables it right away
+                    run(['hostapd_cli', '-p', os.path.join(self.tempdir, 'hostapd'), '-i', self.ap_iface,
+                         'wps_ap_pin', 'set', self.ap_pin, '0'], NETNS, check=False)
+
+    def teardown(self):
+        if self.hostapd:
+            self.hostapd.terminate()
+            self.hostapd.wait()
+        run(['ip', 'netns', 'del', NETNS], check=False)
+        run(['modprobe', '-r', 'mac80211_hwsim'], check=False)
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+def report(metrics):
+    """Prints the median and 90th percentile time of every phase and the wpa_supplicant start time"""
+    for bssid, target in metrics.summary().items():
+        print('{:<16} {:>8} {:>12} {:>12}'.format('Phase', 'Count', 'Median, ms', 'P90, ms'))
+        for phase, h in target['phases'].items():
+            print('{:<16} {:>8} {:>12.1f} {:>12.1f}'.format(
+                phase, h['count'], h['percentiles']['50'] * 1000, h['percentiles']['90'] * 1000))
+        print('Outcomes: ' + ', '.join('{} {}'.format(k, v) for k, v in sorted(target['outcomes'].items())))
+    for interface, drivers in metrics.startupSummary().items():
+        for driver, h in drivers.items():
+            print('wpa_supplicant start on {} ({}): median {:.1f} ms over {}'.format(
+                interface, driver, h['percentiles']['50'] * 1000, h['count']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Companion benchmark against hostapd on mac80211_hwsim')
+    parser.add_argument('mode', nargs='?', default='single', choices=('single', 'bruteforce', 'pixie'))
+    parser.add_argument('-n', '--attempts', type=int, default=10, help='Attempts in the single and pixie modes')
+    parser.add_argument('--ap-pin', default='12345670', help='AP PIN configured in hostapd')
+    parser.add_argument('-p', '--pin', default='00000000', help='PIN tried in the single mode')
+    parser.add_argument('--start-pin', default='0000', help='First PIN half of the bruteforce mode')
+    parser.add_argument('--locked', action='store_true', help='Start hostapd with the AP setup locked')
+    parser.add_argument('--no-lockout', action='store_true',
+                        help='Re-enable the AP PIN as soon as hostapd locks it after failed attempts')
+    parser.add_argument('--channel', type=int, default=6)
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show Companion output')
+    args = parser.parse_args()
+
+    if os.getuid() != 0:
+        die('Run it as root')
+    for tool in ('hostapd', 'hostapd_cli', 'iw', 'ip', 'modprobe', 'wpa_supplicant'):
+        if not shutil.which(tool):
+            die('{} is not installed'.format(tool))
+
+    # Sessions and reports go to a throwaway home directory
+    os.environ['HOME'] = tempfile.mkdtemp(prefix='osup-bench-')
+    output = open(os.devnull, 'w') if not args.verbose else sys.stdout
+    with HwsimRig(args.ap_pin, args.locked, args.no_lockout, args.channel) as rig:
+        print('[*] AP {} on {} (netns {}), station {}'.format(rig.bssid, rig.ap_iface, NETNS, rig.sta_iface))
+        with contextlib.redirect_stdout(output):
+            metrics = AttemptMetrics(window=100000)
+            companion = Companion(rig.sta_iface, metrics=metrics)
+            try:
+                wall = time.monotonic()
+                if args.mode == 'bruteforce':
+                    companion.smart_bruteforce(rig.bssid, args.start_pin)
+                else:
+                    for _ in range(args.attempts):
+                        companion.single_connection(rig.bssid, args.pin, pixiemode=args.mode == 'pixie')
+                wall = time.monotonic() - wall
+            finally:
+                companion.cleanup()
+        attempts = sum(sum(target['outcomes'].values()) for target in metrics.summary().values())
+        print('[*] {} attempts in {:.1f} s, hostapd lockouts: {}'.format(attempts, wall, rig.lockouts))
+        report(metrics)
+
+if __name__ == '__main__':
+    main()
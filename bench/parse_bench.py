@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Measures the CPU time spent parsing wpa_supplicant output per WPS attempt.
+Recorded debug logs (one attempt per file) are piped through the real
+Companion output handler, without a radio or a running wpa_supplicant.
+
+Usage: python3 bench/parse_bench.py [-n 200] [--pixie] [bench/logs/*.log]
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from src.wps_connection import Companion, PixiewpsData, ConnectionStatus  # noqa: E402
+from src.wpas_reader import WpasOutputReader  # noqa: E402
+
+class ParserCompanion(Companion):
+    """Companion whose wpa_supplicant output is a recorded log replayed several times"""
+    def __init__(self, log, repeat):
+        self.interface = 'wlan0'
+        self.print_debug = False
+        self.pixie_creds = PixiewpsData()
+        self.connection_status = ConnectionStatus()
+        self._Companion__iface_prefix = b'wlan0: '
+        self._Companion__ascii_dump = None
+        cmd = ['sh', '-c', 'for i in $(seq {}); do cat "$0"; done'.format(repeat), log]
+        self.wpas = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        self.wpas_output = WpasOutputReader(self.wpas.stdout)
+
+    def cleanup(self):
+        self.wpas.wait()
+
+def bench_log(log, repeat, pixiemode):
+    companion = ParserCompanion(log, repeat)
+    handle = companion._Companion__handle_wpas
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.process_time()
+        while handle(pixiemode=pixiemode):
+            pass
+        elapsed = time.process_time() - start
+    return elapsed / repeat
+
+def main():
+    logs_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'logs')
+    parser = argparse.ArgumentParser(description='wpa_supplicant output parser benchmark')
+    parser.add_argument('logs', nargs='*', default=sorted(glob.glob(logs_dir + '/*.log')))
+    parser.add_argument('-n', '--repeat', type=int, default=200, help='Attempts replayed per log')
+    parser.add_argument('--pixie', action='store_true', help='Parse in Pixie Dust mode')
+    args = parser.parse_args()
+
+    print('{:<20} {:>8} {:>16}'.format('Log', 'Lines', 'CPU/attempt, ms'))
+    for log in args.logs:
+        with open(log, 'rb') as file:
+            lines = sum(1 for _ in file)
+        cpu = bench_log(log, args.repeat, args.pixie)
+        print('{:<20} {:>8} {:>16.3f}'.format(os.path.basename(log), lines, cpu * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end Companion benchmark against the replaying fake wpa_supplicant.
+Reports attempts/sec and Companion CPU time per attempt for
+single_connection (one row per scenario) and smart_bruteforce.
+
+Usage: python3 bench/run_bench.py [-n 20] [--time-scale 0] [--scenario nack_m4 …]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from src.wps_connection import Companion  # noqa: E402
+from src.wps import WPSpin  # noqa: E402
+
+FAKE_WPAS = os.path.join(BENCH_DIR, 'fake_wpa_supplicant.py')
+BSSID = '00:90:4C:C1:AC:21'
+
+class CountingCompanion(Companion):
+    """Companion counting the WPS attempts it starts"""
+    attempts = 0
+
+    def sendAndReceive(self, command, timeout=None):
+        reply = super().sendAndReceive(command, timeout)
+        if command.startswith(('WPS_REG', 'WPS_PBC')) or (command == 'REAUTHENTICATE' and reply.startswith('OK')):
+            self.attempts += 1
+        return reply
+
+def measure(env, run):
+    """Runs run(companion) against a fake wpa_supplicant configured with env"""
+    os.environ.update(env)
+    # Every run gets its own sessions, so no run is affected by the PINs rejected in an earlier one
+    os.environ['HOME'] = tempfile.mkdtemp(prefix='osup-bench-')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # Repeating a rejected PIN is the point of the single_connection runs
+        companion = CountingCompanion('wlan0', wpas_binary=FAKE_WPAS, remember_rejected=False)
+        try:
+            wall = time.monotonic()
+            cpu = time.process_time()
+            run(companion)
+            cpu = time.process_time() - cpu
+            wall = time.monotonic() - wall
+        finally:
+            companion.cleanup()
+    return companion.attempts, wall, cpu
+
+def report(name, attempts, wall, cpu):
+    print('{:<24} {:>8} {:>10.2f} {:>12.2f} {:>14.3f}'.format(
+        name, attempts, wall, attempts / wall, cpu / max(attempts, 1) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description='Companion benchmark with a fake wpa_supplicant')
+    parser.add_argument('-n', '--attempts', type=int, default=20,
+                        help='single_connection attempts per scenario')
+    parser.add_argument('--scenario', nargs='*', default=['success', 'nack_m4', 'nack_m6'],
+                        help='single_connection scenarios (scripts in bench/scripts)')
+    parser.add_argument('--bruteforce-pin', default='00200103',
+                        help='AP PIN for the smart_bruteforce run (first half = attempts in the first stage)')
+    parser.add_argument('--time-scale', type=float, default=0.0,
+                        help='Scale of the recorded radio delays; 0 measures the pure software overhead')
+    args = parser.parse_args()
+
+    os.environ['FAKE_WPAS_TIME_SCALE'] = str(args.time_scale)
+
+    print('{:<24} {:>8} {:>10} {:>12} {:>14}'.format(
+        'Run', 'Attempts', 'Wall, s', 'Attempts/s', 'CPU/attempt, ms'))
+    for scenario in args.scenario:
+        def run(companion):
+            for _ in range(args.attempts):
+                companion.single_connection(BSSID, '12345670')
+        report('single_connection/' + scenario, *measure({'FAKE_WPAS_SCENARIO': scenario}, run))
+
+    pin = args.bruteforce_pin
+    if WPSpin.checksum(int(pin[:7])) != int(pin[7]):
+        parser.error('--bruteforce-pin must have a valid checksum digit')
+    report('smart_bruteforce', *measure({'FAKE_WPAS_SCENARIO': 'pin', 'FAKE_WPAS_PIN': pin},
+                                        lambda companion: companion.smart_bruteforce(BSSID, '0000')))
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,16 @@ from .main import main
 from .network_address import NetworkAddress
 from .wps import WPSpin
 from .wifi_scanner import WiFiScanner
-from .wps_connection import Companion, PixiewpsData, ConnectionStatus, BruteforceStatus
+from .wps_connection import Companion, ConnectionStatus, BruteforceStatus
+from .metrics import AttemptMetrics
+from .pacing import AttemptPacer
+from .pixiewps import PixiewpsData, PixiewpsRunner, PixiewpsCapabilities, PixiewpsCache
+from .pixie_capture import PixieCapture, crack_captures
+from .pixie_native import PixieNativeEngine
+from .tried_pins import TriedPins
+from .scheduler import BruteforceScheduler
+from .coordinator import PartitionedBruteforce, DistributedBruteforce
+from .lease_store import SqliteLeaseStore, HttpLeaseStore
 
 __version__ = '0.0.2'
 __author__ = 'rofl0r, modded by drygdryg'
@@ -20,5 +29,19 @@ __all__ = [
     'Companion',
     'PixiewpsData',
     'ConnectionStatus',
-    'BruteforceStatus'
+    'BruteforceStatus',
+    'AttemptMetrics',
+    'AttemptPacer',
+    'PixiewpsRunner',
+    'PixiewpsCapabilities',
+    'PixiewpsCache',
+    'PixieCapture',
+    'crack_captures',
+    'PixieNativeEngine',
+    'TriedPins',
+    'BruteforceScheduler',
+    'PartitionedBruteforce',
+    'DistributedBruteforce',
+    'SqliteLeaseStore',
+    'HttpLeaseStore'
 ] 
\ No newline at end of file
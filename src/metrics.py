@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import bisect
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .utils import replaceFile
+
+# Upper bounds of the histogram buckets, in seconds
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PERCENTILES = (50, 90, 99)
+
+class PhaseHistogram:
+    """Durations of one attempt phase: cumulative bucket counts and a rolling window for percentiles"""
+    def __init__(self, window=200):
+        self.buckets = [0] * len(PHASE_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.window = collections.deque(maxlen=window)
+
+    def add(self, seconds):
+        i = bisect.bisect_left(PHASE_BUCKETS, seconds)
+        if i < len(self.buckets):
+            self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.window.append(seconds)
+
+    def percentile(self, p):
+        """Nearest-rank percentile of the rolling window; None if it is empty"""
+        if not self.window:
+            return None
+        values = sorted(self.window)
+        return values[max(0, -(-len(values) * p // 100) - 1)]
+
+    def cumulative(self):
+        """Prometheus 'le' bucket counts, including +Inf"""
+        counts = []
+        total = 0
+        for n in self.buckets:
+            total += n
+            counts.append(total)
+        counts.append(self.count)
+        return counts
+
+
+class AttemptMetrics:
+    """
+    Per-target timing of WPS attempt phases
+    @window — number of recent attempts the percentiles are computed over
+    @textfile — Prometheus textfile rewritten after every attempt
+    """
+    def __init__(self, window=200, textfile=None):
+        self.window = window
+        self.textfile = textfile
+        self.targets = {}    # BSSID → {phase: PhaseHistogram}
+        self.outcomes = {}   # BSSID → Counter of attempt outcomes
+        self.startup = {}    # (interface, driver) → PhaseHistogram of wpa_supplicant start times
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()   # Keeps an older snapshot from replacing a newer one
+        self.server = None
+
+    def registerAttempt(self, bssid, marks, end_time, outcome):
+        """
+        Adds a finished attempt
+        @marks — [(phase, monotonic time the phase started), …] in order
+        @end_time — monotonic time the attempt finished
+        @outcome — ConnectionStatus.status of the attempt
+        """
+        if not marks:
+            return
+        bssid = (bssid or '').upper()
+        with self.lock:
+            phases = self.targets.setdefault(bssid, {})
+            ends = [start for _, start in marks[1:]] + [end_time]
+            for (phase, start), end in zip(marks, ends):
+                phases.setdefault(phase, PhaseHistogram(self.window)).add(end - start)
+            phases.setdefault('attempt', PhaseHistogram(self.window)).add(end_time - marks[0][1])
+            self.outcomes.setdefault(bssid, collections.Counter())[outcome or 'none'] += 1
+        if self.textfile:
+            self.writeTextfile(self.textfile)
+
+    def registerStartup(self, interface, driver, seconds):
+        """Adds the time wpa_supplicant took to bring its control interface up"""
+        with self.lock:
+            self.startup.setdefault((interface, driver), PhaseHistogram(self.window)).add(seconds)
+        if self.textfile:
+            self.writeTextfile(self.textfile)
+
+    @staticmethod
+    def __histogramSummary(h):
+        return {
+            'count': h.count,
+            'sum': round(h.sum, 6),
+            'percentiles': {str(p): h.percentile(p) for p in PERCENTILES},
+            'buckets': dict(zip([str(le) for le in PHASE_BUCKETS] + ['+Inf'], h.cumulative()))
+        }
+
+    def startupSummary(self):
+        """Returns the wpa_supplicant start times as a JSON-serializable dict: interface → driver → histogram"""
+        with self.lock:
+            result = {}
+            for (interface, driver), h in self.startup.items():
+                result.setdefault(interface, {})[driver] = self.__histogramSummary(h)
+            return result
+
+    def summary(self):
+        """Returns the metrics as a JSON-serializable dict"""
+        with self.lock:
+            return {
+                bssid: {
+                    'outcomes': dict(self.outcomes.get(bssid, {})),
+                    'phases': {phase: self.__histogramSummary(h) for phase, h in phases.items()}
+                } for bssid, phases in self.targets.items()
+            }
+
+    def prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP osup_wps_phase_seconds Duration of WPS attempt phases',
+            '# TYPE osup_wps_phase_seconds histogram'
+        ]
+        quantiles = [
+            '# HELP osup_wps_phase_recent_seconds Percentiles of phase durations over recent attempts',
+            '# TYPE osup_wps_phase_recent_seconds gauge'
+        ]
+        outcomes = [
+            '# HELP osup_wps_attempts_total WPS attempts by outcome',
+            '# TYPE osup_wps_attempts_total counter'
+        ]
+        startup = [
+            '# HELP osup_wpas_startup_seconds Time wpa_supplicant takes to bring its control interface up',
+            '# TYPE osup_wpas_startup_seconds histogram'
+        ]
+        with self.lock:
+            for (interface, driver), h in sorted(self.startup.items()):
+                labels = 'interface="{}",driver="{}"'.format(interface, driver)
+                for le, n in zip([repr(le) for le in PHASE_BUCKETS] + ['+Inf'], h.cumulative()):
+                    startup.append('osup_wpas_startup_seconds_bucket{{{},le="{}"}} {}'.format(labels, le, n))
+                startup.append('osup_wpas_startup_seconds_sum{{{}}} {:.6f}'.format(labels, h.sum))
+                startup.append('osup_wpas_startup_seconds_count{{{}}} {}'.format(labels, h.count))
+            for bssid, phases in sorted(self.targets.items()):
+                for phase, h in phases.items():
+                    labels = 'bssid="{}",phase="{}"'.format(bssid, phase)
+                    for le, n in zip([repr(le) for le in PHASE_BUCKETS] + ['+Inf'], h.cumulative()):
+                        lines.append('osup_wps_phase_seconds_bucket{{{},le="{}"}} {}'.format(labels, le, n))
+                    lines.append('osup_wps_phase_seconds_sum{{{}}} {:.6f}'.format(labels, h.sum))
+                    lines.append('osup_wps_phase_seconds_count{{{}}} {}'.format(labels, h.count))
+                    for p in PERCENTILES:
+                        quantiles.append('osup_wps_phase_recent_seconds{{{},quantile="{}"}} {:.6f}'.format(
+                            labels, p / 100, h.percentile(p)))
+                for outcome, n in sorted(self.outcomes.get(bssid, {}).items()):
+                    outcomes.append('osup_wps_attempts_total{{bssid="{}",outcome="{}"}} {}'.format(
+                        bssid, outcome, n))
+        return '\n'.join(lines + quantiles + outcomes + startup) + '\n'
+
+    def writeTextfile(self, path):
+        """Atomically replaces the Prometheus textfile (node_exporter textfile collector format)"""
+        with self.write_lock:
+            replaceFile(path, self.prometheus())
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serves the metrics as JSON on http://host:port/ in the background, the wpa_supplicant
+        start times as JSON on /startup and both as Prometheus text on /metrics
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') == '/metrics':
+                    body = metrics.prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path.rstrip('/') == '/startup':
+                    body = json.dumps(metrics.startupSummary(), indent=2).encode()
+                    content_type = 'application/json'
+                else:
+                    body = json.dumps(metrics.summary(), indent=2).encode()
+                    content_type = 'application/json'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
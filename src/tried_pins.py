@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import struct
+import threading
+
+from .wps import WPSpin
+
+TRIED_MAGIC = b'OSTP'
+TRIED_VERSION = 1
+TRIED_SUFFIX = '.tried'
+
+# Magic, version, padding and the valid first half (big-endian, 0xFFFF while unknown)
+TRIED_HEADER = struct.Struct('>4sBxH')
+FIRST_HALF_UNKNOWN = 0xFFFF
+
+FIRST_HALVES = 10000
+SECOND_HALVES = 1000   # Without the checksum digit
+TRIED_SIZE = TRIED_HEADER.size + (FIRST_HALVES + SECOND_HALVES + 7) // 8
+
+
+class TriedPins:
+    """
+    Memory-mapped record of the PINs an AP has definitively rejected, kept across runs.
+    Bits 0–9999 are first halves NACKed after M4; bits 10000–10999 are second halves
+    NACKed after M6, which only count together with the valid first half stored in the header.
+    Updates land in the shared mapping at once, so they survive a crash of the process
+    and are seen by every process that has the same file open
+    @path — record file; None keeps the record in memory for this process only
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()   # Setting a bit rewrites its whole byte
+        if path is None:
+            self.map = mmap.mmap(-1, TRIED_SIZE)
+            TRIED_HEADER.pack_into(self.map, 0, TRIED_MAGIC, TRIED_VERSION, FIRST_HALF_UNKNOWN)
+            return
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, TRIED_HEADER.size, 0)
+            if len(header) < TRIED_HEADER.size or os.fstat(fd).st_size != TRIED_SIZE or \
+                    TRIED_HEADER.unpack(header)[:2] != (TRIED_MAGIC, TRIED_VERSION):
+                if header:
+                    print('[!] {} is not a tried-PIN record, starting a new one'.format(path))
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, TRIED_SIZE)
+                os.pwrite(fd, TRIED_HEADER.pack(TRIED_MAGIC, TRIED_VERSION, FIRST_HALF_UNKNOWN), 0)
+            self.map = mmap.mmap(fd, TRIED_SIZE)
+        finally:
+            # The mapping keeps its own reference to the file
+            os.close(fd)
+
+    @classmethod
+    def forBssid(cls, directory, bssid):
+        return cls(os.path.join(directory, bssid.replace(':', '').upper() + TRIED_SUFFIX))
+
+    @property
+    def firstHalf(self):
+        """The first half the AP has accepted, or None"""
+        first_half = TRIED_HEADER.unpack_from(self.map)[2]
+        return None if first_half == FIRST_HALF_UNKNOWN else '%04d' % first_half
+
+    def __bit(self, n):
+        return self.map[TRIED_HEADER.size + n // 8] >> (n % 8) & 1
+
+    def __setBit(self, n):
+        offset = TRIED_HEADER.size + n // 8
+        with self.lock:
+            self.map[offset] = self.map[offset] | 1 << (n % 8)
+
+    def isFirstHalfRejected(self, f_half):
+        """@f_half — 4-character string"""
+        first_half = self.firstHalf
+        if first_half is not None:
+            return f_half != first_half
+        return bool(self.__bit(int(f_half)))
+
+    def isSecondHalfRejected(self, f_half, s_half):
+        """@s_half — second half without the checksum digit, 3-character string"""
+        if self.isFirstHalfRejected(f_half):
+            return True
+        return f_half == self.firstHalf and bool(self.__bit(FIRST_HALVES + int(s_half)))
+
+    def isRejected(self, pin):
+        """Returns True if the AP has already rejected the PIN; only 8-digit PINs are tracked"""
+        if not _isFullPin(pin):
+            return False
+        if self.isFirstHalfRejected(pin[:4]):
+            return True
+        return _hasChecksum(pin) and self.isSecondHalfRejected(pin[:4], pin[4:7])
+
+    def record(self, pin, last_m_message):
+        """
+        Records a WSC NACK of the AP
+        @last_m_message — last M-message of the exchange: 4 rejects the first half,
+                          5 and above prove it valid, 6 rejects the second half
+        """
+        if not _isFullPin(pin):
+            return
+        if last_m_message == 4:
+            self.__setBit(int(pin[:4]))
+        elif last_m_message >= 5:
+            self.markFirstHalf(pin[:4])
+            # The second half of a PIN with a wrong checksum says nothing about the real one
+            if last_m_message == 6 and _hasChecksum(pin):
+                self.__setBit(FIRST_HALVES + int(pin[4:7]))
+
+    def markFirstHalf(self, f_half):
+        with self.lock:
+            TRIED_HEADER.pack_into(self.map, 0, TRIED_MAGIC, TRIED_VERSION, int(f_half))
+
+    def rejectedCount(self):
+        """Number of PINs of the 11000-attempt space ruled out so far"""
+        if self.firstHalf is not None:
+            second = sum(self.__bit(FIRST_HALVES + i) for i in range(SECOND_HALVES))
+            return FIRST_HALVES - 1 + second
+        return sum(bin(b).count('1') for b in self.map[TRIED_HEADER.size:TRIED_HEADER.size + FIRST_HALVES // 8])
+
+    def close(self):
+        if not self.map.closed:
+            self.map.flush()
+            self.map.close()
+
+
+def _isFullPin(pin):
+    return isinstance(pin, str) and len(pin) == 8 and pin.isdigit()
+
+def _hasChecksum(pin):
+    return WPSpin.checksum(int(pin[:7])) == int(pin[7])
@@ -1,9 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import csv
+import time
+import signal
+import ctypes
+import select
+import socket
+import binascii
+import tempfile
+import threading
+import contextlib
+import ipaddress
 import subprocess
 from pathlib import Path
+from datetime import datetime
+
+# Store of the found credentials
+REPORTS_DIR = os.path.dirname(os.path.realpath(__file__)) + '/../reports/'
 
 def ifaceUp(iface, down=False):
     """
@@ -17,26 +33,154 @@ def ifaceUp(iface, down=False):
     res = subprocess.run(cmd, shell=True, stdout=sys.stdout, stderr=sys.stdout)
     return res.returncode == 0
 
+# inotify(7) event masks
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+def _inotifyWatch(directory):
+    """Returns an inotify descriptor watching for new files in directory, or None if unavailable"""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CREATE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def waitForFile(path, timeout=None, cancel=None):
+    """
+    Wait until the file appears
+    @path — file to wait for
+    @timeout — maximum waiting time in seconds, None to wait forever
+    @cancel — callable checked periodically; waiting stops when it returns True
+    Sleeps on an inotify watch of the parent directory and falls back to a tight poll
+    Returns True if the file exists
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    fd = _inotifyWatch(os.path.dirname(path) or '.')
+    try:
+        # The watch is set up before the check, so a file created in between is not missed
+        while not os.path.exists(path):
+            if cancel and cancel():
+                return False
+            wait = 0.1 if fd is not None else 0.01
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            if fd is not None:
+                if select.select([fd], [], [], wait)[0]:
+                    os.read(fd, 4096)
+            else:
+                time.sleep(wait)
+        return True
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+def isLoopback(host):
+    """Whether the address only accepts connections from this machine"""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+@contextlib.contextmanager
+def sigtermInterrupts():
+    """
+    Within the block SIGTERM ends the run the same way as Ctrl+C, so the session is saved.
+    Only the main thread may handle signals: elsewhere nothing changes
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    previous = signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+def confirmRestore(what):
+    """Asks whether to restore the previous @what"""
+    return input('[?] Restore previous {}? [n/Y] '.format(what)).lower() != 'n'
+
+def restoreSession(filename, bssid):
+    """Returns the mask saved in the session file if there is one and the user restores it, otherwise None"""
+    try:
+        with open(filename, 'r') as file:
+            if confirmRestore('session for {}'.format(bssid)):
+                return file.readline().strip()
+    except FileNotFoundError:
+        pass
+    return None
+
+def replaceFile(path, data, fsync=False):
+    """
+    Atomically replaces the file with @data (str or bytes). Every call writes a temporary
+    file of its own, so concurrent writers never rename each other's away
+    @fsync — the data reaches the disk before the rename
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as file:
+            file.write(data)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
 def die(msg):
     """Print error message and exit with error code 1"""
     sys.stderr.write(msg + '\n')
     sys.exit(1)
 
-def recvuntil(pipe, what):
-    """Read from pipe until specific string is found"""
-    s = ''
-    while True:
-        inp = pipe.stdout.read(1)
-        if inp == '':
-            return s
-        s += inp
-        if what in s:
-            return s
+def saveReport(reports_dir, bssid, essid, wps_pin, wpa_psk):
+    """
+    Appends credentials to the report store (stored.txt and stored.csv)
+    Returns the path of the store without extension
+    """
+    if not os.path.exists(reports_dir):
+        os.makedirs(reports_dir)
+    filename = reports_dir + 'stored'
+    dateStr = datetime.now().strftime("%d.%m.%Y %H:%M")
+    with open(filename + '.txt', 'a', encoding='utf-8') as file:
+        file.write('{}\nBSSID: {}\nESSID: {}\nWPS PIN: {}\nWPA PSK: {}\n\n'.format(
+                    dateStr, bssid, essid, wps_pin, wpa_psk
+                )
+        )
+    writeTableHeader = not os.path.isfile(filename + '.csv')
+    with open(filename + '.csv', 'a', newline='', encoding='utf-8') as file:
+        csvWriter = csv.writer(file, delimiter=';', quoting=csv.QUOTE_ALL)
+        if writeTableHeader:
+            csvWriter.writerow(['Date', 'BSSID', 'ESSID', 'WPS PIN', 'WPA PSK'])
+        csvWriter.writerow([dateStr, bssid, essid, wps_pin, wpa_psk])
+    return filename
 
 def get_hex(line):
-    """Extract hex value from line containing format 'something:hex:value'"""
-    a = line.split(':', 3)
-    return a[2].replace(' ', '').upper()
+    """
+    Extract raw bytes from a wpa_supplicant hexdump line
+    @line — bytes line with format b'title - hexdump(len=n): xx xx …'
+    """
+    start = line.index(b'): ') + 3
+    return binascii.a2b_hex(line[start:].translate(None, b' \r\n'))
 
 def colored(text, color=None):
     """Returns colored text for terminal output"""
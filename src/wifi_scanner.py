@@ -10,11 +10,24 @@ from typing import Dict
 
 from .utils import colored, truncateStr
 
+def freq_to_channel(freq):
+    """Returns the channel number of a frequency in MHz, or None if it is not a Wi-Fi channel"""
+    if freq == 2484:
+        return 14
+    if 2412 <= freq <= 2472:
+        return (freq - 2407) // 5
+    if 5000 <= freq <= 5900:
+        return (freq - 5000) // 5
+    if 5955 <= freq <= 7115:
+        return (freq - 5950) // 5
+    return None
+
 class WiFiScanner:
     """WiFi network scanner with WPS detection"""
     def __init__(self, interface, vuln_list=None):
         self.interface = interface
         self.vuln_list = vuln_list
+        self.frequencies = {}   # BSSID → frequency in MHz, from the latest scan
 
         reports_fname = os.path.dirname(os.path.realpath(__file__)) + '/../reports/stored.csv'
         try:
@@ -33,8 +46,12 @@ class WiFiScanner:
         except FileNotFoundError:
             self.stored = []
 
-    def iw_scanner(self) -> Dict[int, dict]:
-        """Parsing iw scan results"""
+    @staticmethod
+    def parse_iw_scan(lines):
+        """
+        Parses 'iw dev <iface> scan' (or 'scan dump') output lines
+        Returns the list of networks, or None if iw reported an error
+        """
         def handle_network(line, result, networks):
             networks.append(
                     {
@@ -43,11 +60,18 @@ class WiFiScanner:
                         'WPS locked': False,
                         'Model': '',
                         'Model number': '',
-                        'Device name': ''
+                        'Device name': '',
+                        'Frequency': None,
+                        'Channel': None
                      }
                 )
             networks[-1]['BSSID'] = result.group(1).upper()
 
+        def handle_freq(line, result, networks):
+            # Newer iw prints fractional MHz (freq: 2437.0)
+            networks[-1]['Frequency'] = int(float(result.group(1)))
+            networks[-1]['Channel'] = freq_to_channel(networks[-1]['Frequency'])
+
         def handle_essid(line, result, networks):
             d = result.group(1)
             networks[-1]['ESSID'] = codecs.decode(d, 'unicode-escape').encode('latin1').decode('utf-8', errors='replace')
@@ -95,13 +119,10 @@ class WiFiScanner:
             d = result.group(1)
             networks[-1]['Device name'] = codecs.decode(d, 'unicode-escape').encode('latin1').decode('utf-8', errors='replace')
 
-        cmd = 'iw dev {} scan'.format(self.interface)
-        proc = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
-                              stderr=subprocess.STDOUT, encoding='utf-8', errors='replace')
-        lines = proc.stdout.splitlines()
         networks = []
         matchers = {
             re.compile(r'BSS (\S+)( )?\(on \w+\)'): handle_network,
+            re.compile(r'freq: (\d+(\.\d+)?)'): handle_freq,
             re.compile(r'SSID: (.*)'): handle_essid,
             re.compile(r'signal: ([+-]?([0-9]*[.])?[0-9]+) dBm'): handle_level,
             re.compile(r'(capability): (.+)'): handle_securityType,
@@ -117,12 +138,37 @@ class WiFiScanner:
         for line in lines:
             if line.startswith('command failed:'):
                 print('[!] Error:', line)
-                return False
+                return None
             line = line.strip('\t')
             for regexp, handler in matchers.items():
                 res = re.match(regexp, line)
                 if res:
                     handler(line, res, networks)
+        return networks
+
+    def iw_scan(self, dump=False, freqs=None):
+        """
+        Runs iw and parses its output
+        @dump — only read the networks cached by the kernel from the latest scans, without scanning
+        @freqs — frequencies in MHz to scan, all channels if None
+        Returns the list of networks, or None on error
+        """
+        cmd = 'iw dev {} scan{}'.format(self.interface, ' dump' if dump else '')
+        if freqs and not dump:
+            cmd += ' freq ' + ' '.join(str(f) for f in freqs)
+        proc = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, encoding='utf-8', errors='replace')
+        networks = self.parse_iw_scan(proc.stdout.splitlines())
+        for network in networks or ():
+            if network['Frequency']:
+                self.frequencies[network['BSSID']] = network['Frequency']
+        return networks
+
+    def iw_scanner(self) -> Dict[int, dict]:
+        """Parsing iw scan results"""
+        networks = self.iw_scan()
+        if networks is None:
+            return False
 
         # Filtering non-WPS networks
         networks = list(filter(lambda x: bool(x['WPS']), networks))
@@ -144,8 +190,8 @@ class WiFiScanner:
                 colored('Already stored', color='yellow')
             ))
         print('Networks list:')
-        print('{:<4} {:<18} {:<25} {:<8} {:<4} {:<27} {:<}'.format(
-            '#', 'BSSID', 'ESSID', 'Sec.', 'PWR', 'WSC device name', 'WSC model'))
+        print('{:<4} {:<18} {:<25} {:<8} {:<4} {:<3} {:<27} {:<}'.format(
+            '#', 'BSSID', 'ESSID', 'Sec.', 'PWR', 'Ch', 'WSC device name', 'WSC model'))
 
         network_list_items = list(network_list.items())
         for n, network in network_list_items:
@@ -153,9 +199,9 @@ class WiFiScanner:
             model = '{} {}'.format(network['Model'], network['Model number'])
             essid = truncateStr(network['ESSID'], 25)
             deviceName = truncateStr(network['Device name'], 27)
-            line = '{:<4} {:<18} {:<25} {:<8} {:<4} {:<27} {:<}'.format(
+            line = '{:<4} {:<18} {:<25} {:<8} {:<4} {:<3} {:<27} {:<}'.format(
                 number, network['BSSID'], essid,
-                network['Security type'], network['Level'],
+                network['Security type'], network['Level'], network['Channel'] or '',
                 deviceName, model
                 )
             if (network['BSSID'], network['ESSID']) in self.stored:
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import socket
+import threading
+
+# Unsolicited messages sent to ATTACHed clients start with '<level>'
+WPAS_EVENT = re.compile(rb'<\d+>')
+
+# Initial receive buffer; a connection grows its own as soon as a reply does not fit
+WPAS_REPLY_SIZE = 4096
+
+class WpasCtrlTimeout(Exception):
+    """wpa_supplicant did not answer a request before its deadline"""
+
+
+class WpasCtrlConnection:
+    """
+    One client socket of the control interface. It is bound to an abstract address
+    chosen by the kernel, so it leaves nothing on the filesystem, even after a crash,
+    and connected to wpa_supplicant, so datagrams of anyone else never arrive
+    """
+    def __init__(self, ctrl_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            # Binding to an empty address is Linux autobind: a unique abstract name
+            self.sock.bind('')
+            self.sock.connect(ctrl_path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.buffer_size = WPAS_REPLY_SIZE
+
+    def send(self, command):
+        self.sock.send(command.encode())
+
+    def request(self, command, deadline):
+        """Sends the command and returns its reply; raises WpasCtrlTimeout after @deadline (time.monotonic())"""
+        self.__drain()
+        self.send(command)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise WpasCtrlTimeout(command)
+            self.sock.settimeout(remaining)
+            try:
+                data = self.__receive()
+            except socket.timeout:
+                raise WpasCtrlTimeout(command) from None
+            if not WPAS_EVENT.match(data):
+                return data.decode('utf-8', errors='replace')
+
+    def __receive(self):
+        # The datagram is peeked at until the buffer holds it whole, then consumed
+        while True:
+            data, _, flags, _ = self.sock.recvmsg(self.buffer_size, 0, socket.MSG_PEEK)
+            if not flags & socket.MSG_TRUNC:
+                return self.sock.recv(self.buffer_size)
+            self.buffer_size *= 2
+
+    def __drain(self):
+        """Drops whatever arrived since the last request, so it cannot pass for the next reply"""
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.recv(self.buffer_size)
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+class WpasControl:
+    """
+    Client of the wpa_supplicant control interface, safe to share between threads.
+    Every request runs on a connection of its own, taken from a pool of idle ones.
+    wpa_supplicant answers in order and to the sender, so a connection that waits
+    for a single reply at a time cannot mistake anything else for it; one whose
+    request failed may still receive the late reply and is closed instead of reused
+    @timeout — default deadline of a request, in seconds
+    @pool_size — idle connections kept for reuse
+    """
+    def __init__(self, ctrl_path, timeout=5.0, pool_size=4):
+        self.ctrl_path = ctrl_path
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.idle = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def __acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return WpasCtrlConnection(self.ctrl_path)
+
+    def __release(self, connection):
+        with self.lock:
+            if not self.closed and len(self.idle) < self.pool_size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, command, timeout=None):
+        """
+        Returns the reply to the command
+        @timeout — seconds to wait for it instead of the default
+        Raises WpasCtrlTimeout, or OSError if wpa_supplicant is not there
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        connection = self.__acquire()
+        try:
+            reply = connection.request(command, deadline)
+        except BaseException:
+            connection.close()
+            raise
+        self.__release(connection)
+        return reply
+
+    def send(self, command):
+        """Sends the command without waiting for the reply"""
+        connection = self.__acquire()
+        try:
+            connection.send(command)
+        finally:
+            # The reply would be left in the socket: wpa_supplicant drops it once the socket is gone
+            connection.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
